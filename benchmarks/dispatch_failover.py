@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency and failures through the API when nodes misbehave: one
+node fails half its requests and the others now and then run a request 20x
+slower than usual.
+
+Every run retries failed dispatches on another node; the runs differ in
+whether the circuit breaker takes the failing node out of selection and
+whether slow requests are hedged onto a second node.
+
+Usage: python benchmarks/dispatch_failover.py [--requests 400] [--concurrency 16] [--tokens 32] [--redis-url URL]
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from harness import platform
+
+HEADERS = {"Authorization": "Bearer bench"}
+RUNS = (
+    ("retry", {"hedge_percentile": 0, "circuit_failures": 0}),
+    ("+breaker", {"hedge_percentile": 0}),
+    ("+hedging", {}),
+)
+
+
+async def run_requests(client: httpx.AsyncClient, requests: int, concurrency: int, tokens: int):
+    latencies = []
+    failed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal failed
+        # Distinct prompts, so the response cache doesn't answer any
+        body = {"model_id": "llama-70b", "prompt": f"Hello {i}", "max_tokens": tokens, "temperature": 0}
+        async with semaphore:
+            started = time.perf_counter()
+            task_id = (await client.post("/api/inference/generate", json=body, headers=HEADERS)).json()["task_id"]
+            while True:
+                status = (await client.get(f"/api/inference/status/{task_id}")).json()["status"]
+                if status in ("completed", "failed"):
+                    break
+                await asyncio.sleep(0.01)
+            latencies.append(time.perf_counter() - started)
+            failed += status == "failed"
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], failed
+
+
+async def run(args):
+    faults = [{"error_rate": 0.5, "seed": 0}] + [
+        {"stall_rate": 0.05, "stall_factor": 20, "seed": i} for i in range(1, args.nodes)
+    ]
+    print(f"{'run':>9} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}")
+    for name, options in RUNS:
+        async with platform(args.redis_url, nodes=args.nodes, seconds_per_token=args.seconds_per_token,
+                            node_faults=faults, worker_options=options) as (base_url, _):
+            async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+                # Warm-up fills the latency history hedging works from
+                await run_requests(client, 40, args.concurrency, args.tokens)
+                p50, p99, failed = await run_requests(client, args.requests, args.concurrency, args.tokens)
+        print(f"{name:>9} {p50 * 1000:>8.0f} {p99 * 1000:>8.0f} {failed:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--tokens", type=int, default=32)
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--seconds-per-token", type=float, default=0.01)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
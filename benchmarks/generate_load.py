@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Load test of POST /api/inference/generate on one API process: how many
+requests per second it accepts with the enqueue micro-batcher off and on,
+at a few connection pool sizes.
+
+No workers or nodes run, so every request ends queued and only the API's
+own path is measured: token counting, rate limit and enqueue. Rate limits
+and the queue limit are lifted for the run. Against a real Redis
+(--redis-url, which is flushed) it also reports Redis commands and round
+trips per request.
+
+Usage: python benchmarks/generate_load.py [--requests 5000] [--concurrency 128] [--redis-url URL]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from harness import platform
+
+import admission
+import main as api
+
+
+async def load(base_url: str, requests: int, concurrency: int):
+    latencies = []
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # aiohttp rather than httpx: httpx's pool bookkeeping costs more CPU
+    # than the endpoint under test at this concurrency
+    async with aiohttp.ClientSession(base_url, headers={"Authorization": "Bearer bench"},
+                                     connector=aiohttp.TCPConnector(limit=concurrency)) as client:
+        async def one(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                async with client.post("/api/inference/generate", json={
+                    "model_id": "llama-70b", "prompt": f"Request {i}: summarise the attached report",
+                    "max_tokens": 256, "temperature": 0.7
+                }) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], statuses
+
+
+async def redis_counters(client):
+    """(commands processed, socket reads) so far, or None on fakeredis
+
+    A pipeline arrives in one read however many commands it carries, so
+    reads approximate round trips.
+    """
+    try:
+        stats = await client.info("stats")
+    except Exception:
+        return None
+    return stats["total_commands_processed"], stats.get("total_reads_processed", 0)
+
+
+async def run(args):
+    # The tokenizer warnings repeat for every platform start
+    logging.getLogger("tokenizer_service").setLevel(logging.ERROR)
+    admission.USER_TOKENS_PER_SECOND = admission.USER_TOKEN_BURST = 1e12
+
+    print(f"{args.requests} requests at concurrency {args.concurrency}")
+    print(f"{'batcher':>8} {'pool':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'cmds/req':>9} {'reads/req':>10}")
+    for batch in (False, True):
+        for pool in args.pools:
+            api.REDIS_BATCH_ENABLED = batch
+            async with platform(args.redis_url, nodes=0, workers=0, max_connections=pool) as (base_url, _):
+                client = api.app.state.redis
+                await client.flushdb()
+                api.app.state.admission.limit = 2 ** 31
+                before = await redis_counters(client)
+                rate, p50, p99, statuses = await load(base_url, args.requests, args.concurrency)
+                after = await redis_counters(client)
+                accepted = statuses.get(202, 0)
+                if accepted != args.requests:
+                    print(f"  unexpected responses: {statuses}")
+                commands = reads = float("nan")
+                if before and after:
+                    commands = (after[0] - before[0]) / args.requests
+                    reads = (after[1] - before[1]) / args.requests
+                print(f"{str(batch):>8} {pool:>6} {rate:>8.0f} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} "
+                      f"{commands:>9.1f} {reads:>10.1f}")
+            if not args.redis_url:
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--pools", type=int, nargs="+", default=[16, 256], help="Connection pool sizes to try")
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis (flushes it)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
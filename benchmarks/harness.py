@@ -0,0 +1,273 @@
+"""
+In-process platform for benchmarks: the inference API served by uvicorn,
+inference workers and fake GPU nodes, all on one event loop.
+
+Redis is either a real server (--redis-url) or fakeredis, so benchmarks
+run offline.
+"""
+
+import asyncio
+import json
+import random
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / "services" / "inference"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+import msgpack  # noqa: E402
+import uvicorn  # noqa: E402
+import websockets  # noqa: E402
+
+import main  # noqa: E402
+from redis_pool import create_redis  # noqa: E402
+from task_queue import node_control_key, node_inbox_key, node_result_key  # noqa: E402
+from worker import InferenceWorker, NodeDispatcher  # noqa: E402
+
+NODE_REGISTRATION = {
+    "wallet_address": "0xbench",
+    "gpu_model": "Bench GPU",
+    "vram": 1024,
+    "bandwidth": 100,
+    "cuda_cores": 10000,
+    "location": "local"
+}
+
+
+def redis_factory(redis_url: Optional[str] = None, max_connections: Optional[int] = None):
+    """Callable returning new clients that share one Redis (or fakeredis) server"""
+    if redis_url:
+        if max_connections:
+            return lambda: create_redis(redis_url, max_connections)
+        return lambda: create_redis(redis_url)
+
+    import fakeredis
+    import fakeredis.aioredis
+
+    server = fakeredis.FakeServer()
+    return lambda: fakeredis.aioredis.FakeRedis(server=server)
+
+
+class FakeNode:
+    """Answers inference requests with canned output at a fixed token rate
+
+    For failover benchmarks a node can fail a share of requests outright
+    (error_rate) or run a share of them stall_factor times slower
+    (stall_rate), drawn from a seeded generator so runs are repeatable. It
+    can also crash (die_after): once it has taken that many requests it
+    drops all those still in flight unanswered and disconnects.
+    """
+
+    def __init__(self, node_id: str, seconds_per_token: float = 0.01, error_rate: float = 0,
+                 stall_rate: float = 0, stall_factor: float = 20, seed: Optional[int] = None,
+                 die_after: Optional[int] = None):
+        self.node_id = node_id
+        self.seconds_per_token = seconds_per_token
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_factor = stall_factor
+        self.die_after = die_after
+        self.rng = random.Random(node_id if seed is None else seed)
+        self.taken = 0
+        self.dead = False
+        self._requests: Dict[str, asyncio.Task] = {}
+
+    def start_request(self, message: dict):
+        request_id = message["request_id"]
+        task = asyncio.create_task(self.serve(message))
+        self._requests[request_id] = task
+        task.add_done_callback(lambda _: self._requests.pop(request_id, None))
+        self.taken += 1
+        if self.die_after is not None and self.taken >= self.die_after:
+            self.die()
+
+    def die(self):
+        self.dead = True
+        for task in list(self._requests.values()):
+            task.cancel()
+
+    def handle(self, message: dict):
+        if self.dead:
+            return
+        if message["type"] == "inference_request":
+            self.start_request(message)
+        elif message["type"] == "cancel" and message["request_id"] in self._requests:
+            self._requests[message["request_id"]].cancel()
+
+    async def reply(self, message: dict):
+        raise NotImplementedError
+
+    async def serve(self, message: dict):
+        try:
+            await self._serve(message)
+        except asyncio.CancelledError:
+            if self.dead:
+                return
+            await self.reply({
+                "type": "inference_response",
+                "request_id": message["request_id"],
+                "result": {"error": "Cancelled", "cancelled": True}
+            })
+
+    async def _serve(self, message: dict):
+        request = message["request"]
+        request_id = message["request_id"]
+        tokens = request.get("max_tokens", 16)
+
+        fault = self.rng.random()
+        if fault < self.error_rate:
+            await asyncio.sleep(self.seconds_per_token)
+            await self.reply({
+                "type": "inference_response",
+                "request_id": request_id,
+                "result": {"error": f"Injected failure on {self.node_id}"}
+            })
+            return
+        seconds_per_token = self.seconds_per_token
+        if fault < self.error_rate + self.stall_rate:
+            seconds_per_token *= self.stall_factor
+
+        for index in range(tokens):
+            if seconds_per_token:
+                await asyncio.sleep(seconds_per_token)
+            if request.get("stream"):
+                await self.reply({
+                    "type": "inference_token", "request_id": request_id, "index": index, "text": f" tok{index}"
+                })
+
+        await self.reply({
+            "type": "inference_response",
+            "request_id": request_id,
+            "result": {
+                "status": "success",
+                "response": request["prompt"] + "".join(f" tok{i}" for i in range(tokens)),
+                "tokens_generated": tokens,
+                "timings": {
+                    "prefill_ms": self.seconds_per_token * 1000,
+                    "decode_tokens_per_second": 1 / self.seconds_per_token if self.seconds_per_token else 0
+                }
+            }
+        })
+
+
+class RedisFakeNode(FakeNode):
+    """Serves a node inbox directly, without the node websocket"""
+
+    def __init__(self, redis_client, node_id: str, seconds_per_token: float = 0.01, **faults):
+        super().__init__(node_id, seconds_per_token, **faults)
+        self.redis = redis_client
+
+    async def run(self):
+        keys = [node_control_key(self.node_id), node_inbox_key(self.node_id)]
+        while not self.dead:
+            reply = await self.redis.blpop(keys, timeout=1)
+            if reply is None:
+                continue
+            self.handle(json.loads(reply[1]))
+
+    async def reply(self, message: dict):
+        await self.redis.rpush(node_result_key(message["request_id"]), json.dumps(message))
+
+
+class WebSocketFakeNode(FakeNode):
+    """Connects to the API's node channel the way gpu_node_client does"""
+
+    def __init__(self, base_url: str, node_id: str, seconds_per_token: float = 0.01,
+                 encoding: str = "json", credits: int = 64, **faults):
+        super().__init__(node_id, seconds_per_token, **faults)
+        self.url = f"{base_url.replace('http', 'ws', 1)}/ws/node/{node_id}?encoding={encoding}"
+        self.encoding = encoding
+        self.credits = credits
+        self.ws = None
+
+    def encode(self, message: dict):
+        return msgpack.packb(message) if self.encoding == "msgpack" else json.dumps(message)
+
+    async def run(self):
+        async with websockets.connect(self.url) as ws:
+            self.ws = ws
+            await ws.send(self.encode({"type": "register", "credits": self.credits}))
+            async for frame in ws:
+                message = msgpack.unpackb(frame) if isinstance(frame, bytes) else json.loads(frame)
+                if message["type"] == "ping":
+                    await ws.send(self.encode({"type": "pong"}))
+                else:
+                    self.handle(message)
+                if self.dead:
+                    break
+
+    async def reply(self, message: dict):
+        await self.ws.send(self.encode(message))
+
+
+@asynccontextmanager
+async def platform(redis_url: Optional[str] = None, nodes: int = 1, workers: int = 1,
+                   worker_concurrency: int = 32, seconds_per_token: float = 0.01,
+                   node_channel: Optional[str] = None, node_faults: Optional[List[dict]] = None,
+                   worker_options: Optional[dict] = None, max_connections: Optional[int] = None):
+    """Start API, workers and fake nodes; yields (base_url, node_ids)
+
+    Fake nodes read their Redis inbox directly unless node_channel names an
+    encoding ("json" or "msgpack"), in which case they connect over the
+    node websocket. node_faults gives FakeNode fault settings per node, in
+    order, and worker_options extra InferenceWorker arguments.
+    max_connections sizes each client's pool on a real Redis.
+    """
+    new_client = redis_factory(redis_url, max_connections)
+
+    def api_client(url, pool_size=None):
+        # The API builds its Redis clients in lifespan via create_redis; the
+        # node channels' pool keeps the size the API gives it
+        if redis_url and pool_size:
+            return create_redis(redis_url, pool_size)
+        return new_client()
+
+    main.create_redis = api_client
+
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+
+    background: List[asyncio.Task] = []
+    node_ids = []
+    worker_clients = []
+    try:
+        import httpx
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            for _ in range(nodes):
+                response = await client.post("/api/node/register", json=NODE_REGISTRATION)
+                node_ids.append(response.json()["node_id"])
+
+        for i, node_id in enumerate(node_ids):
+            faults = node_faults[i] if node_faults and i < len(node_faults) else {}
+            if node_channel:
+                fake = WebSocketFakeNode(base_url, node_id, seconds_per_token, node_channel, **faults)
+            else:
+                fake = RedisFakeNode(new_client(), node_id, seconds_per_token, **faults)
+            background.append(asyncio.create_task(fake.run()))
+
+        for i in range(workers):
+            worker_redis = new_client()
+            worker_clients.append(worker_redis)
+            inference_worker = InferenceWorker(
+                worker_redis, NodeDispatcher(worker_redis, timeout=30),
+                name=f"bench-{i}", concurrency=worker_concurrency, block_ms=100, **(worker_options or {})
+            )
+            background.append(asyncio.create_task(inference_worker.run()))
+
+        yield base_url, node_ids
+
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        server.should_exit = True
+        await serving
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Node model load modes on CPU: load time, weight footprint, process memory
+and decode speed of a causal LM loaded fp32, bf16 and int8 (dynamic
+quantization), plus fp16 where the device supports it.
+
+Each mode loads in its own process so memory figures don't mix. Greedy
+output is compared with fp32's to show what the precision costs.
+Runs with any small causal LM (FARLABS_TEXT_MODEL, gpt2 by default).
+
+Usage: python benchmarks/load_modes.py [--model PATH] [--modes fp32 bf16 int8] [--tokens 64] [--threads N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import gpu_node_client  # noqa: E402
+from gpu_node_client import load_text_model, model_footprint_bytes, resolve_load_mode  # noqa: E402
+
+PROMPT = "The quick brown fox jumps over the lazy dog. Meanwhile, in the server room, the operators"
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+
+
+def measure(model_path: str, mode: str, tokens: int):
+    """Load once in mode and decode; runs in the child process"""
+    import torch
+
+    baseline = rss_mb()
+    started = time.perf_counter()
+    model, tokenizer = load_text_model(model_path, mode, "cpu")
+    load_seconds = time.perf_counter() - started
+    inputs = tokenizer(PROMPT, return_tensors="pt")
+
+    with torch.inference_mode():
+        # Warm up kernels before timing
+        model.generate(**inputs, max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+        started = time.perf_counter()
+        output = model.generate(**inputs, max_new_tokens=tokens, min_new_tokens=tokens, do_sample=False,
+                                pad_token_id=tokenizer.pad_token_id)
+        decode_seconds = time.perf_counter() - started
+
+    return {
+        "mode": mode,
+        "load_seconds": load_seconds,
+        "weights_mb": model_footprint_bytes(model) / 1024**2,
+        "rss_mb": rss_mb() - baseline,
+        "tokens_per_second": tokens / decode_seconds,
+        "output": output[0, inputs["input_ids"].shape[1]:].tolist()
+    }
+
+
+def run_child(args, mode: str):
+    command = [sys.executable, __file__, "--child", mode, "--tokens", str(args.tokens)]
+    if args.model:
+        command += ["--model", args.model]
+    env = dict(os.environ)
+    if args.threads:
+        env["OMP_NUM_THREADS"] = str(args.threads)
+    result = subprocess.run(command, capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise SystemExit(f"{mode} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Model path or repo (default FARLABS_TEXT_MODEL)")
+    parser.add_argument("--modes", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens decoded per mode")
+    parser.add_argument("--threads", type=int, help="torch threads per run")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    model_path = args.model or gpu_node_client.TEXT_MODEL_PATH
+    if args.child:
+        print(json.dumps(measure(model_path, args.child, args.tokens)))
+        return
+
+    print(f"{model_path} on CPU, {args.tokens} tokens decoded")
+    print(f"{'mode':>6} {'load s':>7} {'weights MB':>11} {'RSS MB':>7} {'tok/s':>7} {'same as fp32':>13}")
+    reference = None
+    for requested in args.modes:
+        mode = resolve_load_mode(requested, "cpu")
+        result = run_child(args, mode)
+        if reference is None and mode == "fp32":
+            reference = result["output"]
+        if reference is None:
+            same = "-"
+        else:
+            matching = next((i for i, (a, b) in enumerate(zip(reference, result["output"])) if a != b), len(reference))
+            same = f"{matching}/{len(reference)} tok"
+        label = mode if mode == requested else f"{requested}>{mode}"
+        print(f"{label:>6} {result['load_seconds']:>7.2f} {result['weights_mb']:>11.0f} {result['rss_mb']:>7.0f} "
+              f"{result['tokens_per_second']:>7.1f} {same:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Open-loop load test of the whole platform: the inference API, workers and
+a fleet of GPUNodeClient nodes with a stub model (stub_node.py), which
+register over HTTP and serve requests on the node websocket exactly as
+real nodes do.
+
+Requests arrive at a fixed mean rate per endpoint (Poisson arrivals),
+whether or not earlier ones have finished, so a slow platform shows up as
+growing latency rather than as a lower offered load. Latency is measured
+from each request's scheduled arrival; an arrival that finds --concurrency
+requests already in flight is dropped and counted as an error.
+
+  generate  POST /api/inference/generate
+  status    GET /api/inference/status/{id} of a recently submitted task
+  ws        /ws/inference/{id} of a recent task, until its final event
+  network   GET /api/network/status
+
+Rate limits and the queue limit are lifted for the run. Results go to
+stdout and, with --output, to a JSON file; --compare reads an earlier
+JSON and exits non-zero when throughput, p99 latency or the error rate
+regressed by more than --tolerance.
+
+Usage: python benchmarks/load_suite.py [--nodes 4] [--node-vram 560] [--duration 20] [--prompt-tokens 256] [--max-tokens 32]
+           [--concurrency 256] [--generate-rate 50] [--status-rate 100] [--ws-rate 10] [--network-rate 5]
+           [--redis-url URL] [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import deque
+from typing import Dict, List
+
+import aiohttp
+
+from harness import platform
+
+import admission
+import main as api
+from redis_pool import create_redis
+from stub_node import StubNodeClient, gpu_node_client
+
+ENDPOINTS = ("generate", "status", "ws", "network")
+WORDS = ("please summarise the following support ticket and list every action the customer asked for "
+         "including refunds shipping changes account updates and anything they said was urgent").split()
+
+
+def make_prompt(prompt_tokens: int, rng: random.Random) -> str:
+    # Roughly four characters per token, as tokenizer_service estimates
+    words = []
+    length = 0
+    while length < prompt_tokens * 4:
+        words.append(rng.choice(WORDS))
+        length += len(words[-1]) + 1
+    return " ".join(words)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Endpoint:
+    """Outcomes of one endpoint's requests"""
+
+    def __init__(self, name: str, rate: float):
+        self.name = name
+        self.rate = rate
+        self.latencies: List[float] = []
+        self.first_message: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.sent = 0
+        self.last_done = 0.0
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, started: float, duration: float) -> Dict[str, object]:
+        self.latencies.sort()
+        self.first_message.sort()
+        errors = sum(self.errors.values())
+        summary = {
+            "offered_rate": self.rate,
+            "requests": self.sent,
+            "ok": len(self.latencies),
+            "errors": self.errors,
+            "error_rate": errors / self.sent if self.sent else 0.0,
+            # Over the arrival window, or until the last late completion
+            "throughput": len(self.latencies) / max(self.last_done - started, duration),
+            "latency_ms": {
+                "p50": percentile(self.latencies, 0.5) * 1000,
+                "p95": percentile(self.latencies, 0.95) * 1000,
+                "p99": percentile(self.latencies, 0.99) * 1000,
+                "max": self.latencies[-1] * 1000 if self.latencies else float("nan")
+            }
+        }
+        if self.first_message:
+            summary["first_message_ms"] = {
+                "p50": percentile(self.first_message, 0.5) * 1000,
+                "p99": percentile(self.first_message, 0.99) * 1000
+            }
+        return summary
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, args):
+        self.base_url = base_url
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.prompts = [make_prompt(args.prompt_tokens, self.rng) for _ in range(64)]
+        self.task_ids: deque = deque(maxlen=256)
+        self.in_flight = 0
+        self.pending: set = set()
+        self.endpoints = {
+            "generate": Endpoint("generate", args.generate_rate),
+            "status": Endpoint("status", args.status_rate),
+            "ws": Endpoint("ws", args.ws_rate),
+            "network": Endpoint("network", args.network_rate)
+        }
+        self.session = None
+
+    async def submit(self) -> str:
+        request = {
+            "model_id": self.args.model, "prompt": self.rng.choice(self.prompts),
+            "max_tokens": self.args.max_tokens, "temperature": 0.7
+        }
+        async with self.session.post("/api/inference/generate", json=request) as response:
+            body = await response.read()
+            if response.status != 202:
+                raise RuntimeError(f"HTTP {response.status}")
+        task_id = json.loads(body)["task_id"]
+        self.task_ids.append(task_id)
+        return task_id
+
+    async def generate(self):
+        await self.submit()
+
+    async def status(self):
+        async with self.session.get(f"/api/inference/status/{self.rng.choice(self.task_ids)}") as response:
+            await response.read()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+
+    async def ws(self, endpoint: Endpoint, scheduled: float):
+        # The newest tasks, so most streams follow a task still running
+        task_id = self.task_ids[-1 - self.rng.randrange(min(8, len(self.task_ids)))]
+        async with self.session.ws_connect(f"/ws/inference/{task_id}") as ws:
+            first = True
+            async for message in ws:
+                if first:
+                    endpoint.first_message.append(time.perf_counter() - scheduled)
+                    first = False
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                if "error" in json.loads(message.data):
+                    raise RuntimeError("stream error")
+
+    async def network(self):
+        async with self.session.get("/api/network/status") as response:
+            await response.read()
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+
+    async def one(self, endpoint: Endpoint, scheduled: float):
+        self.in_flight += 1
+        try:
+            request = self.ws(endpoint, scheduled) if endpoint.name == "ws" else getattr(self, endpoint.name)()
+            await asyncio.wait_for(request, self.args.timeout)
+            endpoint.last_done = time.perf_counter()
+            endpoint.latencies.append(endpoint.last_done - scheduled)
+        except asyncio.TimeoutError:
+            endpoint.error("timeout")
+        except Exception as e:
+            endpoint.error(str(e) if str(e).startswith(("HTTP", "stream")) else type(e).__name__)
+        finally:
+            self.in_flight -= 1
+
+    async def arrivals(self, endpoint: Endpoint, started: float):
+        """Start endpoint requests at exponential intervals until the run ends"""
+        scheduled = started
+        end = started + self.args.duration
+        while True:
+            scheduled += self.rng.expovariate(endpoint.rate)
+            if scheduled >= end:
+                return
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            endpoint.sent += 1
+            if self.in_flight >= self.args.concurrency:
+                endpoint.error("dropped")
+                continue
+            task = asyncio.create_task(self.one(endpoint, scheduled))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def run(self) -> Dict[str, Dict[str, object]]:
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency)
+        async with aiohttp.ClientSession(self.base_url, headers={"Authorization": "Bearer bench"},
+                                         connector=connector) as self.session:
+            # Tasks for the status and websocket arrivals to look at
+            for _ in range(8):
+                await self.submit()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                self.arrivals(endpoint, started) for endpoint in self.endpoints.values() if endpoint.rate > 0
+            ))
+            # Late requests still count; their latency includes the wait
+            if self.pending:
+                await asyncio.wait(set(self.pending))
+
+        return {name: endpoint.summary(started, self.args.duration) for name, endpoint in self.endpoints.items() if endpoint.rate > 0}
+
+
+async def start_fleet(base_url: str, nodes: int, seconds_per_token: float, vram: int):
+    """Register stub nodes and connect them; returns (clients, tasks)"""
+    gpu_node_client.PLATFORM_URL = base_url
+    gpu_node_client.WS_URL = base_url.replace("http", "ws", 1) + "/ws"
+    clients = [StubNodeClient(f"0xbench{i}", seconds_per_token=seconds_per_token, vram=vram) for i in range(nodes)]
+    for client in clients:
+        if not await client.register_node():
+            raise SystemExit("A stub node could not register")
+    tasks = [asyncio.create_task(client.connect_websocket()) for client in clients]
+    while not all(client.ws for client in clients):
+        await asyncio.sleep(0.05)
+    return clients, tasks
+
+
+async def stop_fleet(clients, tasks):
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for client in clients:
+        client.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def compare(results: Dict[str, object], baseline: Dict[str, object], tolerance: float) -> List[str]:
+    """Regressions of results against baseline, as readable lines"""
+    regressions = []
+    for name, current in results["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        if current["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']:.1f} -> {current['throughput']:.1f} req/s")
+        if current["latency_ms"]["p99"] > before["latency_ms"]["p99"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {before['latency_ms']['p99']:.1f} -> {current['latency_ms']['p99']:.1f} ms")
+        if current["error_rate"] > before["error_rate"] + tolerance / 10:
+            regressions.append(f"{name}: error rate {before['error_rate']:.3f} -> {current['error_rate']:.3f}")
+    return regressions
+
+
+async def run(args):
+    # Node and tokenizer logs repeat for every node and request
+    logging.getLogger("gpu_node").setLevel(logging.WARNING)
+    logging.getLogger("tokenizer_service").setLevel(logging.ERROR)
+    admission.USER_TOKENS_PER_SECOND = admission.USER_TOKEN_BURST = 1e12
+
+    if args.redis_url:
+        # Before startup: flushing later would drop the worker group
+        client = create_redis(args.redis_url)
+        await client.flushdb()
+        await client.close()
+
+    async with platform(args.redis_url, nodes=0, workers=args.workers,
+                        worker_concurrency=args.worker_concurrency) as (base_url, _):
+        api.app.state.admission.limit = 2 ** 31
+        clients, tasks = await start_fleet(base_url, args.nodes, args.seconds_per_token, args.node_vram)
+        try:
+            endpoints = await LoadGenerator(base_url, args).run()
+        finally:
+            await stop_fleet(clients, tasks)
+
+    config = {name: getattr(args, name) for name in (
+        "nodes", "node_vram", "workers", "duration", "prompt_tokens", "max_tokens", "concurrency", "seconds_per_token",
+        "model", "generate_rate", "status_rate", "ws_rate", "network_rate", "seed"
+    )}
+    config["redis"] = "redis" if args.redis_url else "fakeredis"
+    results = {"config": config, "endpoints": endpoints}
+
+    print(f"{args.nodes} nodes, {args.prompt_tokens}-token prompts, {args.max_tokens} new tokens, "
+          f"concurrency {args.concurrency}, {args.duration:g}s on {config['redis']}")
+    print(f"{'endpoint':>9} {'offered':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, summary in endpoints.items():
+        latency = summary["latency_ms"]
+        print(f"{name:>9} {summary['offered_rate']:>8.1f} {summary['throughput']:>8.1f} {latency['p50']:>8.1f} "
+              f"{latency['p95']:>8.1f} {latency['p99']:>8.1f} {summary['error_rate']:>7.1%}")
+        if summary["errors"]:
+            print(f"{'':>9} errors: {summary['errors']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} at {args.tolerance:.0%} tolerance")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=4, help="Stub nodes in the fleet")
+    parser.add_argument("--node-vram", type=int, default=560, help="GB per node; sets its slots per model")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--worker-concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of arrivals")
+    parser.add_argument("--prompt-tokens", type=int, default=256)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--seconds-per-token", type=float, default=0.002, help="Stub model decode speed")
+    parser.add_argument("--model", default="llama-70b")
+    parser.add_argument("--concurrency", type=int, default=256, help="Most requests in flight at once")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds before a request counts as failed")
+    for endpoint, rate in zip(ENDPOINTS, (50, 100, 10, 5)):
+        parser.add_argument(f"--{endpoint}-rate", type=float, default=rate, help="Arrivals per second, 0 for none")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis (flushes it)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier --output JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Cost of the metrics instrumentation: one stage_timer block, and the
+request middleware around a trivial FastAPI endpoint.
+
+Usage: python benchmarks/metrics_overhead.py [--iterations 200000] [--requests 2000]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+from fastapi import FastAPI
+
+import harness  # noqa: F401  (puts services/inference on sys.path)
+import metrics
+
+
+def time_timer(iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with metrics.stage_timer("bench"):
+            pass
+    return (time.perf_counter() - started) / iterations
+
+
+async def time_requests(app, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(50):
+            await client.get("/ping/1")
+        started = time.perf_counter()
+        for i in range(requests):
+            await client.get(f"/ping/{i}")
+        return (time.perf_counter() - started) / requests
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping/{item}")
+    async def ping(item: int):
+        return {"item": item}
+
+    if instrumented:
+        app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    metrics.METRICS_ENABLED = False
+    disabled = time_timer(args.iterations)
+    metrics.METRICS_ENABLED = True
+    enabled = time_timer(args.iterations)
+    print(f"stage_timer: {enabled * 1e9:.0f} ns enabled, {disabled * 1e9:.0f} ns disabled")
+
+    plain = asyncio.run(time_requests(build_app(False), args.requests))
+    instrumented = asyncio.run(time_requests(build_app(True), args.requests))
+    print(f"request: {plain * 1e6:.1f} us plain, {instrumented * 1e6:.1f} us with middleware "
+          f"(+{(instrumented - plain) * 1e6:.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark /api/network/status: the legacy passes over every node in the
+read cache versus the incrementally maintained fleet totals.
+
+Usage: python benchmarks/network_status.py [--nodes 1000 100000] [--calls 200] [--redis-url URL]
+"""
+
+import argparse
+import asyncio
+import time
+
+from harness import redis_factory
+from node_manager import GPUNodeManager
+from node_selection import build_fleet, load_registry
+
+
+def scan_status(nodes):
+    """The pre-totals get_network_status body"""
+    total_nodes = len(nodes)
+    available_nodes = sum(1 for n in nodes.values() if n["status"] == "available")
+    total_vram = sum(n["capabilities"]["vram"] for n in nodes.values())
+    avg_score = sum(n["score"] for n in nodes.values()) / total_nodes if total_nodes else 0
+    return total_nodes, available_nodes, total_vram, avg_score
+
+
+async def run(new_client, size, calls):
+    redis_client = new_client()
+    fleet = build_fleet(size)
+    await load_registry(redis_client, fleet)
+    manager = GPUNodeManager(redis_client)
+
+    started = time.perf_counter()
+    await manager.rebuild_totals()
+    rebuild = time.perf_counter() - started
+    await manager.refresh()
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        legacy = scan_status(manager.nodes)
+    scan = (time.perf_counter() - started) / calls
+
+    started = time.perf_counter()
+    for _ in range(calls):
+        totals = await manager.network_totals()
+    snapshot = (time.perf_counter() - started) / calls
+
+    assert (totals["total_nodes"], totals["available_nodes"], totals["total_vram_gb"]) == legacy[:3]
+    await redis_client.flushdb()
+    return scan, snapshot, rebuild
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis")
+    args = parser.parse_args()
+    new_client = redis_factory(args.redis_url)
+
+    print(f"{'nodes':>8} {'scan us/call':>13} {'totals us/call':>15} {'one-off rebuild s':>18}")
+    for size in args.nodes:
+        scan, snapshot, rebuild = asyncio.run(run(new_client, size, args.calls))
+        print(f"{size:>8} {scan * 1e6:>13.1f} {snapshot * 1e6:>15.1f} {rebuild:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
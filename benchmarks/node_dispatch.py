@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Dispatch throughput and latency between workers and nodes: fake nodes
+reading their Redis inbox directly versus fake nodes connected over the
+node websocket channel with JSON or msgpack frames.
+
+Requests go through worker.NodeDispatcher, so each one makes the full trip
+worker -> Redis -> channel -> node and back; nodes answer instantly, which
+leaves only the dispatch path.
+
+Usage: python benchmarks/node_dispatch.py [--requests 2000] [--concurrency 64] [--tokens 16] [--redis-url URL]
+"""
+
+import argparse
+import asyncio
+import time
+import uuid
+
+from harness import platform
+from main import app
+from worker import NodeDispatcher
+
+
+async def dispatch_all(dispatcher, node_ids, requests: int, concurrency: int, tokens: int, stream: bool):
+    latencies = []
+    streamed = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def on_text(text, index):
+        nonlocal streamed
+        streamed += 1
+
+    async def one(i: int):
+        task = {
+            "id": str(uuid.uuid4()), "node_id": node_ids[i % len(node_ids)], "model": "llama-70b",
+            "prompt": "Hello", "max_tokens": tokens, "temperature": 0, "top_p": 1, "stream": stream
+        }
+        async with semaphore:
+            started = time.perf_counter()
+            result = await dispatcher.dispatch(task, on_text)
+            latencies.append(time.perf_counter() - started)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return requests / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], streamed / elapsed
+
+
+async def run(args):
+    print(f"{'transport':>10} {'stream':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'tokens/s':>9}")
+    for transport in ("redis", "json", "msgpack"):
+        node_channel = None if transport == "redis" else transport
+        async with platform(args.redis_url, nodes=args.nodes, seconds_per_token=0,
+                            node_channel=node_channel) as (_, node_ids):
+            # Give websocket nodes a moment to connect and register
+            await asyncio.sleep(0.5)
+            dispatcher = NodeDispatcher(app.state.redis, timeout=30)
+            for stream in (False, True):
+                rate, p50, p99, tokens = await dispatch_all(
+                    dispatcher, node_ids, args.requests, args.concurrency, args.tokens, stream
+                )
+                print(f"{transport:>10} {str(stream):>7} {rate:>8.0f} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} {tokens:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--tokens", type=int, default=16, help="Tokens per request, streamed back one by one when streaming")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
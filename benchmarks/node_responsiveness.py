@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Measure ping/pong latency on the node websocket while a long generation
+runs, with model work on the inference executor versus inline on the
+event loop.
+
+Usage: python benchmarks/node_responsiveness.py [--generation-seconds 2] [--ping-interval 0.05]
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import threading
+import time
+
+import websockets
+
+from stub_node import StubNodeClient, gpu_node_client
+
+
+async def run_node(node: StubNodeClient):
+    try:
+        await node.connect_websocket()
+    except asyncio.CancelledError:
+        pass
+
+
+async def measure(inline: bool, generation_seconds: float, ping_interval: float):
+    messages: asyncio.Queue = asyncio.Queue()
+    connected = asyncio.Event()
+    channel = {}
+
+    async def platform(ws, *_):
+        channel["ws"] = ws
+        connected.set()
+        async for raw in ws:
+            # Frames come in the encoding the node asked for (FRAME_ENCODING)
+            await messages.put((time.perf_counter(), StubNodeClient.decode(raw)))
+
+    async with websockets.serve(platform, "127.0.0.1", 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        gpu_node_client.WS_URL = f"ws://127.0.0.1:{port}"
+
+        tokens = 100
+        node = StubNodeClient(seconds_per_token=generation_seconds / tokens, inline=inline)
+        # The node gets its own thread and event loop, as it would in its own process
+        node_loop = asyncio.new_event_loop()
+        node_thread = threading.Thread(
+            target=node_loop.run_until_complete, args=(run_node(node),), daemon=True
+        )
+        node_thread.start()
+        await connected.wait()
+        ws = channel["ws"]
+        await messages.get()  # register message
+
+        await ws.send(StubNodeClient.encode({
+            "type": "inference_request",
+            "request_id": "bench",
+            "request": {"model": "llama", "prompt": "hello", "max_tokens": tokens}
+        }))
+
+        rtts = []
+        done = False
+        while not done:
+            sent = time.perf_counter()
+            await ws.send(StubNodeClient.encode({"type": "ping"}))
+            while True:
+                received, message = await messages.get()
+                if message.get("type") == "pong":
+                    rtts.append((received - sent) * 1000)
+                    break
+                if message.get("type") == "inference_response":
+                    done = True
+            await asyncio.sleep(ping_interval)
+
+        for task in asyncio.all_tasks(node_loop):
+            node_loop.call_soon_threadsafe(task.cancel)
+        node.executor.shutdown(wait=False)
+        return rtts
+
+
+def main():
+    logging.getLogger("websockets").setLevel(logging.WARNING)
+    logging.getLogger("gpu_node").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--generation-seconds", type=float, default=2.0)
+    parser.add_argument("--ping-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{'mode':>9} {'pings':>6} {'p50 ms':>8} {'max ms':>8}")
+    for mode, inline in (("inline", True), ("executor", False)):
+        rtts = asyncio.run(measure(inline, args.generation_seconds, args.ping_interval))
+        print(f"{mode:>9} {len(rtts):>6} {statistics.median(rtts):>8.2f} {max(rtts):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark node selection: the legacy full scan over an in-process dict
+versus the shared registry (per-model sorted sets plus Lua reservation).
+
+Usage: python benchmarks/node_selection.py [--nodes 10000 100000] [--selections 2000] [--redis-url URL]
+
+Without --redis-url the registry runs on fakeredis, whose per-command cost
+is much higher than a real server's; compare growth across fleet sizes.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from harness import redis_factory
+from node_manager import GPUNodeManager, HEARTBEATS_KEY, NODES_KEY, available_key, node_key
+
+# Mirrors MODEL_REGISTRY in services/inference/main.py
+MODEL_VRAM = {"llama-70b": 140, "mixtral-8x22b": 180, "llama-405b": 810}
+VRAM_TIERS = [24, 48, 80, 160, 320, 640, 1024]
+LOCATIONS = ["us-east", "us-west", "eu-central", "ap-south"]
+
+
+def build_fleet(size: int, seed: int = 7):
+    rng = random.Random(seed)
+    nodes = {}
+    for i in range(size):
+        vram = rng.choice(VRAM_TIERS)
+        nodes[f"node_{i}"] = {
+            "capabilities": {
+                "vram": vram,
+                "location": rng.choice(LOCATIONS),
+                "supported_models": [m for m, v in MODEL_VRAM.items() if vram >= v],
+            },
+            "status": "available",
+            "score": rng.uniform(50, 100),
+        }
+    return nodes
+
+
+def scan_select(nodes, min_vram):
+    """The pre-index select_best_node: filter every node, then sort"""
+    eligible = [
+        (node_id, node["score"]) for node_id, node in nodes.items()
+        if node["status"] == "available" and node["capabilities"]["vram"] >= min_vram
+    ]
+    if not eligible:
+        return None
+    eligible.sort(key=lambda x: x[1], reverse=True)
+    selected = eligible[0][0]
+    nodes[selected]["status"] = "busy"
+    return selected
+
+
+def scan_release(nodes, node_id):
+    nodes[node_id]["status"] = "available"
+
+
+def run_scan(nodes, requests):
+    start = time.perf_counter()
+    for model_id in requests:
+        node_id = scan_select(nodes, MODEL_VRAM[model_id])
+        if node_id:
+            scan_release(nodes, node_id)
+    return time.perf_counter() - start
+
+
+async def load_registry(redis_client, nodes):
+    """Bulk-write the fleet the way register_node lays it out"""
+    await redis_client.flushdb()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for node_id, node in nodes.items():
+            models = node["capabilities"]["supported_models"]
+            pipe.hset(node_key(node_id), mapping={
+                "capabilities": json.dumps(node["capabilities"]),
+                "models": ",".join(models),
+                "vram": node["capabilities"]["vram"],
+                "location": node["capabilities"]["location"],
+                "bandwidth": 100,
+                "slots": ",".join("1" for _ in models),
+                "in_flight": 0,
+                "status": "available",
+                "score": node["score"],
+                "tasks_completed": 0,
+                "uptime": 0,
+                "last_heartbeat": time.time()
+            })
+            pipe.sadd(NODES_KEY, node_id)
+            pipe.zadd(HEARTBEATS_KEY, {node_id: time.time()})
+            for model_id in models:
+                pipe.zadd(available_key(model_id), {node_id: node["score"]})
+        await pipe.execute()
+
+
+async def run_registry(new_client, nodes, requests):
+    redis_client = new_client()
+    await load_registry(redis_client, nodes)
+    manager = GPUNodeManager(redis_client)
+
+    start = time.perf_counter()
+    for model_id in requests:
+        node_id = await manager.select_best_node(model_id)
+        if node_id:
+            await manager.release_node(node_id)
+    elapsed = time.perf_counter() - start
+
+    await redis_client.flushdb()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--selections", type=int, default=2000)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    requests = [rng.choice(list(MODEL_VRAM)) for _ in range(args.selections)]
+    new_client = redis_factory(args.redis_url)
+
+    print(f"{'nodes':>8} {'scan us/op':>12} {'registry us/op':>15}")
+    for size in args.nodes:
+        nodes = build_fleet(size)
+        scan = run_scan(nodes, requests) / len(requests) * 1e6
+        registry = asyncio.run(run_registry(new_client, nodes, requests)) / len(requests) * 1e6
+        print(f"{size:>8} {scan:>12.1f} {registry:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Node restart time: how long after a GPU node process starts it is
+registered with the platform, has its model loaded, and streams the first
+token of a request sent the moment it registered.
+
+Each run starts a fresh node process (gpu_node_client with
+FARLABS_PREWARM_MODELS=llama) against an in-process platform:
+
+  eager     the old startup: torch and transformers imported up front, GPU
+            probed, model loaded before the node connects
+  cold      probe not cached yet (first start after an install or upgrade),
+            model loaded in the background after connecting
+  restart   cached probe, model loaded in the background
+
+Runs on CPU with any small causal LM (FARLABS_TEXT_MODEL, gpt2 by default).
+
+Usage: python benchmarks/node_startup.py [--model PATH] [--runs 3] [--redis-url URL]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+WALLET = "0xstartup"
+SCENARIOS = {
+    "eager": {"FARLABS_LOAD_IN_BACKGROUND": "false"},
+    "cold": {},
+    "restart": {}
+}
+
+
+async def run_node(base_url: str, eager_imports: bool):
+    """Child process: start a node the way gpu_node_client.main() does"""
+    if eager_imports:
+        # What main() used to do to check the packages were installed
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+    sys.path.insert(0, str(ROOT))
+    import gpu_node_client
+    from gpu_node_client import GPUNodeClient
+
+    gpu_node_client.PLATFORM_URL = base_url
+    gpu_node_client.WS_URL = base_url.replace("http", "ws", 1) + "/ws"
+    await GPUNodeClient(WALLET, "startup-node").start()
+
+
+async def first_token(base_url: str) -> float:
+    """Time the first token of a streamed request arrives"""
+    import httpx
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": "Bearer bench"}, timeout=None) as client:
+        async with client.stream("POST", "/api/inference/generate", json={
+            "model_id": "llama-70b", "prompt": "The node restarted and", "max_tokens": 8, "stream": True
+        }) as response:
+            async for line in response.aiter_lines():
+                if line in ("event: token", "event: result"):
+                    return time.time()
+                if line == "event: error":
+                    raise RuntimeError("the request failed")
+    raise RuntimeError("the stream ended without a token")
+
+
+async def measure(api, base_url: str, scenario: str, env: dict, timeout: float):
+    """(seconds to registered, to model ready, to first token) after the node process starts"""
+    command = [sys.executable, __file__, "--node", base_url]
+    if scenario == "eager":
+        command.append("--eager-imports")
+    node_manager = api.app.state.node_manager
+    started = time.time()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        node_id = None
+        while node_id is None:
+            if time.time() - started > timeout or process.poll() is not None:
+                raise SystemExit(f"{scenario}: the node did not register")
+            node_id = next((n for n in node_manager.nodes if n.startswith(f"node_{WALLET}")), None)
+            await asyncio.sleep(0.01)
+        registered = time.time()
+
+        # Sent the moment the node registered: answering it may wait for the load
+        token = asyncio.create_task(first_token(base_url))
+
+        while node_manager.nodes.get(node_id, {}).get("model_states", {}).get("llama") != "ready":
+            if time.time() - started > timeout:
+                raise SystemExit(f"{scenario}: the model never reported ready")
+            await asyncio.sleep(0.01)
+        ready = time.time()
+        first = await asyncio.wait_for(token, timeout)
+        await node_manager.remove_node(node_id)
+        return registered - started, ready - started, first - started
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def run(args):
+    # The platform's own modules load only in this process, not in the node's
+    from harness import platform
+    import admission
+    import main as api
+
+    logging.getLogger("tokenizer_service").setLevel(logging.ERROR)
+    admission.USER_TOKENS_PER_SECOND = admission.USER_TOKEN_BURST = 1e12
+    # The node serves llama-70b with the small test model: size the platform's
+    # entry for that, so a CPU node registering its RAM budget can be placed
+    api.MODEL_REGISTRY["llama-70b"] = {**api.MODEL_REGISTRY["llama-70b"], "min_gpu_vram": 1}
+    cache_dir = tempfile.mkdtemp()
+    env = dict(os.environ, FARLABS_PREWARM_MODELS="llama", FARLABS_METRICS_PORT="0",
+               FARLABS_CAPABILITY_CACHE=os.path.join(cache_dir, "capabilities.json"))
+    if args.model:
+        env["FARLABS_TEXT_MODEL"] = args.model
+
+    async with platform(args.redis_url, nodes=0, workers=1) as (base_url, _):
+        results = {scenario: [] for scenario in SCENARIOS}
+        for _ in range(args.runs):
+            for scenario, overrides in SCENARIOS.items():
+                run_env = dict(env, **overrides)
+                if scenario == "eager":
+                    run_env["FARLABS_CAPABILITY_CACHE"] = ""
+                elif scenario == "cold" and os.path.exists(env["FARLABS_CAPABILITY_CACHE"]):
+                    os.remove(env["FARLABS_CAPABILITY_CACHE"])
+                results[scenario].append(await measure(api, base_url, scenario, run_env, args.timeout))
+
+    print(f"Median of {args.runs} node starts, seconds after the process started")
+    print(f"{'startup':>8} {'registered':>11} {'model ready':>12} {'first token':>12}")
+    for scenario, runs in results.items():
+        registered, ready, first = (statistics.median(values) for values in zip(*runs))
+        print(f"{scenario:>8} {registered:>11.2f} {ready:>12.2f} {first:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Model path or repo (default FARLABS_TEXT_MODEL)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis")
+    parser.add_argument("--node", help=argparse.SUPPRESS)
+    parser.add_argument("--eager-imports", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.node:
+        asyncio.run(run_node(args.node, args.eager_imports))
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Prefill time on a node with and without the prompt-prefix KV cache, for
+requests that share a long system prompt and differ in a short question.
+Runs on CPU with any small causal LM (FARLABS_TEXT_MODEL, gpt2 by default).
+
+Usage: python benchmarks/prefix_cache.py [--requests 30] [--system-words 300] [--tokens 8] [--block 32]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import gpu_node_client  # noqa: E402
+from gpu_node_client import GPUNodeClient, PrefixCache  # noqa: E402
+
+WORDS = ("the model reads every token of the prompt before it writes a single word so long shared "
+         "instructions cost the same prefill time on each request unless their keys and values are kept").split()
+
+
+def prompts(requests: int, system_words: int):
+    rng = random.Random(0)
+    system = " ".join(rng.choice(WORDS) for _ in range(system_words))
+    return [f"{system}\nQuestion {i}: " + " ".join(rng.choice(WORDS) for _ in range(12)) for i in range(requests)]
+
+
+def run(client: GPUNodeClient, model_data, requests, tokens: int):
+    prefill, total = [], []
+    for prompt in requests:
+        started = time.perf_counter()
+        result = client._generate_batch_sync("llama", model_data, [{"prompt": prompt, "max_tokens": tokens, "temperature": 0}])[0]
+        total.append((time.perf_counter() - started) * 1000)
+        prefill.append(result["timings"]["prefill_ms"])
+    return statistics.median(prefill), statistics.median(total), result["response"]
+
+
+async def main_async(args):
+    client = GPUNodeClient("0xbench", "bench-node")
+    model_data = await client.load_model("llama")
+    if not model_data:
+        raise SystemExit(f"Could not load {gpu_node_client.TEXT_MODEL_PATH}")
+    requests = prompts(args.requests, args.system_words)
+    prompt_tokens = len(model_data["tokenizer"](requests[0])["input_ids"])
+    print(f"{prompt_tokens} prompt tokens, {args.tokens} new tokens, {args.requests} requests")
+    print(f"{'prefix cache':>12} {'prefill p50 ms':>15} {'request p50 ms':>15} {'hit rate':>9}")
+
+    responses = {}
+    for name, budget in (("off", 0), ("on", args.cache_mb * 1024**2)):
+        client.prefix_cache = PrefixCache(budget, block_tokens=args.block)
+        prefill, total, responses[name] = run(client, model_data, requests, args.tokens)
+        hit_rate = client.prefix_cache.stats()["hit_rate"]
+        print(f"{name:>12} {prefill:>15.1f} {total:>15.1f} {hit_rate:>9.2f}")
+    if responses["on"] != responses["off"]:
+        print("warning: outputs differ with the prefix cache on")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=30)
+    parser.add_argument("--system-words", type=int, default=300)
+    parser.add_argument("--tokens", type=int, default=8)
+    parser.add_argument("--block", type=int, default=32, help="Prefix cache block size in tokens")
+    parser.add_argument("--cache-mb", type=float, default=256)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
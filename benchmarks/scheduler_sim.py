@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Offline simulation of node scheduling policies.
+
+Replays one synthetic request trace against a synthetic fleet through each
+policy in services/inference/scheduler.py, the same code the admission
+scheduler runs, and reports makespan, latency and queue wait percentiles
+and utilization. Each model has a FIFO queue whose head is offered a
+sample of the free nodes picked as the admission scheduler picks them: the
+best scored in its region and overall, then a group of each VRAM size from
+the smallest up.
+
+Usage: python benchmarks/scheduler_sim.py [--nodes 200] [--requests 20000] [--load 0.85] [--policies score balanced random]
+"""
+
+import argparse
+import heapq
+import random
+from collections import deque
+
+from node_selection import LOCATIONS, MODEL_VRAM, VRAM_TIERS
+from scheduler import POLICIES, SCHEDULER_CANDIDATES, SCHEDULER_GROUP_CANDIDATES, SchedulingPolicy, load_policy
+
+# Expected decode speed and traffic share per model, as in MODEL_REGISTRY
+MODEL_TPS = {"llama-70b": 50, "mixtral-8x22b": 40, "llama-405b": 30}
+MODEL_MIX = {"llama-70b": 0.6, "mixtral-8x22b": 0.3, "llama-405b": 0.1}
+PREFILL_SECONDS = 0.2
+CROSS_REGION_SECONDS = 0.15
+
+
+class RandomPolicy(SchedulingPolicy):
+    """Baseline: any candidate"""
+
+    name = "random"
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+
+    def choose(self, task, candidates):
+        return self.rng.choice(candidates)["node_id"] if candidates else None
+
+
+def build_fleet(size: int, rng: random.Random):
+    # Nodes too small for every model never see a request
+    tiers = [vram for vram in VRAM_TIERS if vram >= min(MODEL_VRAM.values())]
+    fleet = {}
+    for i in range(size):
+        vram = rng.choice(tiers)
+        fleet[f"node_{i}"] = {
+            "vram": vram,
+            "location": rng.choice(LOCATIONS),
+            "score": rng.uniform(50, 100),
+            "bandwidth": rng.choice([100, 1000, 10000]),
+            # How fast this node runs relative to the model's expected speed
+            "speed": rng.lognormvariate(0, 0.35),
+            "models": [m for m, v in MODEL_VRAM.items() if vram >= v],
+        }
+    return fleet
+
+
+def service_seconds(task, node):
+    seconds = PREFILL_SECONDS + task["max_tokens"] / (MODEL_TPS[task["model"]] * node["speed"])
+    if task["region"] != node["location"]:
+        seconds += CROSS_REGION_SECONDS
+    return seconds
+
+
+def build_trace(count: int, fleet, load: float, rng: random.Random):
+    models, weights = zip(*MODEL_MIX.items())
+    tasks = []
+    for i in range(count):
+        model = rng.choices(models, weights)[0]
+        tasks.append({
+            "id": f"task_{i}",
+            "model": model,
+            "min_vram": MODEL_VRAM[model],
+            "tokens_per_second": MODEL_TPS[model],
+            "max_tokens": min(2048, max(16, int(rng.lognormvariate(5.5, 0.8)))),
+            "region": rng.choice(LOCATIONS),
+        })
+
+    # Offer `load` times what the fleet could serve at the expected speeds
+    mean_service = sum(PREFILL_SECONDS + t["max_tokens"] / t["tokens_per_second"] for t in tasks) / count
+    rate = load * len(fleet) / mean_service
+    now = 0.0
+    for task in tasks:
+        now += rng.expovariate(rate)
+        task["arrival"] = now
+    return tasks
+
+
+def sample_candidates(fleet, eligible, task, candidates: int, group: int):
+    """Node ids offered for the task, as admission.PEEK_SCRIPT chooses them"""
+    by_score = lambda node_id: -fleet[node_id]["score"]
+    local = [node_id for node_id in eligible if fleet[node_id]["location"] == task["region"]]
+    chosen = dict.fromkeys(sorted(local, key=by_score)[:group])
+    chosen.update(dict.fromkeys(sorted(eligible, key=by_score)[:group]))
+    tiers = {}
+    for node_id in eligible:
+        tiers.setdefault(fleet[node_id]["vram"], []).append(node_id)
+    for vram in sorted(tiers):
+        if len(chosen) >= candidates:
+            break
+        chosen.update(dict.fromkeys(sorted(tiers[vram], key=by_score)[:group]))
+    return list(chosen)
+
+
+def simulate(policy: SchedulingPolicy, fleet, trace, candidates: int, group: int):
+    free = set(fleet)
+    # Measured speed per node and model, known once the node has served it
+    measured = {}
+    queues = {model: deque() for model in MODEL_VRAM}
+    events = [(task["arrival"], 0, task["id"], task) for task in trace]
+    heapq.heapify(events)
+    latencies = []
+    waits = []
+    busy_seconds = 0.0
+    finished_at = 0.0
+
+    def dispatch(now):
+        nonlocal busy_seconds
+        for model, queue in queues.items():
+            while queue:
+                eligible = [node_id for node_id in free if model in fleet[node_id]["models"]]
+                if not eligible:
+                    break
+                task = queue[0]
+                top = sample_candidates(fleet, eligible, task, candidates, group)
+                node_id = policy.choose(task, [
+                    {
+                        "node_id": node_id,
+                        "vram": fleet[node_id]["vram"],
+                        "location": fleet[node_id]["location"],
+                        "score": fleet[node_id]["score"],
+                        "tokens_per_second": measured.get((node_id, model), 0.0),
+                        "bandwidth": fleet[node_id]["bandwidth"],
+                        "load": 0,
+                        "slots": 1,
+                    }
+                    for node_id in top
+                ])
+                if node_id is None:
+                    break
+                queue.popleft()
+                waits.append(now - task["arrival"])
+                free.discard(node_id)
+                seconds = service_seconds(task, fleet[node_id])
+                busy_seconds += seconds
+                heapq.heappush(events, (now + seconds, 1, task["id"], (task, node_id)))
+
+    while events:
+        now, kind, _, payload = heapq.heappop(events)
+        if kind == 0:
+            queues[payload["model"]].append(payload)
+        else:
+            task, node_id = payload
+            free.add(node_id)
+            measured[(node_id, task["model"])] = MODEL_TPS[task["model"]] * fleet[node_id]["speed"]
+            latencies.append(now - task["arrival"])
+            finished_at = now
+        dispatch(now)
+
+    latencies.sort()
+    waits.sort()
+    makespan = finished_at - trace[0]["arrival"]
+    return {
+        "makespan": makespan,
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[int(len(latencies) * 0.99)],
+        "wait_p99": waits[int(len(waits) * 0.99)],
+        "utilization": busy_seconds / (len(fleet) * makespan),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--load", type=float, default=0.85, help="Offered load as a fraction of fleet capacity")
+    parser.add_argument("--candidates", type=int, default=SCHEDULER_CANDIDATES)
+    parser.add_argument("--group-candidates", type=int, default=SCHEDULER_GROUP_CANDIDATES)
+    parser.add_argument("--policies", nargs="+", default=[*POLICIES, RandomPolicy.name])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fleet = build_fleet(args.nodes, rng)
+    trace = build_trace(args.requests, fleet, args.load, rng)
+    print(f"{args.nodes} nodes, {args.requests} requests at {args.load:.0%} load, {args.candidates} candidates")
+    print(f"{'policy':>10} {'makespan s':>11} {'p50 s':>8} {'p99 s':>8} {'wait p99':>9} {'util':>6}")
+    for name in args.policies:
+        policy = RandomPolicy(args.seed) if name == RandomPolicy.name else load_policy(name)
+        result = simulate(policy, fleet, trace, args.candidates, args.group_candidates)
+        print(f"{name:>10} {result['makespan']:>11.0f} {result['p50']:>8.1f} {result['p99']:>8.1f} {result['wait_p99']:>9.2f} {result['utilization']:>6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Time-to-first-token for /api/inference/generate with stream=true versus the
+202 + status polling flow, against a local fake node.
+
+Usage: python benchmarks/streaming_ttft.py [--requests 20] [--tokens 64] [--seconds-per-token 0.01]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from harness import platform
+
+HEADERS = {"Authorization": "Bearer bench"}
+
+
+async def ttft_streaming(client: httpx.AsyncClient, body: dict) -> float:
+    started = time.perf_counter()
+    first_token = None
+    async with client.stream("POST", "/api/inference/generate", json={**body, "stream": True}, headers=HEADERS) as response:
+        # Read to the end so the node is released before the next request
+        async for line in response.aiter_lines():
+            if line == "event: token" and first_token is None:
+                first_token = time.perf_counter() - started
+    if first_token is None:
+        raise RuntimeError(f"stream ended without a token (HTTP {response.status_code})")
+    return first_token
+
+
+async def ttft_polling(client: httpx.AsyncClient, body: dict) -> float:
+    started = time.perf_counter()
+    response = await client.post("/api/inference/generate", json=body, headers=HEADERS)
+    task_id = response.json()["task_id"]
+    while True:
+        status = (await client.get(f"/api/inference/status/{task_id}")).json()
+        if status["status"] == "completed":
+            return time.perf_counter() - started
+        await asyncio.sleep(0.005)
+
+
+async def run(args):
+    # Sampled, so the result cache never answers and every request generates
+    body = {"model_id": "llama-70b", "prompt": "Hello " * 32, "max_tokens": args.tokens, "temperature": 0.7}
+    async with platform(args.redis_url, nodes=4, seconds_per_token=args.seconds_per_token) as (base_url, _):
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            print(f"{'mode':>10} {'p50 ms':>8} {'p95 ms':>8}")
+            for mode, measure in (("polling", ttft_polling), ("streaming", ttft_streaming)):
+                samples = sorted([await measure(client, body) * 1000 for _ in range(args.requests)])
+                p95 = samples[int(0.95 * (len(samples) - 1))]
+                print(f"{mode:>10} {statistics.median(samples):>8.1f} {p95:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--seconds-per-token", type=float, default=0.01)
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+GPUNodeClient with a stub model, for benchmarks that need a node without
+torch, transformers or a GPU.
+
+Generation is simulated with time.sleep, which releases the GIL the same
+way torch kernels do, so the node's event loop behaves as it would with a
+real model running on the inference executor.
+"""
+
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import gpu_node_client  # noqa: E402
+from gpu_node_client import GPUNodeClient  # noqa: E402
+
+
+class StubNodeClient(GPUNodeClient):
+    def __init__(self, wallet_address: str = "0x0", node_name: Optional[str] = None,
+                 seconds_per_token: float = 0.002, load_seconds: float = 0.0, inline: bool = False,
+                 vram: int = 160):
+        self.seconds_per_token = seconds_per_token
+        self.load_seconds = load_seconds
+        self.inline = inline
+        self.vram = vram
+        super().__init__(wallet_address, node_name)
+
+    def _detect_capabilities(self) -> Dict[str, Any]:
+        # A simulated GPU; the default VRAM fits one llama-70b slot
+        return {"platform": "stub", "gpu_available": False, "gpu_model": "Stub GPU", "vram": self.vram,
+                "models_supported": ["llama"]}
+
+    def load_mode(self, model_name: str) -> str:
+        # No weights; register at the size the platform assumes
+        return "fp16"
+
+    async def run_blocking(self, fn, *args):
+        if self.inline:
+            # The pre-executor behaviour: block the event loop
+            return fn(*args)
+        return await super().run_blocking(fn, *args)
+
+    def _load_model_sync(self, model_name: str) -> Optional[Dict[str, Any]]:
+        time.sleep(self.load_seconds)
+        return {"model": None, "tokenizer": None}
+
+    def _generate_batch_sync(self, model_name: str, model_data: Dict[str, Any],
+                             requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        max_new_tokens = [r.get("max_tokens", gpu_node_client.DEFAULT_MAX_NEW_TOKENS) for r in requests]
+        time.sleep(max(max_new_tokens) * self.seconds_per_token)
+        return [
+            {
+                "status": "success",
+                "response": r.get("prompt", "") + " [stub completion]",
+                "model": model_name,
+                "tokens_generated": n,
+                "batch_size": len(requests),
+                "timings": {"decode_tokens_per_second": 1 / self.seconds_per_token}
+            }
+            for r, n in zip(requests, max_new_tokens)
+        ]
+
+    def _generate_stream_sync(self, model_name: str, model_data: Dict[str, Any],
+                              request: Dict[str, Any], emit) -> Dict[str, Any]:
+        tokens = request.get("max_tokens", gpu_node_client.DEFAULT_MAX_NEW_TOKENS)
+        for index in range(tokens):
+            time.sleep(self.seconds_per_token)
+            emit(f" tok{index}")
+        return {
+            "status": "success",
+            "response": request.get("prompt", "") + "".join(f" tok{i}" for i in range(tokens)),
+            "model": model_name,
+            "tokens_generated": tokens
+        }
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Redis cost of task records with long prompts: the old layout, a JSON blob
+in task:{id} plus a copy of it on the inference_queue stream, against the
+task:{id} hash with the prompt kept once under task_prompt:{id} and only
+ids on the stream (see task_queue.py).
+
+Reports bytes stored per task (MEMORY USAGE on a real Redis, value bytes on
+fakeredis), status read and status update latency, and the time to encode
+a node inbox message with json and orjson.
+
+Usage: python benchmarks/task_records.py [--tasks 500] [--prompt-tokens 4096] [--reads 2000] [--redis-url URL]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "inference"))
+
+import orjson  # noqa: E402
+import redis.asyncio as redis  # noqa: E402
+
+from main import TASK_STATUS_FIELDS  # noqa: E402
+from task_queue import (  # noqa: E402
+    TASK_TTL,
+    read_task_fields,
+    split_task,
+    task_key,
+    task_prompt_key,
+    update_task,
+)
+
+STREAM = "bench_task_records"
+
+
+def make_task(prompt_tokens: int, rng: random.Random):
+    # Roughly four characters per token
+    prompt = " ".join(f"w{rng.randrange(10000):04d}" for _ in range(prompt_tokens * 4 // 6))
+    return {
+        "id": str(uuid.uuid4()), "model": "llama-70b", "prompt": prompt, "max_tokens": 512,
+        "prompt_tokens": prompt_tokens, "temperature": 0.7, "top_p": 0.9, "stream": False,
+        "price_per_1m_tokens": 3.0, "tokens_per_second": 50, "min_vram": 140, "region": None,
+        "prefix_key": uuid.uuid4().hex, "profile": None, "cache_key": None, "node_id": None,
+        "priority": "standard", "status": "queued", "user_id": "bench", "created_at": datetime.now().isoformat()
+    }
+
+
+async def legacy_store(client, task):
+    payload = json.dumps(task)
+    await client.set(task_key(task["id"]), payload, ex=TASK_TTL)
+    await client.xadd(STREAM, {"task": payload, "node_id": "node", "request_id": task["id"]})
+
+
+async def hash_store(client, task):
+    fields, prompt = split_task(task)
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.hset(task_key(task["id"]), mapping=fields)
+        pipe.expire(task_key(task["id"]), TASK_TTL)
+        pipe.set(task_prompt_key(task["id"]), prompt, ex=TASK_TTL)
+        await pipe.execute()
+    await client.xadd(STREAM, {"task_id": task["id"], "node_id": "node", "request_id": task["id"]})
+
+
+async def legacy_status(client, task_id):
+    task = json.loads(await client.get(task_key(task_id)))
+    return {name: task.get(name) for name in TASK_STATUS_FIELDS}
+
+
+async def legacy_update(client, task_id, **fields):
+    task = json.loads(await client.get(task_key(task_id)))
+    task.update(fields)
+    await client.set(task_key(task_id), json.dumps(task), ex=TASK_TTL)
+
+
+async def stored_bytes(client, keys):
+    """MEMORY USAGE of keys and the stream, or their value bytes without it"""
+    try:
+        usage = [await client.memory_usage(key) for key in keys]
+        return sum(usage) + await client.memory_usage(STREAM), "memory"
+    except Exception:
+        total = 0
+        for key in keys:
+            kind = (await client.type(key)).decode()
+            if kind == "hash":
+                total += sum(len(k) + len(v) for k, v in (await client.hgetall(key)).items())
+            elif kind == "string":
+                total += await client.strlen(key)
+        for _, fields in await client.xrange(STREAM):
+            total += sum(len(k) + len(v) for k, v in fields.items())
+        return total, "value"
+
+
+async def timed(calls):
+    latencies = []
+    for call in calls:
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+async def run(args):
+    if args.redis_url:
+        client = redis.from_url(args.redis_url)
+    else:
+        import fakeredis.aioredis
+        client = fakeredis.aioredis.FakeRedis()
+
+    rng = random.Random(0)
+    tasks = [make_task(args.prompt_tokens, rng) for _ in range(args.tasks)]
+    print(f"{args.tasks} tasks with {args.prompt_tokens}-token prompts ({len(tasks[0]['prompt'])} chars)")
+    print(f"{'layout':>8} {'KB/task':>8} {'read p50 us':>12} {'read p99 us':>12} {'update p50 us':>14} {'update p99 us':>14}")
+    layouts = (
+        ("json", legacy_store, legacy_status, legacy_update, lambda task: [task_key(task["id"])]),
+        ("hash", hash_store, lambda c, task_id: read_task_fields(c, task_id, TASK_STATUS_FIELDS), update_task,
+         lambda task: [task_key(task["id"]), task_prompt_key(task["id"])]),
+    )
+    for name, store, status, update, keys in layouts:
+        await client.flushall()
+        for task in tasks:
+            await store(client, task)
+        size, kind = await stored_bytes(client, [key for task in tasks for key in keys(task)])
+
+        ids = [rng.choice(tasks)["id"] for _ in range(args.reads)]
+        read_p50, read_p99 = await timed(lambda task_id=task_id: status(client, task_id) for task_id in ids)
+        update_p50, update_p99 = await timed(
+            lambda task_id=task_id: update(client, task_id, status="processing", progress=0.5) for task_id in ids
+        )
+        print(f"{name:>8} {size / args.tasks / 1024:>8.1f} {read_p50:>12.0f} {read_p99:>12.0f} "
+              f"{update_p50:>14.0f} {update_p99:>14.0f}")
+    print(f"(bytes from {'MEMORY USAGE' if kind == 'memory' else 'stored values'})")
+
+    message = {"type": "inference_request", "request_id": tasks[0]["id"], "request": tasks[0]}
+    for encoder, dumps in (("json", lambda m: json.dumps(m).encode()), ("orjson", orjson.dumps)):
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            dumps(message)
+        print(f"inbox message encode, {encoder}: {(time.perf_counter() - started) / args.reads * 1e6:.1f} us")
+
+    await client.flushall()
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=500)
+    parser.add_argument("--prompt-tokens", type=int, default=4096)
+    parser.add_argument("--reads", type=int, default=2000, help="Status reads and updates timed per layout")
+    parser.add_argument("--redis-url", help="Use this Redis instead of fakeredis (flushes it)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
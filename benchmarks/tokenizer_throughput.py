@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Prompt token counting on the API's request path: encoding each prompt
+inline on the event loop, each on a thread, and through
+tokenizer_service.TokenCounter, which batches concurrent prompts and caches
+counts of repeated ones.
+
+Requests arrive concurrently; a share of them (--repeat) reuse one of a few
+popular prompts, the way shared system prompts and retries do. Alongside
+throughput and latency it reports the longest the event loop was stalled.
+
+Uses --tokenizer (a tokenizer.json, e.g. from the model's repo) or, by
+default, a byte-level BPE trained on the spot so it runs offline.
+
+Usage: python benchmarks/tokenizer_throughput.py [--requests 5000] [--concurrency 256] [--words 200] [--repeat 0.5] [--tokenizer PATH]
+"""
+
+import argparse
+import asyncio
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "services" / "inference"))
+
+from tokenizers import Tokenizer, models, pre_tokenizers, trainers  # noqa: E402
+
+from tokenizer_service import TokenCounter  # noqa: E402
+
+WORDS = ("please summarise the following support ticket and list every action the customer asked for "
+         "including refunds shipping changes account updates and anything they said was urgent").split()
+
+
+def make_prompts(requests: int, words: int, repeat: float):
+    rng = random.Random(0)
+    popular = [" ".join(rng.choice(WORDS) for _ in range(words)) for _ in range(8)]
+    return [
+        rng.choice(popular) if rng.random() < repeat
+        else f"Ticket {i}: " + " ".join(rng.choice(WORDS) for _ in range(words))
+        for i in range(requests)
+    ]
+
+
+def train_tokenizer(prompts) -> Tokenizer:
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.train_from_iterator(prompts[:1000], trainers.BpeTrainer(vocab_size=4000, show_progress=False))
+    return tokenizer
+
+
+async def measure(count, prompts, concurrency: int):
+    """(req/s, p50 ms, p99 ms, longest event loop stall ms)"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, time.perf_counter() - started - 0.001)
+
+    async def one(prompt):
+        async with semaphore:
+            started = time.perf_counter()
+            await count(prompt)
+            latencies.append(time.perf_counter() - started)
+
+    tick = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(prompt) for prompt in prompts))
+    elapsed = time.perf_counter() - started
+    done = True
+    await tick
+    latencies.sort()
+    return (len(prompts) / elapsed, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000, stall * 1000)
+
+
+async def run(args):
+    prompts = make_prompts(args.requests, args.words, args.repeat)
+    tokenizer_dir = tempfile.mkdtemp()
+    try:
+        (Path(tokenizer_dir) / "bench").mkdir()
+        if args.tokenizer:
+            shutil.copy(args.tokenizer, Path(tokenizer_dir) / "bench" / "tokenizer.json")
+        else:
+            train_tokenizer(prompts).save(str(Path(tokenizer_dir) / "bench" / "tokenizer.json"))
+        tokenizer = Tokenizer.from_file(str(Path(tokenizer_dir) / "bench" / "tokenizer.json"))
+        loop = asyncio.get_running_loop()
+
+        async def inline(prompt):
+            return len(tokenizer.encode(prompt).ids)
+
+        async def threaded(prompt):
+            return len((await loop.run_in_executor(None, tokenizer.encode, prompt)).ids)
+
+        counter = TokenCounter({"bench": "unused"}, tokenizer_dir=tokenizer_dir)
+        await counter.start()
+        await counter.count("bench", "warm up")
+
+        print(f"{len(prompts)} prompts of {args.words} words, {args.repeat:.0%} repeated, concurrency {args.concurrency}")
+        print(f"{'counting':>18} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'stall ms':>9}")
+        for name, count in (("inline", inline), ("thread per prompt", threaded),
+                            ("TokenCounter", lambda prompt: counter.count("bench", prompt))):
+            rate, p50, p99, stall = await measure(count, prompts, args.concurrency)
+            print(f"{name:>18} {rate:>9.0f} {p50:>8.2f} {p99:>8.2f} {stall:>9.2f}")
+
+        stats = counter.stats()
+        print(f"TokenCounter: hit rate {stats['hit_rate']:.2f}, mean batch {stats['mean_batch_size']:.1f} prompts")
+        expected = [len(tokenizer.encode(prompt).ids) for prompt in prompts[:200]]
+        assert await counter.count_many("bench", prompts[:200]) == expected, "TokenCounter counts differ from encode()"
+        await counter.stop()
+    finally:
+        shutil.rmtree(tokenizer_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=256)
+    parser.add_argument("--words", type=int, default=200, help="Words per prompt")
+    parser.add_argument("--repeat", type=float, default=0.5, help="Share of requests reusing a popular prompt")
+    parser.add_argument("--tokenizer", help="tokenizer.json to count with instead of a freshly trained one")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
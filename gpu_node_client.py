@@ -6,16 +6,35 @@ and start earning FAR tokens by processing inference requests.
 """
 
 import asyncio
+import cProfile
+import ctypes
+import functools
+import gc
+import hashlib
+import importlib.metadata
+import importlib.util
+import io
 import json
 import logging
 import os
 import platform
+import pstats
 import subprocess
 import sys
-from typing import Dict, Any, Optional
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 
 import aiohttp
 import websockets
+from aiohttp import web
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Configure logging
 logging.basicConfig(
@@ -28,6 +47,582 @@ logger = logging.getLogger('gpu_node')
 PLATFORM_URL = "http://54.145.42.136:8000"  # Far Labs platform URL
 WS_URL = "ws://54.145.42.136:8000/ws"
 
+# Batching: requests arriving within the wait window share one generate call
+TEXT_MODEL_PATH = os.getenv("FARLABS_TEXT_MODEL", "gpt2")  # Use gpt2 for testing
+BATCH_MAX_SIZE = int(os.getenv("FARLABS_BATCH_MAX_SIZE", "8"))
+BATCH_WAIT_MS = float(os.getenv("FARLABS_BATCH_WAIT_MS", "10"))
+DEFAULT_MAX_NEW_TOKENS = 100
+
+# Weight precision: fp32, fp16, bf16 or int8 (dynamic quantization of the
+# linear layers, CPU only). "auto" is fp16 on a GPU and fp32 on CPU.
+LOAD_MODE = os.getenv("FARLABS_LOAD_MODE", "auto")
+# Per-model overrides, e.g. "llama=int8,whisper=fp16"
+MODEL_LOAD_MODES = dict(
+    entry.split("=", 1) for entry in os.getenv("FARLABS_MODEL_LOAD_MODES", "").split(",") if "=" in entry
+)
+# Bytes per weight in each mode; the platform sizes models at two (fp16)
+LOAD_MODE_BYTES = {"fp32": 4, "fp16": 2, "bf16": 2, "int8": 1}
+
+# Model cache: resident models are evicted least-recently-used past the budget
+MODEL_CACHE_GB = os.getenv("FARLABS_MODEL_CACHE_GB")  # default: 90% of VRAM, or half of RAM on CPU
+PINNED_MODELS = [m for m in os.getenv("FARLABS_PINNED_MODELS", "").split(",") if m]
+PREWARM_MODELS = [m for m in os.getenv("FARLABS_PREWARM_MODELS", "").split(",") if m]
+# Platform model ids and the local model that serves each: the text models
+# run on TEXT_MODEL_PATH. Extra entries as "platform-id=local,...".
+MODEL_ALIASES = {
+    "llama-70b": "llama", "mixtral-8x22b": "llama", "llama-405b": "llama",
+    **dict(entry.split("=", 1) for entry in os.getenv("FARLABS_MODEL_ALIASES", "").split(",") if "=" in entry)
+}
+
+# Prefix cache: key/values of recent prompt prefixes, so a prompt that starts
+# like an earlier one only prefills the rest (0 MB turns it off). Prefixes are
+# matched in blocks of this many tokens.
+PREFIX_CACHE_MB = float(os.getenv("FARLABS_PREFIX_CACHE_MB", "1024"))
+PREFIX_BLOCK_TOKENS = int(os.getenv("FARLABS_PREFIX_BLOCK_TOKENS", "32"))
+
+# Model loading and generation run on these threads so the websocket stays live
+INFERENCE_THREADS = int(os.getenv("FARLABS_INFERENCE_THREADS", "1"))
+MAX_IN_FLIGHT = int(os.getenv("FARLABS_MAX_IN_FLIGHT", "2"))
+# Requests the platform may have outstanding on this node; one batch by default
+MAX_CONCURRENCY = int(os.getenv("FARLABS_MAX_CONCURRENCY", str(BATCH_MAX_SIZE)))
+
+# Registration details the platform can't detect
+NODE_LOCATION = os.getenv("FARLABS_LOCATION", "unknown")
+NODE_BANDWIDTH_MBPS = float(os.getenv("FARLABS_BANDWIDTH_MBPS", "100"))
+# Startup: the GPU probe is cached here, keyed by the torch and driver
+# versions, so a restart needn't import torch before registering ("" to
+# always probe). Models load after the node connects unless
+# FARLABS_LOAD_IN_BACKGROUND is false.
+CAPABILITY_CACHE = os.getenv(
+    "FARLABS_CAPABILITY_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "farlabs", "capabilities.json")
+)
+LOAD_IN_BACKGROUND = os.getenv("FARLABS_LOAD_IN_BACKGROUND", "true").lower() == "true"
+
+# Websocket frames: binary msgpack when installed, else JSON text
+FRAME_ENCODING = os.getenv("FARLABS_FRAME_ENCODING", "msgpack" if msgpack else "json")
+# Close code from the platform when it no longer knows this node
+UNKNOWN_NODE = 4404
+
+# Telemetry: every response carries its timings; recent ones are summarised
+# on http://127.0.0.1:FARLABS_METRICS_PORT/metrics (0 turns that off)
+METRICS_PORT = int(os.getenv("FARLABS_METRICS_PORT", "9400"))
+ALLOW_PROFILING = os.getenv("FARLABS_ALLOW_PROFILING", "true").lower() == "true"
+PROFILERS = ("cprofile", "torch")
+PROFILE_ROWS = 25
+
+class StepTimer:
+    """generate() streamer that only notes when each step finishes
+
+    generate() calls put() once with the prompt and then once per decoding
+    step, so the first gap is prefill and the rest is decode.
+    """
+
+    def __init__(self):
+        self.prompt_at = None
+        self.first_token_at = None
+        self.last_token_at = None
+        self.steps = 0
+
+    def put(self, value):
+        now = time.perf_counter()
+        if self.prompt_at is None:
+            self.prompt_at = now
+            return
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.last_token_at = now
+        self.steps += 1
+
+    def end(self):
+        pass
+
+    def timings(self) -> Dict[str, float]:
+        if self.first_token_at is None:
+            return {}
+        decode_seconds = self.last_token_at - self.first_token_at
+        return {
+            "prefill_ms": (self.first_token_at - self.prompt_at) * 1000,
+            "decode_tokens_per_second": (self.steps - 1) / decode_seconds if decode_seconds > 0 else 0.0
+        }
+
+def peak_memory_mb(device) -> float:
+    """Peak memory since the last reset on CUDA, else the process's peak RSS"""
+    import torch
+    if device.type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 1024**2
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 1024**2 if platform.system() == "Darwin" else peak / 1024
+
+def probe_fingerprint() -> Dict[str, str]:
+    """What the GPU probe depends on, read without importing torch"""
+    try:
+        torch_version = importlib.metadata.version("torch")
+    except importlib.metadata.PackageNotFoundError:
+        torch_version = ""
+    try:
+        with open("/proc/driver/nvidia/version") as f:
+            driver = f.readline().strip()
+    except OSError:
+        driver = ""
+    return {
+        "torch": torch_version,
+        "driver": driver,
+        "visible_devices": os.getenv("CUDA_VISIBLE_DEVICES", ""),
+        "machine": f"{platform.system()} {platform.machine()}"
+    }
+
+def load_cached_probe(path: str = CAPABILITY_CACHE) -> Optional[Dict[str, Any]]:
+    """The cached GPU probe, if it was taken with the current torch and driver"""
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("fingerprint") != probe_fingerprint():
+        return None
+    return cached.get("capabilities")
+
+def save_probe(capabilities: Dict[str, Any], path: str = CAPABILITY_CACHE):
+    if not path:
+        return
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Written whole then renamed, so a crash can't leave half a file
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"fingerprint": probe_fingerprint(), "capabilities": capabilities}, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logger.warning(f"Could not cache the GPU probe: {e}")
+
+def import_model_libraries():
+    """Import torch and transformers, the slowest part of a cold start"""
+    import torch  # noqa: F401
+    from transformers import AutoModelForCausalLM, AutoTokenizer  # noqa: F401
+
+def resolve_snapshot(path: str) -> str:
+    """A local directory for path: path itself, or its downloaded Hub snapshot
+
+    Loading from the snapshot directory skips the Hub's per-file freshness
+    checks, which cost round trips on every restart and time out offline.
+    """
+    if os.path.isdir(path):
+        return path
+    try:
+        from huggingface_hub import snapshot_download
+        return snapshot_download(path, local_files_only=True)
+    except Exception:
+        # Not downloaded yet: from_pretrained fetches it
+        return path
+
+def resolve_load_mode(mode: str, device: str) -> str:
+    """The mode to load with on device, falling back where it is unsupported"""
+    if mode == "auto":
+        return "fp32" if device == "cpu" else "fp16"
+    if mode not in LOAD_MODE_BYTES:
+        logger.warning(f"Unknown load mode {mode!r}; loading fp32")
+        return "fp32"
+    if mode == "fp16" and device == "cpu":
+        # CPU kernels such as layer norm have no fp16 version
+        logger.warning("fp16 is not supported on CPU; loading bf16")
+        return "bf16"
+    if mode == "int8" and device != "cpu":
+        logger.warning(f"int8 dynamic quantization runs on CPU only; loading fp16 on {device}")
+        return "fp16"
+    return mode
+
+def quantize_int8(model):
+    """Quantize the model's linear layers to int8 weights, dynamically quantized activations
+
+    GPT-2 style Conv1D layers are turned into Linear first so they are
+    quantized too. The output embeddings stay as they are: they are usually
+    tied to the input embeddings, and quantizing them costs the most quality.
+    """
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                linear = torch.nn.Linear(child.weight.shape[0], child.nf, device="meta")
+                linear.weight = torch.nn.Parameter(child.weight.t().contiguous())
+                linear.bias = child.bias
+                setattr(parent, name, linear)
+
+    output = model.get_output_embeddings()
+    layers = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and module is not output
+    }
+    # In place: a copy would hold the fp32 and int8 weights at once
+    return torch.ao.quantization.quantize_dynamic(model, layers, dtype=torch.qint8, inplace=True)
+
+def model_footprint_bytes(model) -> int:
+    """Bytes of a model's weights and buffers, tied weights counted once"""
+    import torch
+
+    tensors = {}
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        tensors[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+    footprint = sum(tensors.values())
+    # Quantized layers keep their weights packed, outside parameters()
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            footprint += sum(t.numel() * t.element_size() for t in module._weight_bias() if t is not None)
+    return footprint
+
+def release_freed_memory():
+    """Hand memory freed while loading (fp32 weights replaced by converted
+    ones) back to the OS; glibc otherwise keeps it for the process"""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def load_text_model(path: str, mode: str, device: str):
+    """(model, tokenizer) for a causal LM, loaded in mode and placed on device"""
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    path = resolve_snapshot(path)
+    dtype = {"fp16": torch.float16, "bf16": torch.bfloat16}.get(mode, torch.float32)
+    # safetensors checkpoints are memory-mapped rather than read and unpickled
+    safetensors = os.path.isdir(path) and any(name.endswith(".safetensors") for name in os.listdir(path))
+    # Builds the model on the meta device and fills in the checkpoint's
+    # weights, instead of randomly initialising every layer only to overwrite it
+    model = AutoModelForCausalLM.from_pretrained(
+        path, torch_dtype=dtype, use_safetensors=safetensors or None, low_cpu_mem_usage=True
+    )
+    if mode == "int8":
+        model = quantize_int8(model)
+        release_freed_memory()
+    tokenizer = AutoTokenizer.from_pretrained(path)
+    # Decoder-only models must be left padded to batch prompts
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # Place the model once; requests move only their inputs
+    return model.to(device).eval(), tokenizer
+
+def warm_up_model(model, tokenizer):
+    """Generate one token, which sets up the kernels the first request would otherwise wait for"""
+    import torch
+
+    inputs = tokenizer("Hello", return_tensors="pt").to(model.device)
+    with torch.inference_mode():
+        model.generate(**inputs, max_new_tokens=1, do_sample=False, pad_token_id=tokenizer.pad_token_id)
+
+class BatchScheduler:
+    """Collects inference requests into batches and fans results back out"""
+
+    def __init__(self, run_batch, max_batch_size: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_stats = deque(maxlen=100)
+        self.queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._runner is None:
+            self.queue = asyncio.Queue()
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+
+    async def submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a request and wait for its result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(pending) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests cancelled while they waited are left out of the batch
+            pending = [entry for entry in pending if not entry[1].done()]
+            for group in self._group(pending):
+                await self._execute(group)
+
+    @staticmethod
+    def _group(pending: List[Tuple[Dict[str, Any], asyncio.Future, float]]):
+        """Split a batch by model and sampling settings, which generate() shares"""
+        groups: Dict[tuple, list] = {}
+        for entry in pending:
+            request = entry[0]
+            key = (
+                request.get("model", "llama"),
+                request.get("temperature", 0.7),
+                request.get("top_p", 1.0)
+            )
+            groups.setdefault(key, []).append(entry)
+        return groups.values()
+
+    async def _execute(self, group):
+        requests = [request for request, _, _ in group]
+        started = time.perf_counter()
+        try:
+            results = await self.run_batch(requests)
+        except Exception as e:
+            logger.error(f"Batch inference error: {e}")
+            results = [{"error": str(e)}] * len(requests)
+        elapsed = time.perf_counter() - started
+
+        tokens = sum(r.get("tokens_generated", 0) for r in results)
+        stats = {
+            "batch_size": len(requests),
+            "tokens_generated": tokens,
+            "seconds": elapsed,
+            "tokens_per_second": tokens / elapsed if elapsed > 0 else 0.0
+        }
+        self.batch_stats.append(stats)
+        logger.info(
+            f"Batch of {stats['batch_size']}: {tokens} tokens in {elapsed:.2f}s "
+            f"({stats['tokens_per_second']:.1f} tok/s)"
+        )
+
+        for (_, future, queued_at), result in zip(group, results):
+            if "error" not in result:
+                result.setdefault("timings", {})["queue_wait_ms"] = (started - queued_at) * 1000
+            if not future.done():
+                future.set_result(result)
+
+class ModelCache:
+    """Resident models under a memory budget, evicted least-recently-used"""
+
+    def __init__(self, loader, budget_bytes: int, pinned: Optional[List[str]] = None, on_evict=None):
+        self.loader = loader
+        self.on_evict = on_evict
+        self.budget_bytes = budget_bytes
+        self.pinned = set(pinned or [])
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds: deque = deque(maxlen=100)
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def __contains__(self, model_name: str) -> bool:
+        return model_name in self.entries
+
+    @property
+    def used_bytes(self) -> int:
+        return sum(entry.get("bytes", 0) for entry in self.entries.values())
+
+    async def get(self, model_name: str) -> Optional[Dict[str, Any]]:
+        """Return a resident model, loading it (and evicting others) on a miss"""
+        if model_name in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(model_name)
+            return self.entries[model_name]
+
+        # Concurrent requests for the same model wait for a single load
+        lock = self._locks.setdefault(model_name, asyncio.Lock())
+        async with lock:
+            if model_name in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(model_name)
+                return self.entries[model_name]
+
+            self.misses += 1
+            started = time.perf_counter()
+            model_data = await self.loader(model_name)
+            if not model_data:
+                return None
+
+            elapsed = time.perf_counter() - started
+            self.load_seconds.append(elapsed)
+            self._make_room(model_data.get("bytes", 0))
+            self.entries[model_name] = model_data
+            logger.info(
+                f"Model {model_name} resident: {model_data.get('bytes', 0) / 1024**3:.2f}GB, "
+                f"loaded in {elapsed:.1f}s, cache {self.used_bytes / 1024**3:.2f}/"
+                f"{self.budget_bytes / 1024**3:.2f}GB"
+            )
+            return model_data
+
+    def _make_room(self, needed: int):
+        for model_name in list(self.entries):
+            if self.used_bytes + needed <= self.budget_bytes:
+                return
+            if model_name in self.pinned:
+                continue
+            self.entries.pop(model_name)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(model_name)
+            logger.info(f"Evicted model {model_name} from cache")
+
+        if self.used_bytes + needed > self.budget_bytes:
+            logger.warning("Model cache over budget: remaining models are pinned or the model is larger than the budget")
+
+        # This runs on the event loop: never pay for importing torch here.
+        # Until a model load has imported it there is no CUDA cache to empty
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "resident": list(self.entries),
+            "load_modes": {name: entry.get("load_mode") for name, entry in self.entries.items()},
+            "used_gb": self.used_bytes / 1024**3,
+            "budget_gb": self.budget_bytes / 1024**3,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "avg_load_seconds": sum(self.load_seconds) / len(self.load_seconds) if self.load_seconds else 0.0
+        }
+
+def legacy_key_values(past) -> Tuple:
+    """A model's key/values as one (key, value) pair per layer"""
+    return past.to_legacy_cache() if hasattr(past, "to_legacy_cache") else past
+
+def model_key_values(key_values: Optional[Tuple]):
+    """(key, value) pairs in the form the installed transformers passes to models"""
+    if key_values is None:
+        return None
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        # Releases before cache classes take the pairs as they are
+        return key_values
+    return DynamicCache.from_legacy_cache(key_values)
+
+def key_values_bytes(key_values: Tuple) -> int:
+    return sum(t.numel() * t.element_size() for layer in key_values for t in layer)
+
+class PrefixCache:
+    """Key/values of prompt prefixes under a memory cap, evicted least-recently-used
+
+    Prompts are cut into blocks of block_tokens and each block-aligned
+    prefix is identified by a hash chained over its blocks. An entry holds
+    the key/values of one prompt's longest block-aligned prefix, and every
+    shorter prefix of it points at the entry, so a later prompt that shares
+    only the first few blocks still reuses those.
+    """
+
+    def __init__(self, budget_bytes: int, block_tokens: int = PREFIX_BLOCK_TOKENS):
+        self.budget_bytes = budget_bytes
+        self.block_tokens = block_tokens
+        self.entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self.index: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+        self.prompt_tokens = 0
+        # Generation may run on several inference threads
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.budget_bytes > 0
+
+    def prefix_hashes(self, tokens: List[int]) -> List[str]:
+        """Hash of each block-aligned prefix that leaves at least one token to prefill"""
+        hashes, digest = [], b""
+        for end in range(self.block_tokens, len(tokens), self.block_tokens):
+            block = ",".join(map(str, tokens[end - self.block_tokens:end])).encode()
+            digest = hashlib.blake2b(digest + block, digest_size=16).digest()
+            hashes.append(digest.hex())
+        return hashes
+
+    def lookup(self, model_name: str, tokens: List[int]) -> Tuple[int, Optional[Tuple]]:
+        """Longest cached prefix of the prompt: (its length, its key/values)"""
+        with self._lock:
+            self.prompt_tokens += len(tokens)
+            hashes = self.prefix_hashes(tokens)
+            for blocks in range(len(hashes), 0, -1):
+                entry_key = self.index.get((model_name, hashes[blocks - 1]))
+                if entry_key is None:
+                    continue
+                self.entries.move_to_end(entry_key)
+                length = blocks * self.block_tokens
+                self.hits += 1
+                self.reused_tokens += length
+                key_values = self.entries[entry_key]["key_values"]
+                return length, tuple((k[:, :, :length], v[:, :, :length]) for k, v in key_values)
+            self.misses += 1
+            return 0, None
+
+    def store(self, model_name: str, tokens: List[int], key_values: Tuple):
+        """Keep the key/values of the prompt's longest block-aligned prefix
+
+        key_values covers the prompt up to at least that prefix.
+        """
+        hashes = self.prefix_hashes(tokens)
+        if not hashes:
+            return
+        entry_key = (model_name, hashes[-1])
+        with self._lock:
+            if entry_key in self.index:
+                return
+        length = len(hashes) * self.block_tokens
+        # Copies, so the entry doesn't keep the whole generation's tensors alive
+        key_values = tuple((k[:, :, :length].clone(), v[:, :, :length].clone()) for k, v in key_values)
+        size = key_values_bytes(key_values)
+        if size > self.budget_bytes:
+            return
+
+        with self._lock:
+            if entry_key in self.entries:
+                return
+            while self.entries and self.used_bytes + size > self.budget_bytes:
+                self._evict()
+            self.entries[entry_key] = {"key_values": key_values, "bytes": size, "hashes": hashes}
+            self.used_bytes += size
+            for digest in hashes:
+                self.index[(model_name, digest)] = entry_key
+
+    def _evict(self):
+        entry_key, entry = self.entries.popitem(last=False)
+        self.used_bytes -= entry["bytes"]
+        self.evictions += 1
+        for digest in entry["hashes"]:
+            if self.index.get((entry_key[0], digest)) == entry_key:
+                del self.index[(entry_key[0], digest)]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "used_mb": self.used_bytes / 1024**2,
+            "budget_mb": self.budget_bytes / 1024**2,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            # Share of prompt tokens that skipped prefill
+            "token_reuse": self.reused_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        }
+
 class GPUNodeClient:
     def __init__(self, wallet_address: str, node_name: Optional[str] = None):
         self.wallet_address = wallet_address
@@ -35,15 +630,41 @@ class GPUNodeClient:
         self.session = None
         self.ws = None
         self.capabilities = self._detect_capabilities()
-        self.models_loaded = {}
+        self.scheduler = BatchScheduler(self.process_batch)
+        self.executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+        self.in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self.request_slots = asyncio.Semaphore(MAX_CONCURRENCY)
+        self.active_requests: Dict[str, asyncio.Task] = {}
+        # Per model: loading, ready or failed; sent to the platform as it changes
+        self.model_states: Dict[str, str] = {}
+        self._prewarming: Optional[asyncio.Task] = None
+        self.model_cache = ModelCache(
+            self._load_model, self._cache_budget_bytes(), PINNED_MODELS,
+            on_evict=lambda model_name: self._set_model_state(model_name, None)
+        )
+        self.prefix_cache = PrefixCache(int(PREFIX_CACHE_MB * 1024**2))
+        self.recent_timings = deque(maxlen=200)
+        self.requests_served = 0
 
     def _detect_capabilities(self) -> Dict[str, Any]:
-        """Detect GPU capabilities"""
+        """Detect GPU capabilities, from the cached probe when it is still valid"""
         capabilities = {
             "platform": platform.system(),
             "python_version": sys.version,
-            "models_supported": []
+            "max_concurrency": MAX_CONCURRENCY
         }
+        probe = load_cached_probe()
+        if probe is None:
+            probe = self._probe_gpu()
+            save_probe(probe)
+        else:
+            logger.info(f"Using cached GPU probe: {probe.get('gpu_model', 'no GPU')}")
+        capabilities.update(probe)
+        return capabilities
+
+    def _probe_gpu(self) -> Dict[str, Any]:
+        """Probe the GPU through torch, which takes seconds to import"""
+        capabilities = {"models_supported": []}
 
         # Try to detect NVIDIA GPU
         try:
@@ -78,18 +699,25 @@ class GPUNodeClient:
         return capabilities
 
     async def register_node(self):
-        """Register this node with the platform"""
+        """Register this node with the platform, which assigns its node id"""
         async with aiohttp.ClientSession() as session:
             data = {
-                "node_id": self.node_id,
                 "wallet_address": self.wallet_address,
-                "capabilities": self.capabilities
+                "gpu_model": self.capabilities.get("gpu_model", "CPU"),
+                "vram": self.model_memory_gb(),
+                "bandwidth": NODE_BANDWIDTH_MBPS,
+                "cuda_cores": self.capabilities.get("cuda_cores", 0),
+                "location": NODE_LOCATION,
+                "max_concurrency": MAX_CONCURRENCY,
+                # Lets the platform fit models to the weights' real size
+                "load_mode": self.load_mode("llama")
             }
 
             try:
                 async with session.post(f"{PLATFORM_URL}/api/node/register", json=data) as resp:
                     if resp.status == 200:
                         result = await resp.json()
+                        self.node_id = result["node_id"]
                         logger.info(f"✅ Node registered successfully: {result}")
                         return True
                     else:
@@ -99,122 +727,581 @@ class GPUNodeClient:
                 logger.error(f"Error registering node: {e}")
                 return False
 
+    async def run_blocking(self, fn, *args):
+        """Run blocking model work on the inference executor"""
+        async with self.in_flight:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    def _cache_budget_bytes(self) -> int:
+        if MODEL_CACHE_GB:
+            return int(float(MODEL_CACHE_GB) * 1024**3)
+        if self.capabilities.get("vram"):
+            return int(self.capabilities["vram"] * 0.9 * 1024**3)
+        try:
+            return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2
+        except (ValueError, OSError, AttributeError):
+            return 8 * 1024**3
+
+    def model_memory_gb(self) -> int:
+        """Memory this node registers for models: VRAM, or its RAM budget on CPU"""
+        if self.capabilities.get("vram"):
+            return int(self.capabilities["vram"])
+        return max(1, self._cache_budget_bytes() // 1024**3)
+
+    def _target_device(self) -> str:
+        """Device models live on for as long as they are resident"""
+        if not self.capabilities.get("gpu_available"):
+            return "cpu"
+        if self.capabilities.get("gpu_model") == "Apple Silicon (MPS)":
+            return "mps"
+        return "cuda"
+
+    def load_mode(self, model_name: str) -> str:
+        """Weight precision model_name loads with on this node"""
+        return resolve_load_mode(MODEL_LOAD_MODES.get(model_name, LOAD_MODE), self._target_device())
+
     async def load_model(self, model_name: str):
         """Load a model for inference"""
-        if model_name in self.models_loaded:
-            return self.models_loaded[model_name]
+        return await self.model_cache.get(model_name)
 
+    async def prewarm(self, model_names: List[str] = PREWARM_MODELS):
+        """Load models named at startup before requests arrive"""
+        for model_name in model_names:
+            self._set_model_state(model_name, "loading")
+        if model_names:
+            # The first request pays for these imports otherwise
+            await self.run_blocking(import_model_libraries)
+        for model_name in model_names:
+            await self.load_model(model_name)
+
+    async def _load_model(self, model_name: str) -> Optional[Dict[str, Any]]:
         logger.info(f"Loading model: {model_name}")
+        self._set_model_state(model_name, "loading")
+        try:
+            model_data = await self.run_blocking(self._load_model_sync, model_name)
+        except Exception as e:
+            logger.error(f"Failed to load model {model_name}: {e}")
+            model_data = None
+        self._set_model_state(model_name, "ready" if model_data else "failed")
+        return model_data
+
+    def _set_model_state(self, model_name: str, state: Optional[str]):
+        """Record a model's readiness (None once evicted) and tell the platform"""
+        if state is None:
+            self.model_states.pop(model_name, None)
+        else:
+            self.model_states[model_name] = state
+        if self.ws is not None:
+            message = self.encode({"type": "model_status", "models": {model_name: state}})
+            asyncio.get_running_loop().create_task(self._send_quietly(message))
 
+    async def _send_quietly(self, message):
         try:
-            if model_name == "llama":
-                # Example: Load Llama model
-                from transformers import AutoModelForCausalLM, AutoTokenizer
-                model = AutoModelForCausalLM.from_pretrained("gpt2")  # Use gpt2 for testing
-                tokenizer = AutoTokenizer.from_pretrained("gpt2")
-                self.models_loaded[model_name] = {"model": model, "tokenizer": tokenizer}
+            await self.ws.send(message)
+        except websockets.ConnectionClosed:
+            # The next register message carries every state
+            pass
 
-            elif model_name == "stable-diffusion":
-                # Example: Load Stable Diffusion
-                logger.info("Stable Diffusion support coming soon")
+    def _load_model_sync(self, model_name: str) -> Optional[Dict[str, Any]]:
+        if model_name == "llama":
+            # Example: Load Llama model
+            mode = self.load_mode(model_name)
+            model, tokenizer = load_text_model(TEXT_MODEL_PATH, mode, self._target_device())
+            warm_up_model(model, tokenizer)
+            footprint = model_footprint_bytes(model)
+            logger.info(f"✅ Model {model_name} loaded successfully ({mode}, {footprint / 1024**2:.0f}MB)")
+            return {"model": model, "tokenizer": tokenizer, "bytes": footprint, "load_mode": mode}
 
-            elif model_name == "whisper":
-                # Example: Load Whisper
-                logger.info("Whisper support coming soon")
+        elif model_name == "stable-diffusion":
+            # Example: Load Stable Diffusion
+            logger.info("Stable Diffusion support coming soon")
 
-            logger.info(f"✅ Model {model_name} loaded successfully")
-            return self.models_loaded.get(model_name)
+        elif model_name == "whisper":
+            # Example: Load Whisper
+            logger.info("Whisper support coming soon")
 
-        except Exception as e:
-            logger.error(f"Failed to load model {model_name}: {e}")
-            return None
+        return None
 
     async def process_inference(self, request: Dict[str, Any]) -> Dict[str, Any]:
         """Process an inference request"""
+        logger.info(
+            f"Processing inference request: model={request.get('model', 'llama')}, "
+            f"prompt_length={len(request.get('prompt', ''))}"
+        )
+        if ALLOW_PROFILING and request.get("profile") in PROFILERS:
+            return await self.process_profiled(request)
+        return await self.scheduler.submit(request)
+
+    async def process_profiled(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one request outside the batcher under the profiler it asked for
+
+        The report covers only this request; streaming requests are not
+        profiled.
+        """
         model_name = request.get("model", "llama")
-        prompt = request.get("prompt", "")
+        model_data = await self.load_model(model_name)
+        if not model_data or model_name != "llama":
+            return {"error": f"Model {model_name} not available"}
+
+        try:
+            results, report = await self.run_blocking(
+                self._profiled, request["profile"], self._generate_batch_sync, model_name, model_data, [request]
+            )
+        except Exception as e:
+            logger.error(f"Profiled inference error: {e}")
+            return {"error": str(e)}
+        return {**results[0], "profile": report}
+
+    @staticmethod
+    def _profiled(kind: str, fn, *args):
+        """Call fn under cProfile or the torch CPU profiler; returns (result, report)"""
+        if kind == "torch":
+            from torch.profiler import ProfilerActivity, profile
+            with profile(activities=[ProfilerActivity.CPU]) as profiler:
+                result = fn(*args)
+            return result, profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=PROFILE_ROWS)
+
+        profiler = cProfile.Profile()
+        result = profiler.runcall(fn, *args)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_ROWS)
+        return result, report.getvalue()
 
-        logger.info(f"Processing inference request: model={model_name}, prompt_length={len(prompt)}")
+    async def process_batch(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run one batch of requests that share model and sampling settings"""
+        model_name = requests[0].get("model", "llama")
 
         # Load model if needed
         model_data = await self.load_model(model_name)
 
-        if not model_data:
+        if not model_data or model_name != "llama":
+            return [{"error": f"Model {model_name} not available"}] * len(requests)
+
+        return await self.run_blocking(self._generate_batch_sync, model_name, model_data, requests)
+
+    def _generate_batch_sync(
+        self, model_name: str, model_data: Dict[str, Any], requests: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        import torch
+
+        model = model_data["model"]
+        tokenizer = model_data["tokenizer"]
+        prompts = [r.get("prompt", "") for r in requests]
+        max_new_tokens = [r.get("max_tokens", DEFAULT_MAX_NEW_TOKENS) for r in requests]
+
+        started = time.perf_counter()
+        if model.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(model.device)
+        inputs, tokenized, prefix = self._prepare_inputs(model_name, model, tokenizer, prompts)
+        steps = StepTimer()
+
+        # Generate responses for the whole batch
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max(max_new_tokens),
+                pad_token_id=tokenizer.pad_token_id,
+                streamer=steps,
+                **self._sampling_kwargs(requests[0])
+            )
+        generated = time.perf_counter()
+
+        prompt_length = inputs["input_ids"].shape[1]
+        results = []
+        for i, row in enumerate(outputs):
+            # Each request only keeps the tokens it asked for, up to EOS
+            new_tokens = row[prompt_length:prompt_length + max_new_tokens[i]].tolist()
+            if tokenizer.eos_token_id in new_tokens:
+                new_tokens = new_tokens[:new_tokens.index(tokenizer.eos_token_id)]
+            prompt_tokens = inputs["input_ids"][i][inputs["attention_mask"][i].bool()].tolist()
+
+            results.append({
+                "status": "success",
+                "response": tokenizer.decode(prompt_tokens + new_tokens, skip_special_tokens=True),
+                "model": model_name,
+                "prompt_tokens": len(prompt_tokens),
+                "tokens_generated": len(new_tokens),
+                "batch_size": len(requests)
+            })
+
+        timings = {
+            "tokenize_ms": (tokenized - started) * 1000,
+            **self._prefill_timings(steps, prefix),
+            "detokenize_ms": (time.perf_counter() - generated) * 1000,
+            "peak_memory_mb": peak_memory_mb(model.device)
+        }
+        for result in results:
+            result["timings"] = dict(timings)
+        return results
+
+    def _prepare_inputs(self, model_name: str, model, tokenizer, prompts: List[str]):
+        """generate() inputs for a batch of prompts, left padded
+
+        With the prefix cache on, prompts are prefilled here up to their
+        last token, starting from the longest cached prefix each has, and the
+        key/values go to generate() as past_key_values, so generate() only
+        runs the last prompt token before decoding. Prompts with cached
+        prefixes of the same length (all the misses, say) prefill together
+        in one batch. Returns the inputs, when tokenizing finished and
+        {"prefill_seconds", "reused_tokens"}.
+        """
+        import torch
+
+        if not self.prefix_cache.enabled:
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True, max_length=512, truncation=True)
+            inputs = {k: v.to(model.device) for k, v in inputs.items()}
+            return inputs, time.perf_counter(), {}
+
+        rows = tokenizer(prompts, max_length=512, truncation=True)["input_ids"]
+        tokenized = time.perf_counter()
+        width = max(len(row) for row in rows)
+        pasts, reused = [], 0
+        # Rows left to prefill, by the length of their cached prefix
+        groups: Dict[int, List[int]] = {}
+        for i, row in enumerate(rows):
+            length, past = self.prefix_cache.lookup(model_name, row)
+            reused += length
+            pasts.append(past)
+            if len(row) - 1 > length:
+                groups.setdefault(length, []).append(i)
+        for length, members in groups.items():
+            prefilled = self._prefill(
+                model, length, [pasts[i] for i in members], [rows[i][length:-1] for i in members]
+            )
+            for i, past in zip(members, prefilled):
+                pasts[i] = past
+                self.prefix_cache.store(model_name, rows[i], past)
+
+        # Rows are left padded to the widest prompt; the padding is masked
+        input_ids = torch.full((len(rows), width), tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), width), dtype=torch.long)
+        for i, row in enumerate(rows):
+            input_ids[i, width - len(row):] = torch.tensor(row)
+            attention_mask[i, width - len(row):] = 1
+        inputs = {"input_ids": input_ids.to(model.device), "attention_mask": attention_mask.to(model.device)}
+
+        shape = next((past for past in pasts if past is not None), None)
+        if shape is not None:
+            layers = []
+            for layer, (key, value) in enumerate(shape):
+                keys, values = [], []
+                for past in pasts:
+                    k, v = past[layer] if past is not None else (key[:, :, :0], value[:, :, :0])
+                    padding = (0, 0, width - 1 - k.shape[2], 0)
+                    keys.append(torch.nn.functional.pad(k, padding))
+                    values.append(torch.nn.functional.pad(v, padding))
+                layers.append((torch.cat(keys), torch.cat(values)))
+            inputs["past_key_values"] = model_key_values(tuple(layers))
+        prefix = {"prefill_seconds": time.perf_counter() - tokenized, "reused_tokens": reused}
+        return inputs, tokenized, prefix
+
+    @staticmethod
+    def _prefill(model, length: int, pasts: List[Optional[Tuple]], heads: List[List[int]]) -> List[Tuple]:
+        """Key/values of each row's cached prefix (length tokens) plus its head, in one forward pass
+
+        Heads are left padded to the widest; the padding is masked, given no
+        positions, and cut out of each row's key/values.
+        """
+        import torch
+
+        width = max(len(head) for head in heads)
+        input_ids = torch.zeros((len(heads), width), dtype=torch.long)
+        attention_mask = torch.zeros((len(heads), length + width), dtype=torch.long)
+        attention_mask[:, :length] = 1
+        for i, head in enumerate(heads):
+            input_ids[i, width - len(head):] = torch.tensor(head)
+            attention_mask[i, length + width - len(head):] = 1
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, length:]
+        past = None
+        if length:
+            past = tuple(
+                (torch.cat([p[layer][0] for p in pasts]), torch.cat([p[layer][1] for p in pasts]))
+                for layer in range(len(pasts[0]))
+            )
+        with torch.no_grad():
+            outputs = model(
+                input_ids=input_ids.to(model.device),
+                attention_mask=attention_mask.to(model.device),
+                position_ids=position_ids.to(model.device),
+                past_key_values=model_key_values(past),
+                use_cache=True
+            )
+        layers = legacy_key_values(outputs.past_key_values)
+
+        prefilled = []
+        for i, head in enumerate(heads):
+            keep = torch.cat([torch.arange(length), torch.arange(length + width - len(head), length + width)])
+            keep = keep.to(model.device)
+            prefilled.append(tuple((k[i:i + 1, :, keep], v[i:i + 1, :, keep]) for k, v in layers))
+        return prefilled
+
+    @staticmethod
+    def _prefill_timings(steps: StepTimer, prefix: Dict[str, Any]) -> Dict[str, float]:
+        """Step timings, with prompt tokens prefilled before generate() counted as prefill"""
+        timings = steps.timings()
+        if prefix:
+            timings["prefill_ms"] = timings.get("prefill_ms", 0.0) + prefix["prefill_seconds"] * 1000
+            timings["prefix_tokens_reused"] = prefix["reused_tokens"]
+        return timings
+
+    @staticmethod
+    def _sampling_kwargs(request: Dict[str, Any]) -> Dict[str, Any]:
+        temperature = request.get("temperature", 0.7)
+        if temperature > 0:
+            return {"do_sample": True, "temperature": temperature, "top_p": request.get("top_p", 1.0)}
+        return {"do_sample": False}
+
+    async def process_streaming(self, request: Dict[str, Any], on_text) -> Dict[str, Any]:
+        """Run one request on its own, passing text to on_text as it is generated
+
+        Streaming requests skip the batch scheduler because HF streamers
+        only follow a single sequence.
+        """
+        model_name = request.get("model", "llama")
+        model_data = await self.load_model(model_name)
+        if not model_data or model_name != "llama":
             return {"error": f"Model {model_name} not available"}
 
-        try:
-            if model_name == "llama":
-                # Run inference
-                model = model_data["model"]
-                tokenizer = model_data["tokenizer"]
-
-                inputs = tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True)
-
-                # Move to GPU if available
-                if self.capabilities.get("gpu_available"):
-                    import torch
-                    if torch.cuda.is_available():
-                        model = model.cuda()
-                        inputs = {k: v.cuda() for k, v in inputs.items()}
-
-                # Generate response
-                with torch.no_grad():
-                    outputs = model.generate(
-                        **inputs,
-                        max_new_tokens=100,
-                        temperature=0.7,
-                        do_sample=True
-                    )
-
-                response = tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-                return {
-                    "status": "success",
-                    "response": response,
-                    "model": model_name,
-                    "tokens_generated": len(outputs[0]) - len(inputs['input_ids'][0])
-                }
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        arrived = time.perf_counter()
+
+        def emit(text: str):
+            loop.call_soon_threadsafe(chunks.put_nowait, text)
 
+        def generate(*args):
+            waited = time.perf_counter() - arrived
+            result = self._generate_stream_sync(*args)
+            result.setdefault("timings", {})["queue_wait_ms"] = waited * 1000
+            return result
+
+        generation = asyncio.create_task(
+            self.run_blocking(generate, model_name, model_data, request, emit)
+        )
+        # Text emitted by the generator thread is queued before this runs
+        generation.add_done_callback(lambda _: chunks.put_nowait(None))
+        while (text := await chunks.get()) is not None:
+            await on_text(text)
+
+        try:
+            return await generation
         except Exception as e:
             logger.error(f"Inference error: {e}")
             return {"error": str(e)}
 
+    def _generate_stream_sync(
+        self, model_name: str, model_data: Dict[str, Any], request: Dict[str, Any], emit
+    ) -> Dict[str, Any]:
+        import torch
+        from transformers import TextStreamer
+
+        steps = StepTimer()
+
+        class QueueStreamer(TextStreamer):
+            def put(self, value):
+                steps.put(value)
+                super().put(value)
+
+            def on_finalized_text(self, text: str, stream_end: bool = False):
+                if text:
+                    emit(text)
+
+        model = model_data["model"]
+        tokenizer = model_data["tokenizer"]
+        started = time.perf_counter()
+        if model.device.type == "cuda":
+            torch.cuda.reset_peak_memory_stats(model.device)
+        inputs, tokenized, prefix = self._prepare_inputs(model_name, model, tokenizer, [request.get("prompt", "")])
+
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=request.get("max_tokens", DEFAULT_MAX_NEW_TOKENS),
+                pad_token_id=tokenizer.pad_token_id,
+                streamer=QueueStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True),
+                **self._sampling_kwargs(request)
+            )
+
+        # The streamer decodes incrementally; this times the final full decode
+        generated = time.perf_counter()
+        response = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        return {
+            "status": "success",
+            "response": response,
+            "model": model_name,
+            "prompt_tokens": int(inputs["attention_mask"][0].sum()),
+            "tokens_generated": len(outputs[0]) - len(inputs["input_ids"][0]),
+            "timings": {
+                "tokenize_ms": (tokenized - started) * 1000,
+                **self._prefill_timings(steps, prefix),
+                "detokenize_ms": (time.perf_counter() - generated) * 1000,
+                "peak_memory_mb": peak_memory_mb(model.device)
+            }
+        }
+
+    async def handle_request(self, ws, data: Dict[str, Any]):
+        """Serve one inference_request message and send the response back
+
+        Up to MAX_CONCURRENCY requests are served at once, which is what the
+        node advertised when registering; any beyond that wait their turn.
+        A request the platform cancels is answered with a Cancelled error,
+        which hands its credit back. If the connection drops first, the
+        platform fails the request over and connect_websocket reconnects.
+        """
+        try:
+            try:
+                async with self.request_slots:
+                    await self._handle_request(ws, data)
+            except asyncio.CancelledError:
+                await self._send_cancelled(ws, data.get("request_id"))
+        except websockets.ConnectionClosed:
+            logger.warning(f"Connection closed before request {data.get('request_id')} was answered")
+        finally:
+            self.active_requests.pop(data.get("request_id"), None)
+
+    def _request_done(self, ws, request_id: str, task: asyncio.Task):
+        """Answer a request cancelled before handle_request got to run
+
+        Such a task never enters handle_request, so nothing else would send
+        the Cancelled reply that returns its credit.
+        """
+        if task.cancelled():
+            self.active_requests.pop(request_id, None)
+            asyncio.create_task(self._send_cancelled(ws, request_id))
+
+    async def _send_cancelled(self, ws, request_id: str):
+        try:
+            await ws.send(self.encode({
+                "type": "inference_response",
+                "request_id": request_id,
+                "result": {"error": "Cancelled", "cancelled": True}
+            }))
+        except websockets.ConnectionClosed:
+            logger.warning(f"Connection closed before request {request_id} was answered")
+            return
+        logger.info(f"Cancelled request {request_id}")
+
+    async def _handle_request(self, ws, data: Dict[str, Any]):
+        request = data.get("request", {})
+        # The platform names its own model ids; serve each with the local model
+        model_name = request.get("model", "llama")
+        request = {**request, "model": MODEL_ALIASES.get(model_name, model_name)}
+        request_id = data.get("request_id")
+        arrived = time.perf_counter()
+
+        if request.get("stream"):
+            index = 0
+
+            async def send_text(text: str):
+                nonlocal index
+                await ws.send(self.encode({
+                    "type": "inference_token",
+                    "request_id": request_id,
+                    "index": index,
+                    "text": text
+                }))
+                index += 1
+
+            result = await self.process_streaming(request, send_text)
+        else:
+            result = await self.process_inference(request)
+
+        if "timings" in result:
+            result["timings"]["total_ms"] = (time.perf_counter() - arrived) * 1000
+            self.recent_timings.append(result["timings"])
+        self.requests_served += 1
+
+        await ws.send(self.encode({
+            "type": "inference_response",
+            "request_id": request_id,
+            "result": result
+        }))
+
+        logger.info(f"✅ Processed request {request_id}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Percentiles of recent request timings plus batch and model cache stats"""
+        timings = {}
+        for key in sorted({key for entry in self.recent_timings for key in entry}):
+            values = sorted(entry[key] for entry in self.recent_timings if key in entry)
+            timings[key] = {
+                "p50": values[int(0.5 * (len(values) - 1))],
+                "p95": values[int(0.95 * (len(values) - 1))]
+            }
+        return {
+            "node_id": self.node_id,
+            "requests_served": self.requests_served,
+            "timings": timings,
+            "recent_batches": list(self.scheduler.batch_stats)[-10:],
+            "model_cache": self.model_cache.stats(),
+            "prefix_cache": self.prefix_cache.stats()
+        }
+
+    async def serve_metrics(self, port: int = METRICS_PORT):
+        """Serve stats() as JSON on localhost for the provider's own monitoring"""
+        async def handle(request):
+            return web.json_response(self.stats())
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        logger.info(f"Node metrics on http://127.0.0.1:{port}/metrics")
+
+    @staticmethod
+    def encode(message: Dict[str, Any]):
+        return msgpack.packb(message) if FRAME_ENCODING == "msgpack" else json.dumps(message)
+
+    @staticmethod
+    def decode(frame) -> Dict[str, Any]:
+        return msgpack.unpackb(frame) if isinstance(frame, bytes) else json.loads(frame)
+
     async def connect_websocket(self):
-        """Connect to platform via WebSocket for real-time communication"""
+        """Serve requests over one long-lived websocket to the platform
+
+        Requests are multiplexed by request_id. The register message grants
+        the platform MAX_CONCURRENCY credits; each response hands one back.
+        """
         while True:
             try:
-                async with websockets.connect(f"{WS_URL}/node/{self.node_id}") as ws:
+                async with websockets.connect(f"{WS_URL}/node/{self.node_id}?encoding={FRAME_ENCODING}") as ws:
                     self.ws = ws
-                    logger.info("✅ Connected to platform via WebSocket")
+                    logger.info(f"✅ Connected to platform via WebSocket ({FRAME_ENCODING} frames)")
 
-                    # Send initial registration
-                    await ws.send(json.dumps({
-                        "type": "register",
-                        "node_id": self.node_id,
-                        "capabilities": self.capabilities
+                    await ws.send(self.encode({
+                        "type": "register", "credits": MAX_CONCURRENCY, "models": self.model_states
                     }))
 
                     # Listen for requests
                     async for message in ws:
-                        data = json.loads(message)
+                        data = self.decode(message)
 
                         if data.get("type") == "inference_request":
-                            # Process inference request
-                            result = await self.process_inference(data.get("request", {}))
+                            # Keep reading while the request waits for its batch
+                            task = asyncio.create_task(self.handle_request(ws, data))
+                            task.add_done_callback(
+                                functools.partial(self._request_done, ws, data["request_id"])
+                            )
+                            self.active_requests[data["request_id"]] = task
 
-                            # Send response back
-                            await ws.send(json.dumps({
-                                "type": "inference_response",
-                                "request_id": data.get("request_id"),
-                                "result": result
-                            }))
-
-                            logger.info(f"✅ Processed request {data.get('request_id')}")
+                        elif data.get("type") == "cancel":
+                            # The platform got its answer elsewhere, or gave up
+                            request = self.active_requests.get(data.get("request_id"))
+                            if request:
+                                request.cancel()
 
                         elif data.get("type") == "ping":
                             # Respond to health check
-                            await ws.send(json.dumps({"type": "pong"}))
+                            await ws.send(self.encode({"type": "pong"}))
 
+            except websockets.ConnectionClosed as e:
+                logger.error(f"WebSocket closed: {e}")
+                if e.rcvd and e.rcvd.code == UNKNOWN_NODE:
+                    # Evicted, or the platform lost its registry: register again
+                    await self.register_node()
+                await asyncio.sleep(5)
             except Exception as e:
                 logger.error(f"WebSocket error: {e}")
                 await asyncio.sleep(5)  # Reconnect after 5 seconds
@@ -236,6 +1323,15 @@ class GPUNodeClient:
             logger.error("Failed to register node. Please check your connection.")
             return
 
+        # Connect first and load in the background: the platform learns each
+        # model's readiness from model_status messages
+        if LOAD_IN_BACKGROUND:
+            self._prewarming = asyncio.create_task(self.prewarm())
+        else:
+            await self.prewarm()
+        if METRICS_PORT:
+            await self.serve_metrics()
+
         # Connect via WebSocket
         await self.connect_websocket()
 
@@ -244,8 +1340,10 @@ def install_requirements():
     packages = [
         "torch",
         "transformers",
+        "accelerate",
         "aiohttp",
-        "websockets"
+        "websockets",
+        "msgpack"
     ]
 
     print("Installing required packages...")
@@ -271,16 +1369,13 @@ async def main():
     # Optional: custom node name
     node_name = input("Enter a custom node name (press Enter for auto-generated): ").strip()
 
-    # Check for required packages
-    try:
-        import torch
-        import transformers
-    except ImportError:
+    # Check for required packages without importing them, which is slow
+    if not all(importlib.util.find_spec(package) for package in ("torch", "transformers", "accelerate")):
         response = input("Required packages not installed. Install now? (y/n): ")
         if response.lower() == 'y':
             install_requirements()
         else:
-            print("Please install requirements manually: pip install torch transformers aiohttp websockets")
+            print("Please install requirements manually: pip install torch transformers accelerate aiohttp websockets")
             return
 
     # Create and start client
@@ -0,0 +1,353 @@
+"""
+Admission control for inference requests.
+
+Each user draws from a token bucket sized in prompt plus completion tokens,
+and accepted requests wait in one bounded queue per model, ordered by
+priority class and then arrival. Schedulers in the worker processes move
+the head of a queue onto the task stream as soon as the model has a free
+node, letting the scheduling policy (see scheduler.py) pick which one,
+with a hint of which node served the prompt's prefix last (see
+prefix_affinity.py). A burst therefore waits for capacity instead of being
+turned away, and a request still waiting at its deadline fails with a
+clear error.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from metrics import stage_timer
+from node_manager import NODE_UPDATES_CHANNEL, REGISTRY_LUA, TOTALS_KEY, available_key
+from scheduler import SCHEDULER_CANDIDATES, SCHEDULER_GROUP_CANDIDATES, SchedulingPolicy, load_policy
+from redis_pool import PipelineBatcher, decode
+from task_queue import TASK_TTL, decode_fields, dispatch_id, split_task, task_key
+
+logger = logging.getLogger(__name__)
+
+# Lower classes are admitted first; re-queued tasks go ahead of everything
+PRIORITY_CLASSES = {"interactive": 0, "standard": 1, "batch": 2}
+REQUEUED_PRIORITY = -1
+
+ADMISSION_QUEUE_LIMIT = int(os.getenv("ADMISSION_QUEUE_LIMIT", "1000"))
+# How long an accepted request may wait for a node
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "60"))
+USER_TOKENS_PER_SECOND = float(os.getenv("USER_TOKENS_PER_SECOND", "2000"))
+USER_TOKEN_BURST = float(os.getenv("USER_TOKEN_BURST", "20000"))
+SCHEDULER_TICK = 0.5
+
+MODELS_KEY = "admission:models"
+DEADLINES_KEY = "admission:deadlines"
+ADMISSION_CHANNEL = "admission"
+
+
+def admission_key(model_id: str) -> str:
+    return f"admission:{model_id}"
+
+
+def rate_limit_key(user_id: str) -> str:
+    return f"rate_limit:{user_id}"
+
+
+# KEYS[1] = bucket, ARGV = rate, burst, cost, now. Returns '0' when the cost
+# was taken, else the seconds until it would fit.
+TOKEN_BUCKET_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[4])
+local cost = math.min(tonumber(ARGV[3]), burst)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+tokens = math.min(burst, tokens + math.max(0, now - (tonumber(state[2]) or now)) * rate)
+if tokens < cost then
+    return tostring((cost - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens - cost, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return '0'
+"""
+
+# KEYS[1] = model queue, ARGV = task id, queue score, limit, deadline member,
+# deadline, model id, task TTL, '1' if a prompt follows, the prompt, then the
+# task record as field/value pairs. Stores the task, queues it and wakes the
+# schedulers; returns the number of requests ahead, or -1 when the queue is
+# full, in which case nothing is stored.
+ENQUEUE_SCRIPT = """
+local depth = redis.call('ZCARD', KEYS[1])
+if depth >= tonumber(ARGV[3]) then
+    return -1
+end
+local task = 'task:' .. ARGV[1]
+local unpack = table.unpack or unpack
+redis.call('HSET', task, unpack(ARGV, 10))
+redis.call('EXPIRE', task, ARGV[7])
+if ARGV[8] == '1' then
+    redis.call('SET', 'task_prompt:' .. ARGV[1], ARGV[9], 'EX', ARGV[7])
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZADD', 'admission:deadlines', ARGV[5], ARGV[4])
+redis.call('SADD', 'admission:models', ARGV[6])
+redis.call('PUBLISH', 'admission', ARGV[6])
+return redis.call('ZCOUNT', KEYS[1], '-inf', '(' .. ARGV[2])
+"""
+
+# KEYS[1] = model queue, KEYS[2] = available set for the model, ARGV =
+# candidate count, model id, nodes per group. Returns the head task id, its
+# record as a flat field/value list (without the prompt) and the node that
+# last served the task's prompt prefix ('' if none is available), followed
+# by the candidate nodes, each as CANDIDATE_FIELDS values: node id, vram,
+# location, score, tokens/s, bandwidth, slots in use and slots for the
+# model. Returns nil if there is no task or no node.
+#
+# Candidates are the best scored nodes in the task's region and overall, a
+# group from each VRAM size up from the smallest (walking the :fit index
+# until there are enough), and the prefix node. Taking only the best scored
+# would hide most of the fleet: every node starts at the same score.
+PEEK_SCRIPT = REGISTRY_LUA + """
+while true do
+    local head = redis.call('ZRANGE', KEYS[1], 0, 0)
+    if #head == 0 then
+        return false
+    end
+    local record = redis.call('HGETALL', 'task:' .. head[1])
+    if #record > 0 then
+        local wanted, group = tonumber(ARGV[1]), tonumber(ARGV[3])
+        local nodes, listed = {}, {}
+        local function add(node_id)
+            if not listed[node_id] then
+                listed[node_id] = true
+                table.insert(nodes, node_id)
+            end
+        end
+        local fields = redis.call('HMGET', 'task:' .. head[1], 'region', 'prefix_key')
+        local region = fields[1] and cjson.decode(fields[1])
+        if type(region) == 'string' then
+            for _, node_id in ipairs(redis.call('ZREVRANGE', KEYS[2] .. ':location:' .. region, 0, group - 1)) do
+                add(node_id)
+            end
+        end
+        for _, node_id in ipairs(redis.call('ZREVRANGE', KEYS[2], 0, group - 1)) do
+            add(node_id)
+        end
+        local floor = '-inf'
+        while #nodes < wanted do
+            local tier = redis.call('ZRANGEBYSCORE', KEYS[2] .. ':fit', floor, '+inf', 'WITHSCORES', 'LIMIT', 0, group)
+            if #tier == 0 then
+                break
+            end
+            for i = 1, #tier, 2 do
+                add(tier[i])
+            end
+            -- On to the next size up (scores are vram * 1000 - score)
+            floor = '(' .. math.ceil(tonumber(tier[#tier]) / 1000) * 1000
+        end
+        if #nodes == 0 then
+            return false
+        end
+        local affinity = ''
+        local prefix = fields[2] and cjson.decode(fields[2])
+        if type(prefix) == 'string' then
+            local node_id = redis.call('GET', 'prefix_affinity:' .. prefix)
+            if node_id and redis.call('ZSCORE', KEYS[2], node_id) then
+                affinity = node_id
+                add(node_id)
+            end
+        end
+        local reply = {head[1], record, affinity}
+        for _, node_id in ipairs(nodes) do
+            local fields = redis.call('HMGET', 'node:' .. node_id,
+                'vram', 'location', 'score', 'tokens_per_second', 'bandwidth', 'in_flight', 'models', 'slots')
+            table.insert(reply, node_id)
+            for i = 1, 6 do
+                table.insert(reply, fields[i] or '')
+            end
+            local slots = 1
+            for _, slot in ipairs(model_slots(fields[7], fields[8])) do
+                if slot[1] == ARGV[2] then
+                    slots = slot[2]
+                end
+            end
+            table.insert(reply, slots)
+        end
+        return reply
+    end
+    -- The task record expired while waiting
+    redis.call('ZREM', KEYS[1], head[1])
+end
+"""
+CANDIDATE_FIELDS = 8
+
+# KEYS[1] = model queue, KEYS[2] = available set for the model, ARGV = task
+# id, node id, request id. Takes a slot on the node for the request and puts
+# the task, node and request ids on the stream, if task and node are both
+# still waiting; returns the node's {status, slots in use}, or nil.
+ASSIGN_SCRIPT = REGISTRY_LUA + """
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) or not redis.call('ZSCORE', KEYS[2], ARGV[2]) then
+    return false
+end
+if redis.call('EXISTS', 'task:' .. ARGV[1]) == 0 then
+    return false
+end
+local state = reserve(ARGV[2], ARGV[3])
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('XADD', 'inference_queue', '*', 'task_id', ARGV[1], 'node_id', ARGV[2], 'request_id', ARGV[3])
+return state
+"""
+
+
+def _candidates(flat: list, affinity: str = "") -> List[Dict[str, Any]]:
+    candidates = []
+    for i in range(0, len(flat), CANDIDATE_FIELDS):
+        node_id, vram, location, score, tokens_per_second, bandwidth, load, slots = map(
+            decode, flat[i:i + CANDIDATE_FIELDS]
+        )
+        candidates.append({
+            "node_id": node_id,
+            "vram": float(vram or 0),
+            "location": location,
+            "score": float(score or 0),
+            "tokens_per_second": float(tokens_per_second or 0),
+            "bandwidth": float(bandwidth or 0),
+            "load": int(load or 0),
+            "slots": int(slots),
+            "prefix_cached": node_id == affinity
+        })
+    return candidates
+
+
+class AdmissionQueue:
+    def __init__(self, redis, limit: int = ADMISSION_QUEUE_LIMIT, wait_seconds: float = ADMISSION_WAIT_SECONDS,
+                 policy: Optional[SchedulingPolicy] = None, candidates: int = SCHEDULER_CANDIDATES,
+                 group_candidates: int = SCHEDULER_GROUP_CANDIDATES, batcher: Optional[PipelineBatcher] = None,
+                 node_manager=None):
+        self.redis = redis
+        # Told of every slot admission takes, so registry caches stay current
+        self.node_manager = node_manager
+        self.batcher = batcher
+        self.limit = limit
+        self.wait_seconds = wait_seconds
+        self.policy = policy or load_policy()
+        self.candidates = candidates
+        self.group_candidates = group_candidates
+        self._token_bucket = redis.register_script(TOKEN_BUCKET_SCRIPT)
+        self._enqueue = redis.register_script(ENQUEUE_SCRIPT)
+        self._peek = redis.register_script(PEEK_SCRIPT)
+        self._assign = redis.register_script(ASSIGN_SCRIPT)
+
+    async def take_tokens(self, user_id: str, tokens: int) -> float:
+        """Charge a request to the user's bucket; returns 0, or seconds to wait"""
+        wait = await self._call(
+            self._token_bucket,
+            keys=[rate_limit_key(user_id)],
+            args=[USER_TOKENS_PER_SECOND, USER_TOKEN_BURST, tokens, time.time()]
+        )
+        return float(wait)
+
+    async def _call(self, script, keys: List[str], args: List[Any]):
+        """Run a script, through the batcher if there is one"""
+        if self.batcher:
+            return await self.batcher.run(script, keys, args)
+        return await script(keys=keys, args=args)
+
+    async def enqueue(self, task: Dict[str, Any], priority: int, limit: Optional[int] = None) -> Optional[int]:
+        """Store the task and queue it for a node
+
+        Returns how many requests are ahead of it, or None if the model's
+        queue is full.
+        """
+        now = time.time()
+        model_id = task["model"]
+        fields, prompt = split_task(task)
+        args = [task["id"], priority * 1e10 + now, self.limit if limit is None else limit,
+                f"{model_id}|{task['id']}", now + self.wait_seconds, model_id, TASK_TTL,
+                "0" if prompt is None else "1", prompt or ""]
+        for name, value in fields.items():
+            args += [name, value]
+        with stage_timer("enqueue"):
+            ahead = await self._call(self._enqueue, keys=[admission_key(model_id)], args=args)
+        return None if ahead < 0 else ahead
+
+    async def depths(self, model_ids: Iterable[str]) -> Dict[str, int]:
+        model_ids = list(model_ids)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for model_id in model_ids:
+                pipe.zcard(admission_key(model_id))
+            return dict(zip(model_ids, await pipe.execute()))
+
+    async def retry_after(self, model_id: str, depth: int, tokens_per_second: float, max_tokens: int) -> int:
+        """Seconds until a queue this deep has drained across the model's slots"""
+        slots = int(await self.redis.hget(TOTALS_KEY, f"model:{model_id}:slots") or 0)
+        return max(1, math.ceil(depth * max_tokens / (tokens_per_second * max(1, slots))))
+
+    async def admit(self, model_id: str) -> int:
+        """Hand queued tasks to free nodes until one or the other runs out"""
+        admitted = 0
+        while True:
+            with stage_timer("node_selection"):
+                if not await self._admit_head(model_id):
+                    return admitted
+            admitted += 1
+
+    async def _admit_head(self, model_id: str) -> bool:
+        keys = [admission_key(model_id), available_key(model_id)]
+        # Another scheduler may take the task or the node in between; look again
+        for _ in range(3):
+            head = await self._peek(keys=keys, args=[self.candidates, model_id, self.group_candidates])
+            if not head:
+                return False
+            task_id, record, affinity, *flat = head
+            task = decode_fields(record[::2], record[1::2])
+            candidates = _candidates(flat, decode(affinity))
+            # A retried task goes to a node it hasn't failed on, if there is one
+            excluded = set(task.get("excluded_nodes", ()))
+            candidates = [c for c in candidates if c["node_id"] not in excluded] or candidates
+            node_id = self.policy.choose(task, candidates)
+            if node_id is None:
+                return False
+            state = await self._assign(keys=keys, args=[decode(task_id), node_id, dispatch_id(task)])
+            if state:
+                if self.node_manager:
+                    await self.node_manager.slots_changed(node_id, state)
+                return True
+        return False
+
+    async def expire(self) -> List[Dict[str, Any]]:
+        """Drop requests that waited past their deadline and return their tasks"""
+        members = await self.redis.zrangebyscore(DEADLINES_KEY, "-inf", time.time(), start=0, num=100)
+        expired = []
+        for member in map(decode, members):
+            model_id, _, task_id = member.partition("|")
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(DEADLINES_KEY, member)
+                pipe.zrem(admission_key(model_id), task_id)
+                pipe.hgetall(task_key(task_id))
+                _, waiting, record = await pipe.execute()
+            # Tasks that were admitted in time only leave their deadline behind
+            if waiting and record:
+                expired.append(decode_fields(record.keys(), record.values()))
+        return expired
+
+    async def run_scheduler(self, on_expired: Callable[[Dict[str, Any]], Awaitable[None]]):
+        """Admit queued tasks whenever a request arrives or a node frees up"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(ADMISSION_CHANNEL, NODE_UPDATES_CHANNEL)
+                while True:
+                    for task in await self.expire():
+                        await on_expired(task)
+                    for model_id in map(decode, await self.redis.smembers(MODELS_KEY)):
+                        await self.admit(model_id)
+
+                    # Sleep until something changes, then take every pending
+                    # notification in one go
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SCHEDULER_TICK)
+                    while message is not None:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Admission scheduler error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
@@ -1,18 +1,33 @@
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Depends, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
 import asyncio
-import redis.asyncio as redis
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 import uuid
-import json
+import orjson
 import logging
+import math
+import time
 from datetime import datetime
 from pydantic import BaseModel, Field
 from web3 import Web3
 import os
 from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+import metrics
+from admission import PRIORITY_CLASSES, AdmissionQueue
+from metrics import stage_timer
+from node_channel import ENCODINGS, NodeChannel
+from node_manager import GPUNodeManager, node_slots
+from prefix_affinity import prefix_key
+from redis_pool import NODE_CHANNEL_MAX_CONNECTIONS, REDIS_BATCH_ENABLED, PipelineBatcher, create_redis
+from response_cache import ResponseCache
+from task_events import TaskEventHub
+from task_queue import INFERENCE_QUEUE, WORKER_GROUP, ensure_worker_group, read_task_fields, task_key
+from tokenizer_service import TokenCounter
 
 # Load environment variables
 load_dotenv()
@@ -26,6 +41,13 @@ BSC_RPC = os.getenv("BSC_RPC", "https://bsc-dataseed.binance.org/")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS", "0x0000000000000000000000000000000000000000")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key")
+# Seconds a rendered /api/network/status body is reused for
+NETWORK_STATUS_CACHE_TTL = float(os.getenv("NETWORK_STATUS_CACHE_TTL", "1"))
+# The task record fields a status read needs
+TASK_STATUS_FIELDS = (
+    "status", "progress", "result", "error", "tokens_used", "prompt_tokens", "tokens_generated",
+    "timings", "profile_report"
+)
 
 # Initialize connections
 w3 = Web3(Web3.HTTPProvider(BSC_RPC))
@@ -38,22 +60,33 @@ class InferenceRequest(BaseModel):
     temperature: float = Field(0.7, ge=0, le=2)
     top_p: float = Field(0.9, ge=0, le=1)
     stream: bool = Field(False)
+    priority: Literal["interactive", "standard", "batch"] = Field("standard")
+    profile: Optional[Literal["cprofile", "torch"]] = Field(None, description="Profile generation on the node")
+    region: Optional[str] = Field(None, description="Prefer nodes in this location")
 
 class InferenceResponse(BaseModel):
     task_id: str
     result: Optional[str] = None
     tokens_used: int
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
     cost: float
     model: str
     status: str
+    cached: bool = False
+    queue_position: Optional[int] = None
 
 class NodeRegistration(BaseModel):
     wallet_address: str
     gpu_model: str
-    vram: int = Field(..., ge=8)
+    vram: int = Field(..., ge=1, description="GB of memory for models: VRAM, or RAM on CPU nodes")
     bandwidth: float = Field(..., ge=10)
     cuda_cores: int
     location: str
+    max_concurrency: Optional[int] = Field(None, ge=1, description="Requests the node serves at once")
+    load_mode: Optional[Literal["fp32", "fp16", "bf16", "int8"]] = Field(
+        None, description="Weight precision the node loads models in"
+    )
 
 class TaskStatus(BaseModel):
     task_id: str
@@ -61,8 +94,13 @@ class TaskStatus(BaseModel):
     progress: float
     result: Optional[str] = None
     error: Optional[str] = None
+    tokens_used: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    timings: Optional[Dict[str, float]] = None
+    profile: Optional[str] = None
 
-# Model registry
+# Model registry; min_gpu_vram is the size of the fp16 weights
 MODEL_REGISTRY = {
     "llama-70b": {
         "path": "meta-llama/Llama-2-70b-chat-hf",
@@ -83,82 +121,35 @@ MODEL_REGISTRY = {
         "price_per_1m_tokens": 15.0
     }
 }
-
-class GPUNodeManager:
-    def __init__(self):
-        self.nodes: Dict[str, Dict] = {}
-        self.node_scores: Dict[str, float] = {}
-
-    async def register_node(self, node_id: str, capabilities: dict):
-        """Register a GPU node with its capabilities"""
-        self.nodes[node_id] = {
-            "capabilities": capabilities,
-            "status": "available",
-            "score": 100.0,
-            "tasks_completed": 0,
-            "uptime": 0,
-            "last_heartbeat": datetime.now()
-        }
-        logger.info(f"Node {node_id} registered with {capabilities['vram']}GB VRAM")
-
-    async def select_best_node(self, model_requirements: dict) -> Optional[str]:
-        """Select the best available node for a task"""
-        eligible_nodes = []
-
-        for node_id, node_data in self.nodes.items():
-            if (node_data["status"] == "available" and
-                node_data["capabilities"]["vram"] >= model_requirements["min_gpu_vram"]):
-                eligible_nodes.append((node_id, node_data["score"]))
-
-        if not eligible_nodes:
-            return None
-
-        # Sort by score and return best node
-        eligible_nodes.sort(key=lambda x: x[1], reverse=True)
-        selected_node = eligible_nodes[0][0]
-        self.nodes[selected_node]["status"] = "busy"
-        return selected_node
-
-    async def release_node(self, node_id: str):
-        """Release a node after task completion"""
-        if node_id in self.nodes:
-            self.nodes[node_id]["status"] = "available"
-            self.nodes[node_id]["tasks_completed"] += 1
-
-    async def update_node_score(self, node_id: str, performance_metrics: dict) -> float:
-        """Update node reliability score based on performance"""
-        if node_id not in self.nodes:
-            return 0
-
-        base_score = self.nodes[node_id]["score"]
-
-        # Calculate performance adjustments
-        uptime_factor = performance_metrics.get("uptime", 100) / 100
-        speed_factor = min(1.0, performance_metrics.get("actual_speed", 1) /
-                          performance_metrics.get("expected_speed", 1))
-        accuracy_factor = performance_metrics.get("accuracy", 1)
-
-        new_score = (base_score * 0.7 +
-                    uptime_factor * 10 +
-                    speed_factor * 10 +
-                    accuracy_factor * 10)
-
-        self.nodes[node_id]["score"] = min(100, max(0, new_score))
-
-        # Calculate payment adjustment (±10% based on score)
-        adjustment = (new_score - 80) / 200  # -10% to +10%
-        return adjustment
+# Bytes per weight of each node load mode, against fp16's two
+LOAD_MODE_BYTES = {"fp32": 4, "fp16": 2, "bf16": 2, "int8": 1}
 
 # Application lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    app.state.redis = await redis.from_url(REDIS_URL)
-    app.state.node_manager = GPUNodeManager()
+    app.state.redis = create_redis(REDIS_URL)
+    # Node channels block in BLPOP; on their own pool they can't starve requests
+    app.state.node_redis = create_redis(REDIS_URL, NODE_CHANNEL_MAX_CONNECTIONS)
+    app.state.node_manager = GPUNodeManager(app.state.redis)
+    app.state.task_events = TaskEventHub(app.state.redis)
+    app.state.response_cache = ResponseCache(app.state.redis)
+    # Concurrent requests' rate limit and enqueue calls share pipelines
+    batcher = PipelineBatcher(app.state.redis) if REDIS_BATCH_ENABLED else None
+    app.state.admission = AdmissionQueue(app.state.redis, batcher=batcher, node_manager=app.state.node_manager)
+    app.state.token_counter = TokenCounter({model_id: info["path"] for model_id, info in MODEL_REGISTRY.items()})
+    await ensure_worker_group(app.state.redis)
+    await app.state.node_manager.start()
+    await app.state.task_events.start()
+    await app.state.token_counter.start()
     logger.info("Inference service started")
     yield
     # Shutdown
+    await app.state.node_manager.stop()
+    await app.state.task_events.stop()
+    await app.state.token_counter.stop()
     await app.state.redis.close()
+    await app.state.node_redis.close()
     logger.info("Inference service stopped")
 
 # Create FastAPI app
@@ -166,7 +157,8 @@ app = FastAPI(
     title="Far Labs Inference Service",
     description="Decentralized AI inference API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -178,6 +170,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 # Security
 security = HTTPBearer()
 
@@ -195,117 +190,214 @@ async def root():
         "models": list(MODEL_REGISTRY.keys())
     }
 
-@app.post("/api/inference/generate", response_model=InferenceResponse)
+async def stream_task_events(task_id: str):
+    """Server-Sent Events body relaying a task's token and status events"""
+    yield f"event: task\ndata: {orjson.dumps({'task_id': task_id}).decode()}\n\n"
+    async for event_id, event in app.state.task_events.follow(task_id):
+        yield f"id: {event_id}\nevent: {event['type']}\ndata: {orjson.dumps(event).decode()}\n\n"
+
+@app.post("/api/inference/generate", response_model=InferenceResponse, status_code=202)
 async def generate_text(
     request: InferenceRequest,
+    response: Response,
     user = Depends(verify_token)
 ):
-    """Main inference endpoint"""
+    """Main inference endpoint
+
+    Returns 202 with the task_id, or a text/event-stream of token events
+    when request.stream is set. Deterministic requests may be answered from
+    the result cache (200, cost 0) or share the task of an identical request
+    that is still running (202, cost 0).
+
+    Requests wait in the model's queue until a node is free. A user over
+    their token rate gets 429 and a full queue gets 503, both with a
+    Retry-After header.
+    """
+    cache_key = None
     try:
-        # Validate model
-        model_info = MODEL_REGISTRY.get(request.model_id)
-        if not model_info:
-            raise HTTPException(404, "Model not found")
-
-        # Calculate cost
-        estimated_cost = (request.max_tokens / 1_000_000) * model_info["price_per_1m_tokens"]
-
-        # Select best GPU node
-        node_id = await app.state.node_manager.select_best_node(model_info)
-        if not node_id:
-            raise HTTPException(503, "No available GPU nodes")
+        with stage_timer("validation"):
+            # Validate model
+            model_info = MODEL_REGISTRY.get(request.model_id)
+            if not model_info:
+                raise HTTPException(404, "Model not found")
+
+            task_id = str(uuid.uuid4())
+
+        with stage_timer("tokenize"):
+            prompt_tokens = await app.state.token_counter.count(request.model_id, request.prompt)
+        # Charged up front for the prompt and every token the request may generate
+        estimated_cost = ((prompt_tokens + request.max_tokens) / 1_000_000) * model_info["price_per_1m_tokens"]
+
+        cache = app.state.response_cache
+        if cache.eligible(request.temperature, request.stream):
+            cache_key = cache.key_for(
+                request.model_id, request.prompt, request.max_tokens, request.temperature, request.top_p
+            )
+            with stage_timer("cache_lookup"):
+                cached, owner = await cache.lookup_or_claim(cache_key, task_id)
+            if cached:
+                response.status_code = 200
+                return InferenceResponse(
+                    task_id=cached["task_id"],
+                    result=cached["result"],
+                    tokens_used=prompt_tokens + cached["tokens_generated"],
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=cached["tokens_generated"],
+                    cost=0.0,
+                    model=request.model_id,
+                    status="completed",
+                    cached=True
+                )
+            if owner != task_id:
+                if owner is not None:
+                    return InferenceResponse(
+                        task_id=owner,
+                        tokens_used=0,
+                        cost=0.0,
+                        model=request.model_id,
+                        status="queued",
+                        cached=True
+                    )
+                # The claim expired between commands; run uncached
+                cache_key = None
+
+        admission = app.state.admission
+        with stage_timer("rate_limit"):
+            wait = await admission.take_tokens(user["user_id"], prompt_tokens + request.max_tokens)
+        if wait:
+            if cache_key:
+                await cache.release(cache_key, task_id)
+            raise HTTPException(429, "Token rate limit exceeded", headers={"Retry-After": str(math.ceil(wait))})
 
         # Create task
-        task_id = str(uuid.uuid4())
         task_data = {
             "id": task_id,
             "model": request.model_id,
             "prompt": request.prompt,
             "max_tokens": request.max_tokens,
+            "prompt_tokens": prompt_tokens,
             "temperature": request.temperature,
             "top_p": request.top_p,
-            "node_id": node_id,
+            "stream": request.stream,
+            "price_per_1m_tokens": model_info["price_per_1m_tokens"],
+            "tokens_per_second": model_info["tokens_per_second"],
+            "min_vram": model_info["min_gpu_vram"],
+            "region": request.region,
+            "prefix_key": prefix_key(request.model_id, request.prompt),
+            "profile": request.profile,
+            "cache_key": cache_key,
+            "node_id": None,
+            "priority": request.priority,
             "status": "queued",
             "user_id": user["user_id"],
             "created_at": datetime.now().isoformat()
         }
 
-        # Queue task for processing
-        await app.state.redis.lpush("inference_queue", json.dumps(task_data))
-        await app.state.redis.set(f"task:{task_id}", json.dumps(task_data), ex=3600)
-
-        # For demo purposes, simulate immediate response
-        # In production, this would be handled by worker processes
-        await asyncio.sleep(0.1)  # Simulate processing
-
-        # Mock result
-        result = f"Generated response for: {request.prompt[:50]}..."
-        tokens_used = min(request.max_tokens, len(request.prompt.split()) * 10)
-        actual_cost = (tokens_used / 1_000_000) * model_info["price_per_1m_tokens"]
-
-        # Release node
-        await app.state.node_manager.release_node(node_id)
+        # Wait for a node; the workers' scheduler dispatches it in priority order
+        position = await admission.enqueue(task_data, PRIORITY_CLASSES[request.priority])
+        if position is None:
+            if cache_key:
+                await cache.release(cache_key, task_id)
+            retry_after = await admission.retry_after(
+                request.model_id, admission.limit, model_info["tokens_per_second"], request.max_tokens
+            )
+            raise HTTPException(503, "Inference queue is full", headers={"Retry-After": str(retry_after)})
+
+        if request.stream:
+            return StreamingResponse(
+                stream_task_events(task_id),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Task-Id": task_id}
+            )
 
         return InferenceResponse(
             task_id=task_id,
-            result=result,
-            tokens_used=tokens_used,
-            cost=actual_cost,
+            tokens_used=0,
+            prompt_tokens=prompt_tokens,
+            cost=estimated_cost,
             model=request.model_id,
-            status="completed"
+            status="queued",
+            queue_position=position
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Inference error: {str(e)}")
+        if cache_key:
+            # Identical requests would otherwise wait on a task never queued
+            try:
+                await app.state.response_cache.release(cache_key, task_id)
+            except Exception as release_error:
+                logger.error(f"Could not release result cache claim {cache_key}: {release_error}")
         raise HTTPException(500, str(e))
 
+@app.get("/api/inference/cache")
+async def get_cache_stats():
+    """Result cache hit/miss counters"""
+    return await app.state.response_cache.stats()
+
+@app.get("/api/inference/tokenizer")
+async def get_tokenizer_stats():
+    """Prompt token counter cache and batching counters"""
+    return app.state.token_counter.stats()
+
 @app.get("/api/inference/status/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
     """Get task status and result"""
-    task_data = await app.state.redis.get(f"task:{task_id}")
-    if not task_data:
+    task = await read_task_fields(app.state.redis, task_id, TASK_STATUS_FIELDS)
+    if not task:
         raise HTTPException(404, "Task not found")
 
-    task = json.loads(task_data)
     return TaskStatus(
         task_id=task_id,
         status=task.get("status", "unknown"),
         progress=task.get("progress", 0),
         result=task.get("result"),
-        error=task.get("error")
+        error=task.get("error"),
+        tokens_used=task.get("tokens_used"),
+        prompt_tokens=task.get("prompt_tokens"),
+        completion_tokens=task.get("tokens_generated"),
+        timings=task.get("timings"),
+        profile=task.get("profile_report")
     )
 
 @app.websocket("/ws/inference/{task_id}")
-async def inference_websocket(websocket: WebSocket, task_id: str):
-    """WebSocket for streaming inference results"""
-    await websocket.accept()
+async def inference_websocket(websocket: WebSocket, task_id: str, cursor: str = "0-0"):
+    """WebSocket for streaming inference results
+
+    Each message carries a cursor; reconnect with ?cursor=<last cursor> to
+    resume without missing or repeating updates.
+    """
+    with stage_timer("websocket_setup"):
+        await websocket.accept()
+        task_exists = await app.state.redis.exists(task_key(task_id))
+    metrics.WEBSOCKET_CONNECTIONS.inc()
+
+    async def forward():
+        async for event_id, event in app.state.task_events.follow(task_id, cursor):
+            await websocket.send_json({"cursor": event_id, **event})
+
+    async def until_disconnected():
+        # Frames the client sends (keepalives, acks) are read and ignored
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
 
     try:
         # Check if task exists
-        task_data = await app.state.redis.get(f"task:{task_id}")
-        if not task_data:
+        if not task_exists:
             await websocket.send_json({"error": "Task not found"})
-            await websocket.close()
             return
 
-        # Stream updates
-        while True:
-            # Get task updates from Redis
-            task_data = await app.state.redis.get(f"task:{task_id}")
-            if task_data:
-                task = json.loads(task_data)
-                await websocket.send_json({
-                    "status": task.get("status"),
-                    "progress": task.get("progress", 0),
-                    "tokens": task.get("tokens_generated", 0)
-                })
-
-                if task.get("status") in ["completed", "failed"]:
-                    if task.get("result"):
-                        await websocket.send_json({"result": task["result"]})
-                    break
-
-            await asyncio.sleep(0.5)
+        # Stop forwarding as soon as the client goes away
+        forwarding = asyncio.create_task(forward())
+        disconnected = asyncio.create_task(until_disconnected())
+        await asyncio.wait({forwarding, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        disconnected.cancel()
+        if not forwarding.done():
+            forwarding.cancel()
+            return
+        forwarding.result()
 
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected for task {task_id}")
@@ -313,9 +405,34 @@ async def inference_websocket(websocket: WebSocket, task_id: str):
         logger.error(f"WebSocket error: {str(e)}")
         await websocket.send_json({"error": str(e)})
     finally:
+        metrics.WEBSOCKET_CONNECTIONS.dec()
         await websocket.close()
 
 # GPU Node Management Endpoints
+@app.websocket("/ws/node/{node_id}")
+async def node_websocket(websocket: WebSocket, node_id: str, encoding: str = "json"):
+    """Long-lived channel carrying a node's requests and replies (see node_channel.py)"""
+    await websocket.accept()
+    if encoding not in ENCODINGS:
+        await websocket.close(code=1003, reason=f"encoding must be one of {ENCODINGS}")
+        return
+
+    channel = NodeChannel(websocket, app.state.node_redis, app.state.node_manager, node_id, encoding)
+    metrics.NODE_CONNECTIONS.inc()
+    try:
+        await channel.serve()
+    except (WebSocketDisconnect, asyncio.TimeoutError):
+        logger.info(f"Node {node_id} disconnected")
+    except Exception as e:
+        logger.error(f"Node channel error for {node_id}: {e}")
+        channel.close_code = 1011
+    finally:
+        metrics.NODE_CONNECTIONS.dec()
+    try:
+        await websocket.close(code=channel.close_code)
+    except RuntimeError:
+        pass  # Already closed by the node
+
 @app.post("/api/node/register")
 async def register_gpu_node(registration: NodeRegistration):
     """Register a new GPU provider node"""
@@ -328,59 +445,108 @@ async def register_gpu_node(registration: NodeRegistration):
         "bandwidth": registration.bandwidth,
         "cuda_cores": registration.cuda_cores,
         "location": registration.location,
+        "max_concurrency": registration.max_concurrency,
+        "load_mode": registration.load_mode,
         "supported_models": []
     }
 
-    # Determine which models this node can run
+    # Determine which models this node can run, and how many requests at
+    # once: VRAM in fp16 terms, so an int8 node fits twice what fp16 does
+    effective_vram = registration.vram * 2 / LOAD_MODE_BYTES.get(registration.load_mode, 2)
+    capabilities["effective_vram"] = effective_vram
+    slots = {}
     for model_id, model_info in MODEL_REGISTRY.items():
-        if registration.vram >= model_info["min_gpu_vram"]:
+        if effective_vram >= model_info["min_gpu_vram"]:
             capabilities["supported_models"].append(model_id)
+            slots[model_id] = node_slots(effective_vram, model_info["min_gpu_vram"], registration.max_concurrency)
 
-    await app.state.node_manager.register_node(node_id, capabilities)
+    await app.state.node_manager.register_node(node_id, capabilities, slots)
 
     return {
         "node_id": node_id,
         "status": "registered",
-        "supported_models": capabilities["supported_models"]
+        "supported_models": capabilities["supported_models"],
+        "slots": slots
     }
 
 @app.post("/api/node/{node_id}/heartbeat")
 async def node_heartbeat(node_id: str):
     """Update node heartbeat"""
-    if node_id in app.state.node_manager.nodes:
-        app.state.node_manager.nodes[node_id]["last_heartbeat"] = datetime.now()
+    if await app.state.node_manager.heartbeat(node_id):
         return {"status": "ok"}
     raise HTTPException(404, "Node not found")
 
+@app.get("/api/node/{node_id}")
+async def get_node(node_id: str):
+    """A node's status and the readiness of each model it has loaded or is loading"""
+    node = app.state.node_manager.nodes.get(node_id)
+    if node is None:
+        raise HTTPException(404, "Node not found")
+    return {
+        "node_id": node_id,
+        "status": node["status"],
+        "supported_models": node["capabilities"].get("supported_models", []),
+        "model_states": node["model_states"],
+        "in_flight": node["in_flight"],
+        "last_heartbeat": node["last_heartbeat"].isoformat()
+    }
+
 @app.get("/api/network/status")
 async def get_network_status():
     """Get current network statistics"""
-    node_manager = app.state.node_manager
-    total_nodes = len(node_manager.nodes)
-    available_nodes = sum(
-        1 for n in node_manager.nodes.values()
-        if n["status"] == "available"
-    )
-
-    total_vram = sum(
-        n["capabilities"]["vram"]
-        for n in node_manager.nodes.values()
-    )
+    cached = getattr(app.state, "network_status", None)
+    if cached and time.monotonic() < cached[0]:
+        return Response(cached[1], media_type="application/json")
 
-    avg_score = 0
-    if total_nodes > 0:
-        avg_score = sum(
-            n["score"] for n in node_manager.nodes.values()
-        ) / total_nodes
-
-    return {
-        "total_nodes": total_nodes,
-        "available_nodes": available_nodes,
-        "total_vram_gb": total_vram,
+    node_manager = app.state.node_manager
+    totals = await node_manager.network_totals()
+    liveness = await node_manager.liveness_stats()
+    queued = await app.state.admission.depths(MODEL_REGISTRY)
+    empty = {"total_nodes": 0, "available_nodes": 0, "total_vram_gb": 0, "total_slots": 0}
+
+    body = orjson.dumps({
+        "total_nodes": totals["total_nodes"],
+        "available_nodes": totals["available_nodes"],
+        "stale_nodes": liveness["stale_nodes"],
+        "evicted_nodes": liveness["evicted_nodes"],
+        "total_vram_gb": totals["total_vram_gb"],
+        "total_slots": totals["total_slots"],
         "models_available": list(MODEL_REGISTRY.keys()),
-        "average_node_score": avg_score,
-        "network_status": "operational" if available_nodes > 0 else "degraded"
-    }
+        "average_node_score": totals["average_node_score"],
+        "network_status": "operational" if totals["available_nodes"] > 0 else "degraded",
+        "models": {
+            model_id: {**empty, **totals["models"].get(model_id, {}), "queued_requests": queued[model_id]}
+            for model_id in MODEL_REGISTRY
+        },
+        "locations": totals["locations"]
+    })
+
+    app.state.network_status = (time.monotonic() + NETWORK_STATUS_CACHE_TTL, body)
+    return Response(body, media_type="application/json")
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics; queue and node gauges are refreshed per scrape"""
+    node_manager = app.state.node_manager
+    totals = await node_manager.network_totals()
+    queued = await app.state.admission.depths(MODEL_REGISTRY)
+
+    # Entries not yet read plus entries read but not acknowledged
+    for group in await app.state.redis.xinfo_groups(INFERENCE_QUEUE):
+        if group["name"] in (WORKER_GROUP, WORKER_GROUP.encode()):
+            metrics.QUEUE_DEPTH.labels(INFERENCE_QUEUE).set(group["pending"] + (group.get("lag") or 0))
+    for model_id, depth in queued.items():
+        metrics.QUEUE_DEPTH.labels(f"admission:{model_id}").set(depth)
+
+    pools = {"all": totals, **totals["models"]}
+    for model_id, pool in pools.items():
+        total = pool.get("total_nodes", 0)
+        available = pool.get("available_nodes", 0)
+        metrics.NODES.labels(model_id, "available").set(available)
+        metrics.NODES.labels(model_id, "busy").set(total - available)
+    metrics.TASK_WATCHERS.set(app.state.task_events.connections)
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/api/models")
 async def get_available_models():
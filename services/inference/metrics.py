@@ -0,0 +1,127 @@
+"""
+Prometheus metrics for the inference API and workers.
+
+Request latency comes from an ASGI middleware. The stages of the hot path
+(validation, rate limiting, cache lookup, Redis writes, node selection,
+queue wait and generation) are timed explicitly with stage_timer. Queue
+and node pool gauges are read from Redis when /metrics is scraped, which
+is constant time thanks to the fleet totals.
+
+Set METRICS_ENABLED=false to drop the middleware, timers and the worker's
+metrics port; a disabled timer costs one function call.
+"""
+
+import os
+import time
+from contextlib import nullcontext
+from typing import Dict
+
+from prometheus_client import Counter, Gauge, Histogram
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Per-node series multiply with the fleet; turn them off for large fleets
+METRICS_NODE_LABELS = os.getenv("METRICS_NODE_LABELS", "true").lower() == "true"
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9101"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+REQUEST_LATENCY = Histogram(
+    "inference_http_request_duration_seconds", "HTTP request latency",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "inference_stage_duration_seconds", "Latency of one stage of serving a request",
+    ["stage"], buckets=LATENCY_BUCKETS
+)
+QUEUE_DEPTH = Gauge("inference_queue_depth", "Entries waiting in a queue", ["queue"])
+NODES = Gauge("inference_nodes", "Registered GPU nodes", ["model", "state"])
+WEBSOCKET_CONNECTIONS = Gauge("inference_websocket_connections", "Open task websockets")
+NODE_CONNECTIONS = Gauge("inference_node_connections", "GPU nodes connected over their websocket channel")
+TASK_WATCHERS = Gauge("inference_task_watchers", "Websocket and SSE clients following a task")
+TASKS = Counter("inference_tasks_total", "Tasks finished by a worker", ["model", "outcome"])
+TOKENS = Counter("inference_tokens_generated_total", "Tokens generated", ["model"])
+NODE_TOKENS = Counter("inference_node_tokens_generated_total", "Tokens generated per node", ["node"])
+DISPATCH_FAILURES = Counter(
+    "inference_dispatch_failures_total", "Node dispatches that failed or timed out", ["model", "reason"]
+)
+HEDGES = Counter("inference_hedged_dispatches_total", "Duplicate dispatches sent to a second node", ["model", "outcome"])
+TOKENS_PER_SECOND = Histogram(
+    "inference_tokens_per_second", "Generation throughput of one task", ["model"],
+    buckets=(1, 5, 10, 20, 30, 40, 50, 75, 100, 150, 200, 500)
+)
+
+_stages: Dict[str, Histogram] = {}
+_disabled = nullcontext()
+
+
+def _stage(stage: str) -> Histogram:
+    child = _stages.get(stage)
+    if child is None:
+        child = _stages[stage] = STAGE_LATENCY.labels(stage)
+    return child
+
+
+def observe_stage(stage: str, seconds: float):
+    if METRICS_ENABLED:
+        _stage(stage).observe(seconds)
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+def stage_timer(stage: str):
+    """Context manager recording the block under inference_stage_duration_seconds"""
+    if not METRICS_ENABLED:
+        return _disabled
+    return _StageTimer(_stage(stage))
+
+
+def record_generation(model_id: str, node_id: str, tokens: int, seconds: float):
+    if not METRICS_ENABLED:
+        return
+    TOKENS.labels(model_id).inc(tokens)
+    if METRICS_NODE_LABELS:
+        NODE_TOKENS.labels(node_id).inc(tokens)
+    if seconds > 0 and tokens:
+        TOKENS_PER_SECOND.labels(model_id).observe(tokens / seconds)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; label by its
+            # template so task ids don't each become a series
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
+
@@ -0,0 +1,184 @@
+"""
+Server side of the websocket each GPU node keeps open to the platform.
+
+Workers reach nodes through Redis: requests are pushed onto
+node_inbox:{node_id} and replies read from node_result:{request_id} (see
+worker.NodeDispatcher). The API process holding a node's websocket relays
+between the two, so any number of requests share one connection and are
+told apart by request_id.
+
+The node opens /ws/node/{node_id}, with ?encoding=msgpack for binary
+msgpack frames instead of JSON text frames, and starts with
+{"type": "register", "credits": n}. Credits are how many requests it takes
+at once: every request sent spends one, every inference_response gives it
+back, and {"type": "credit", "credits": n} grants more (or, negative, takes
+some back). The platform pings every NODE_PING_INTERVAL seconds; a pong is
+the node's heartbeat, and a node silent for NODE_PING_TIMEOUT is dropped.
+Requests in flight on a dropped channel fail with node_lost, which makes
+their workers queue them again. Cancels for requests the node already has
+arrive on node_control:{node_id} and are forwarded whatever the credits.
+
+Nodes connect before their models finish loading. The register message and
+later {"type": "model_status", "models": {name: state}} messages report
+each model as loading, ready or failed (null once unloaded); the registry
+keeps them as the node's model_states.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Set
+
+import msgpack
+import orjson
+from fastapi import WebSocket, WebSocketDisconnect
+
+from task_queue import TASK_TTL, node_control_key, node_inbox_key, node_result_key
+
+logger = logging.getLogger(__name__)
+
+NODE_PING_INTERVAL = float(os.getenv("NODE_PING_INTERVAL", "15"))
+NODE_PING_TIMEOUT = float(os.getenv("NODE_PING_TIMEOUT", "45"))
+ENCODINGS = ("json", "msgpack")
+# Close code telling the node to register again before reconnecting
+UNKNOWN_NODE = 4404
+
+
+class NodeChannel:
+    """Relays one node's requests and replies between its websocket and Redis"""
+
+    def __init__(self, websocket: WebSocket, redis, node_manager, node_id: str, encoding: str = "json"):
+        self.websocket = websocket
+        self.redis = redis
+        self.node_manager = node_manager
+        self.node_id = node_id
+        self.encoding = encoding
+        self.credits = 0
+        self.in_flight: Set[str] = set()
+        self.last_seen = time.monotonic()
+        self.close_code = 1000
+        self._credited = asyncio.Event()
+        self._replies: asyncio.Queue = asyncio.Queue()
+
+    async def send(self, message: Dict[str, Any]):
+        if self.encoding == "msgpack":
+            await self.websocket.send_bytes(msgpack.packb(message))
+        else:
+            await self.websocket.send_text(orjson.dumps(message).decode())
+
+    async def receive(self) -> Dict[str, Any]:
+        """Next frame from the node, in whichever encoding it came"""
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("bytes") is not None:
+            return msgpack.unpackb(message["bytes"])
+        return orjson.loads(message["text"])
+
+    def grant(self, credits: int):
+        self.credits += credits
+        if self.credits > 0:
+            self._credited.set()
+
+    async def serve(self):
+        """Relay until the node disconnects or goes quiet"""
+        register = await asyncio.wait_for(self.receive(), NODE_PING_TIMEOUT)
+        if register.get("type") != "register" or not await self.node_manager.heartbeat(self.node_id):
+            self.close_code = UNKNOWN_NODE
+            return
+        self.grant(int(register.get("credits", 1)))
+        await self.node_manager.set_model_states(self.node_id, register.get("models") or {}, replace=True)
+        logger.info(f"Node {self.node_id} connected ({self.encoding}, {self.credits} credits)")
+
+        loops = (self._forward_requests, self._forward_control, self._receive_replies, self._relay_replies, self._ping)
+        tasks = [asyncio.create_task(loop()) for loop in loops]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._fail_in_flight()
+
+    async def _forward_requests(self):
+        inbox = node_inbox_key(self.node_id)
+        while True:
+            if self.credits <= 0:
+                self._credited.clear()
+                await self._credited.wait()
+            reply = await self.redis.blpop(inbox, timeout=1)
+            if reply is None:
+                continue
+            message = orjson.loads(reply[1])
+            self.credits -= 1
+            # Tracked before sending, so a request lost mid-send is failed over
+            self.in_flight.add(message["request_id"])
+            await self.send(message)
+
+    async def _forward_control(self):
+        control = node_control_key(self.node_id)
+        while True:
+            reply = await self.redis.blpop(control, timeout=1)
+            if reply is not None:
+                await self.send(orjson.loads(reply[1]))
+
+    async def _receive_replies(self):
+        while True:
+            message = await self.receive()
+            self.last_seen = time.monotonic()
+            kind = message.get("type")
+            if kind in ("inference_token", "inference_response"):
+                self._replies.put_nowait(message)
+            elif kind == "credit":
+                self.grant(int(message.get("credits", 0)))
+            elif kind == "model_status":
+                await self.node_manager.set_model_states(self.node_id, message.get("models", {}))
+            elif kind == "pong":
+                if not await self.node_manager.heartbeat(self.node_id):
+                    # Evicted while connected
+                    self.close_code = UNKNOWN_NODE
+                    return
+
+    async def _relay_replies(self):
+        """Push replies to Redis, every reply that piled up in one round trip"""
+        while True:
+            replies = [await self._replies.get()]
+            while not self._replies.empty():
+                replies.append(self._replies.get_nowait())
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for message in replies:
+                    pipe.rpush(node_result_key(message["request_id"]), orjson.dumps(message))
+                    if message["type"] == "inference_response":
+                        # Nobody reads the answer to a cancelled request
+                        pipe.expire(node_result_key(message["request_id"]), TASK_TTL)
+                await pipe.execute()
+
+            for message in replies:
+                if message["type"] == "inference_response" and message["request_id"] in self.in_flight:
+                    self.in_flight.discard(message["request_id"])
+                    self.grant(1)
+
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(NODE_PING_INTERVAL)
+            if time.monotonic() - self.last_seen > NODE_PING_TIMEOUT:
+                logger.warning(f"Node {self.node_id} silent for {NODE_PING_TIMEOUT:.0f}s, dropping its channel")
+                return
+            await self.send({"type": "ping"})
+
+    async def _fail_in_flight(self):
+        if not self.in_flight:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for request_id in self.in_flight:
+                pipe.rpush(node_result_key(request_id), orjson.dumps({
+                    "type": "inference_response",
+                    "request_id": request_id,
+                    "result": {"error": f"Node {self.node_id} disconnected", "node_lost": True}
+                }))
+            await pipe.execute()
+        logger.warning(f"Node {self.node_id} disconnected with {len(self.in_flight)} requests in flight")
+        self.in_flight.clear()
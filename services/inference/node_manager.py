@@ -0,0 +1,731 @@
+"""
+GPU node registry shared through Redis.
+
+Every API process and worker sees the same nodes. Each node is a hash at
+node:{id}. A node serves up to `slots` requests at once for each model it
+supports, and stays in that model's sorted set of available nodes, scored
+by node score, while it has a free slot. The best node for a model is the
+top of its set. Two more sets per model hold the same nodes by VRAM (best
+fit first) and by location, so the admission scheduler can offer its
+policy nodes of every size and region rather than just the best scored.
+Reservation and release run as Lua scripts, which means two processes can
+never take the same slot.
+
+Each process keeps a read cache of the registry in `nodes`. Every write
+is announced on node_updates, so each process can update its cache.
+
+A node that fails CIRCUIT_FAILURES dispatches in a row has its circuit
+breaker opened: it leaves every available set for CIRCUIT_OPEN_SECONDS,
+after which the sweeper lets it back in on probation, where one more
+failure opens the breaker again.
+
+Fleet totals (node, availability, slot and VRAM counts, overall and per
+model and location) are adjusted by the same scripts that change a node, so reading
+them costs the same at 10 nodes as at 100k.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from metrics import stage_timer
+from redis_pool import decode
+from task_queue import node_result_key
+
+logger = logging.getLogger(__name__)
+
+NODES_KEY = "nodes:all"
+HEARTBEATS_KEY = "nodes:heartbeats"
+NODE_STATS_KEY = "nodes:stats"
+TOTALS_KEY = "nodes:totals"
+TRIPPED_KEY = "nodes:tripped"
+TOTALS_FIELDS = {"nodes": "total_nodes", "available": "available_nodes", "vram": "total_vram_gb", "slots": "total_slots"}
+NODE_UPDATES_CHANNEL = "node_updates"
+
+# Liveness: a node is stale after NODE_STALE_AFTER seconds without a
+# heartbeat and evicted after NODE_HEARTBEAT_TIMEOUT seconds
+NODE_STALE_AFTER = float(os.getenv("NODE_STALE_AFTER", "30"))
+NODE_HEARTBEAT_TIMEOUT = float(os.getenv("NODE_HEARTBEAT_TIMEOUT", "90"))
+NODE_SWEEP_INTERVAL = float(os.getenv("NODE_SWEEP_INTERVAL", "5"))
+NODE_SWEEP_BATCH = 100
+
+# Circuit breaker: consecutive failed dispatches before a node is taken out
+# of selection (0 turns the breaker off), and for how long
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "3"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+
+def node_key(node_id: str) -> str:
+    return f"node:{node_id}"
+
+
+def available_key(model_id: str) -> str:
+    return f"nodes:available:{model_id}"
+
+
+def node_tasks_key(node_id: str) -> str:
+    return f"node_tasks:{node_id}"
+
+
+def node_slots(vram: float, min_vram: float, max_concurrency: Optional[int] = None) -> int:
+    """Concurrent requests a node takes for a model
+
+    The node's own figure wins; otherwise one request per copy of the
+    model's minimum VRAM that fits on the node.
+    """
+    if max_concurrency:
+        return max_concurrency
+    return max(1, int(vram // min_vram))
+
+
+# Lua shared by the registry scripts. A node's slots field holds its slot
+# count per model, in the order of its models field, and in_flight counts
+# the slots taken; status is busy once every slot is taken, and tripped
+# while its circuit breaker is open.
+#
+# Fleet totals live in the nodes:totals hash and are kept up to date by
+# every script, so reading them never touches individual nodes. Fields are
+# nodes/available/vram/slots for the whole fleet, the same four prefixed
+# with model:{id}: and location:{name}:, and the fleet score sum. Available
+# counts nodes with a free slot; slots outside a model group are the node's
+# largest slot count.
+REGISTRY_LUA = """
+local function model_slots(models, slots)
+    local counts = {}
+    for count in string.gmatch(slots or '', '[^,]+') do
+        table.insert(counts, tonumber(count))
+    end
+    local result = {}
+    for model in string.gmatch(models or '', '[^,]+') do
+        table.insert(result, {model, counts[#result + 1] or 1})
+    end
+    return result
+end
+
+-- Adds the node to, or drops it from, the model's available set and the
+-- selection indexes beside it: :fit, scored vram * 1000 - score so nodes
+-- come smallest first and best scored within a size, and :location:{name}
+-- by score.
+local function index_add(model, node_id, score)
+    local fields = redis.call('HMGET', 'node:' .. node_id, 'vram', 'location')
+    local available = 'nodes:available:' .. model
+    redis.call('ZADD', available, score, node_id)
+    redis.call('ZADD', available .. ':fit', (tonumber(fields[1]) or 0) * 1000 - tonumber(score), node_id)
+    redis.call('ZADD', available .. ':location:' .. (fields[2] or ''), score, node_id)
+end
+
+local function index_remove(model, node_id)
+    local available = 'nodes:available:' .. model
+    redis.call('ZREM', available, node_id)
+    redis.call('ZREM', available .. ':fit', node_id)
+    redis.call('ZREM', available .. ':location:' .. (redis.call('HGET', 'node:' .. node_id, 'location') or ''), node_id)
+end
+
+local function account(node_id, node_delta, available_delta)
+    local fields = redis.call('HMGET', 'node:' .. node_id, 'vram', 'location', 'models', 'score', 'slots')
+    local vram = tonumber(fields[1]) or 0
+    local most = 0
+    local groups = {}
+    for _, slot in ipairs(model_slots(fields[3], fields[5])) do
+        table.insert(groups, {'model:' .. slot[1] .. ':', slot[2]})
+        most = math.max(most, slot[2])
+    end
+    table.insert(groups, {'', most})
+    if fields[2] then
+        table.insert(groups, {'location:' .. fields[2] .. ':', most})
+    end
+    for _, group in ipairs(groups) do
+        local prefix = group[1]
+        if available_delta ~= 0 then
+            redis.call('HINCRBY', 'nodes:totals', prefix .. 'available', available_delta)
+        end
+        if node_delta ~= 0 then
+            local nodes = redis.call('HINCRBY', 'nodes:totals', prefix .. 'nodes', node_delta)
+            redis.call('HINCRBY', 'nodes:totals', prefix .. 'vram', node_delta * vram)
+            redis.call('HINCRBY', 'nodes:totals', prefix .. 'slots', node_delta * group[2])
+            if nodes <= 0 and prefix ~= '' then
+                redis.call('HDEL', 'nodes:totals', prefix .. 'nodes', prefix .. 'available', prefix .. 'vram', prefix .. 'slots')
+            end
+        end
+    end
+    if node_delta ~= 0 then
+        redis.call('HINCRBYFLOAT', 'nodes:totals', 'score', node_delta * (tonumber(fields[4]) or 0))
+    end
+end
+
+local function remove(node_id)
+    local node = 'node:' .. node_id
+    local tasks = {}
+    if redis.call('EXISTS', node) == 1 then
+        account(node_id, -1, redis.call('HGET', node, 'status') == 'available' and -1 or 0)
+        for model in string.gmatch(redis.call('HGET', node, 'models') or '', '[^,]+') do
+            index_remove(model, node_id)
+        end
+        tasks = redis.call('SMEMBERS', 'node_tasks:' .. node_id)
+    end
+    redis.call('DEL', node, 'node_tasks:' .. node_id, 'node_inbox:' .. node_id, 'node_control:' .. node_id)
+    redis.call('SREM', 'nodes:all', node_id)
+    redis.call('ZREM', 'nodes:heartbeats', node_id)
+    redis.call('ZREM', 'nodes:tripped', node_id)
+    return tasks
+end
+
+-- Puts the node, at its score, in the available set of every model it has
+-- a free slot for, unless its circuit breaker is open.
+local function offer(node_id)
+    if redis.call('ZSCORE', 'nodes:tripped', node_id) then
+        return
+    end
+    local fields = redis.call('HMGET', 'node:' .. node_id, 'models', 'slots', 'in_flight', 'score')
+    for _, slot in ipairs(model_slots(fields[1], fields[2])) do
+        if (tonumber(fields[3]) or 0) < slot[2] then
+            index_add(slot[1], node_id, fields[4])
+        end
+    end
+end
+
+-- Opens the node's circuit breaker until reopen_at.
+local function trip(node_id, reopen_at)
+    local node = 'node:' .. node_id
+    redis.call('ZADD', 'nodes:tripped', reopen_at, node_id)
+    for model in string.gmatch(redis.call('HGET', node, 'models') or '', '[^,]+') do
+        index_remove(model, node_id)
+    end
+    if redis.call('HGET', node, 'status') == 'available' then
+        account(node_id, 0, -1)
+    end
+    redis.call('HSET', node, 'status', 'tripped')
+end
+
+-- Takes a slot on the node, leaves the available set of every model whose
+-- slots are now all taken, and records the task (may be empty) as in flight
+-- on it. Returns the node's status and slots in use.
+local function reserve(node_id, task_id)
+    local node = 'node:' .. node_id
+    local fields = redis.call('HMGET', node, 'models', 'slots', 'status')
+    local in_flight = redis.call('HINCRBY', node, 'in_flight', 1)
+    local status = 'busy'
+    for _, slot in ipairs(model_slots(fields[1], fields[2])) do
+        if in_flight >= slot[2] then
+            index_remove(slot[1], node_id)
+        else
+            status = 'available'
+        end
+    end
+    if status == 'busy' and fields[3] == 'available' then
+        redis.call('HSET', node, 'status', status)
+        account(node_id, 0, -1)
+    end
+    if task_id ~= '' then
+        redis.call('SADD', 'node_tasks:' .. node_id, task_id)
+    end
+    return {status, in_flight}
+end
+
+-- The best node in the set that isn't one of the excluded ids.
+local function reserve_best(available, task_id, exclude)
+    local skip = {}
+    for _, node_id in ipairs(exclude) do
+        skip[node_id] = true
+    end
+    for _, node_id in ipairs(redis.call('ZREVRANGE', available, 0, #exclude)) do
+        if not skip[node_id] then
+            local state = reserve(node_id, task_id)
+            return {node_id, state[1], state[2]}
+        end
+    end
+    return false
+end
+"""
+
+# ARGV = node id, timestamp, capabilities json, models, vram, location,
+# bandwidth, slots per model. Registering an id that already exists replaces
+# the old registration.
+REGISTER_SCRIPT = REGISTRY_LUA + """
+local node_id = ARGV[1]
+remove(node_id)
+redis.call('HSET', 'node:' .. node_id,
+    'capabilities', ARGV[3], 'models', ARGV[4], 'vram', ARGV[5], 'location', ARGV[6], 'bandwidth', ARGV[7],
+    'slots', ARGV[8], 'in_flight', 0, 'status', 'available', 'score', 100.0, 'tasks_completed', 0,
+    'uptime', 0, 'last_heartbeat', ARGV[2])
+redis.call('SADD', 'nodes:all', node_id)
+redis.call('ZADD', 'nodes:heartbeats', ARGV[2], node_id)
+for model in string.gmatch(ARGV[4], '[^,]+') do
+    index_add(model, node_id, 100.0)
+end
+account(node_id, 1, 1)
+return 1
+"""
+
+# ARGV[1] = node id. Drops the node from the registry and selection index.
+REMOVE_SCRIPT = REGISTRY_LUA + """
+remove(ARGV[1])
+return 1
+"""
+
+# KEYS[1] = available set for the model, ARGV[1] = task id (may be empty),
+# ARGV[2..] = node ids to pass over. Returns {node id, status, slots in use}
+# or nil.
+RESERVE_BEST_SCRIPT = REGISTRY_LUA + """
+local exclude = {}
+for i = 2, #ARGV do
+    table.insert(exclude, ARGV[i])
+end
+return reserve_best(KEYS[1], ARGV[1], exclude)
+"""
+
+# ARGV = node id, task id (may be empty), outcome, failures that open the
+# breaker (0 never), reopen time. Frees a slot on the node and returns
+# {status, slots in use}, or nil if there was nothing to release. Outcome
+# "ok" closes the breaker count, "failed" adds to it, and an empty outcome
+# (a withdrawn request) leaves it alone.
+RELEASE_SCRIPT = REGISTRY_LUA + """
+local node = 'node:' .. ARGV[1]
+if ARGV[2] ~= '' and redis.call('SREM', 'node_tasks:' .. ARGV[1], ARGV[2]) == 0 then
+    return false
+end
+local fields = redis.call('HMGET', node, 'status', 'in_flight')
+-- Nodes registered before slots were counted have no in_flight yet
+local in_flight = tonumber(fields[2]) or (fields[1] == 'busy' and 1 or 0)
+if in_flight <= 0 then
+    return false
+end
+in_flight = in_flight - 1
+redis.call('HSET', node, 'in_flight', in_flight)
+if ARGV[3] == 'ok' then
+    redis.call('HSET', node, 'failures', 0)
+    redis.call('HINCRBY', node, 'tasks_completed', 1)
+elseif ARGV[3] == 'failed' then
+    local failures = redis.call('HINCRBY', node, 'failures', 1)
+    local threshold = tonumber(ARGV[4])
+    if threshold > 0 and failures >= threshold and fields[1] ~= 'tripped' then
+        trip(ARGV[1], ARGV[5])
+        return {'tripped', in_flight}
+    end
+end
+offer(ARGV[1])
+if fields[1] == 'busy' then
+    redis.call('HSET', node, 'status', 'available')
+    account(ARGV[1], 0, 1)
+    return {'available', in_flight}
+end
+return {fields[1], in_flight}
+"""
+
+# ARGV = node id, now, failures that open the breaker. Closes the node's
+# breaker on probation if it is due: one more failure opens it again.
+REOPEN_SCRIPT = REGISTRY_LUA + """
+local node = 'node:' .. ARGV[1]
+local reopen_at = redis.call('ZSCORE', 'nodes:tripped', ARGV[1])
+if not reopen_at or tonumber(reopen_at) > tonumber(ARGV[2]) then
+    return false
+end
+redis.call('ZREM', 'nodes:tripped', ARGV[1])
+local fields = redis.call('HMGET', node, 'models', 'slots', 'in_flight')
+local status = 'busy'
+for _, slot in ipairs(model_slots(fields[1], fields[2])) do
+    if (tonumber(fields[3]) or 0) < slot[2] then
+        status = 'available'
+    end
+end
+redis.call('HSET', node, 'status', status, 'failures', math.max(0, tonumber(ARGV[3]) - 1))
+if status == 'available' then
+    account(ARGV[1], 0, 1)
+end
+offer(ARGV[1])
+return {status, tonumber(fields[3]) or 0}
+"""
+
+# ARGV[1] = node id, ARGV[2] = performance term of the new score, ARGV[3] =
+# measured tokens/s (0 if the dispatch failed). Smooths the score here, so
+# concurrent updates each build on the last, re-ranks the node in the sets it
+# is available in and folds the measurement into the node's moving average
+# throughput. Returns the unclamped new score, or nil if the node is gone.
+UPDATE_SCORE_SCRIPT = REGISTRY_LUA + """
+local node = 'node:' .. ARGV[1]
+local old = redis.call('HGET', node, 'score')
+if not old then
+    return false
+end
+local score = tonumber(old) * 0.7 + tonumber(ARGV[2])
+local clamped = math.min(100, math.max(0, score))
+redis.call('HSET', node, 'score', clamped)
+local measured = tonumber(ARGV[3])
+if measured > 0 then
+    local average = tonumber(redis.call('HGET', node, 'tokens_per_second'))
+    if average then
+        measured = average * 0.8 + measured * 0.2
+    end
+    redis.call('HSET', node, 'tokens_per_second', measured)
+end
+redis.call('HINCRBYFLOAT', 'nodes:totals', 'score', clamped - tonumber(old))
+offer(ARGV[1])
+-- Lua numbers come back truncated to integers
+return tostring(score)
+"""
+
+# ARGV[1] = node id, ARGV[2] = heartbeat cutoff. Removes the node if its last
+# heartbeat is still older than the cutoff and returns the tasks that were
+# in flight on it; returns nil if the node was already gone or came back.
+EVICT_SCRIPT = REGISTRY_LUA + """
+local heartbeat = redis.call('ZSCORE', 'nodes:heartbeats', ARGV[1])
+if not heartbeat or tonumber(heartbeat) > tonumber(ARGV[2]) then
+    return false
+end
+local tasks = remove(ARGV[1])
+redis.call('HINCRBY', 'nodes:stats', 'evicted', 1)
+return tasks
+"""
+
+
+class GPUNodeManager:
+    def __init__(self, redis, circuit_failures: int = CIRCUIT_FAILURES,
+                 circuit_open_seconds: float = CIRCUIT_OPEN_SECONDS):
+        self.redis = redis
+        self.circuit_failures = circuit_failures
+        self.circuit_open_seconds = circuit_open_seconds
+        self.nodes: Dict[str, Dict] = {}
+        self._register = redis.register_script(REGISTER_SCRIPT)
+        self._remove = redis.register_script(REMOVE_SCRIPT)
+        self._reserve_best = redis.register_script(RESERVE_BEST_SCRIPT)
+        self._release = redis.register_script(RELEASE_SCRIPT)
+        self._reopen = redis.register_script(REOPEN_SCRIPT)
+        self._update_score = redis.register_script(UPDATE_SCORE_SCRIPT)
+        self._evict = redis.register_script(EVICT_SCRIPT)
+        self._background: List[asyncio.Task] = []
+
+    async def start(self, sweep: bool = True):
+        """Load the registry into the read cache, follow changes and expire dead nodes"""
+        if not await self.redis.exists(TOTALS_KEY) and await self.redis.scard(NODES_KEY):
+            await self.rebuild_totals()
+        await self.refresh()
+        self._background.append(asyncio.create_task(self._listen()))
+        if sweep:
+            self._background.append(asyncio.create_task(self._sweep_forever()))
+
+    async def stop(self):
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background = []
+
+    async def refresh(self, node_id: Optional[str] = None):
+        """Reload one node, or the whole registry, from Redis"""
+        node_ids = [node_id] if node_id else [decode(n) for n in await self.redis.smembers(NODES_KEY)]
+        if not node_id:
+            self.nodes = {}
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for nid in node_ids:
+                pipe.hgetall(node_key(nid))
+            records = await pipe.execute()
+
+        for nid, record in zip(node_ids, records):
+            if record:
+                self.nodes[nid] = self._from_record(record)
+            else:
+                self.nodes.pop(nid, None)
+
+    @staticmethod
+    def _from_record(record: dict) -> Dict:
+        record = {decode(k): decode(v) for k, v in record.items()}
+        return {
+            "capabilities": json.loads(record["capabilities"]),
+            "status": record["status"],
+            "score": float(record["score"]),
+            "tasks_completed": int(record.get("tasks_completed", 0)),
+            "uptime": float(record.get("uptime", 0)),
+            "tokens_per_second": float(record.get("tokens_per_second", 0)),
+            "in_flight": int(record.get("in_flight", 0)),
+            "model_states": json.loads(record.get("model_states", "{}")),
+            "last_heartbeat": datetime.fromtimestamp(float(record["last_heartbeat"]))
+        }
+
+    async def _changed(self, node_id: str, state: Optional[list] = None):
+        """Update our cache and tell other processes to update theirs
+
+        A slot change, given as the {status, slots in use} a script returned,
+        is applied as is; anything else makes every process reload the node
+        from Redis.
+        """
+        update = {"node_id": node_id}
+        if state:
+            update["status"], update["in_flight"] = decode(state[0]), int(state[1])
+            self._apply(update)
+        else:
+            await self.refresh(node_id)
+        await self.redis.publish(NODE_UPDATES_CHANNEL, json.dumps(update))
+
+    async def slots_changed(self, node_id: str, state: list):
+        """Announce a slot taken outside this manager, such as by admission
+
+        state is the {status, slots in use} the script returned.
+        """
+        await self._changed(node_id, state)
+
+    def _apply(self, update: dict) -> bool:
+        node = self.nodes.get(update["node_id"])
+        if node is None or "status" not in update:
+            return False
+        if update["in_flight"] < node["in_flight"]:
+            node["tasks_completed"] += 1
+        node["status"] = update["status"]
+        node["in_flight"] = update["in_flight"]
+        return True
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(NODE_UPDATES_CHANNEL)
+                # Changes made while unsubscribed are only visible in Redis
+                await self.refresh()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    update = json.loads(message["data"])
+                    if not self._apply(update):
+                        await self.refresh(update["node_id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Node registry subscription error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def register_node(self, node_id: str, capabilities: dict, slots: Optional[Dict[str, int]] = None):
+        """Register a GPU node with its capabilities and slots per model (default 1)"""
+        slots = slots or {}
+        models = capabilities.get("supported_models", [])
+        await self._register(args=[
+            node_id,
+            time.time(),
+            json.dumps(capabilities),
+            ",".join(models),
+            capabilities["vram"],
+            capabilities.get("location", ""),
+            capabilities.get("bandwidth", 0),
+            ",".join(str(slots.get(model, 1)) for model in models)
+        ])
+        await self._changed(node_id)
+        logger.info(f"Node {node_id} registered with {capabilities['vram']}GB VRAM")
+
+    async def set_model_states(self, node_id: str, states: Dict[str, Optional[str]], replace: bool = False):
+        """Record a node's model readiness: loading, ready, failed, or None once unloaded
+
+        States are merged into what the node reported before, or replace
+        it all (as on a new connection).
+        """
+        if node_id not in self.nodes:
+            await self.refresh(node_id)
+        node = self.nodes.get(node_id)
+        if node is None:
+            return
+        merged = {**({} if replace else node["model_states"]), **states}
+        merged = {model: state for model, state in merged.items() if state is not None}
+        await self.redis.hset(node_key(node_id), "model_states", json.dumps(merged))
+        await self._changed(node_id)
+
+    async def remove_node(self, node_id: str):
+        """Drop a node from the registry and the selection index"""
+        await self._remove(args=[node_id])
+        await self._changed(node_id)
+
+    async def heartbeat(self, node_id: str) -> bool:
+        """Record a heartbeat; returns False for unknown nodes"""
+        if not await self.redis.exists(node_key(node_id)):
+            return False
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(node_key(node_id), "last_heartbeat", now)
+            pipe.zadd(HEARTBEATS_KEY, {node_id: now}, xx=True)
+            await pipe.execute()
+        if node_id in self.nodes:
+            self.nodes[node_id]["last_heartbeat"] = datetime.now()
+        return True
+
+    async def expire_stale_nodes(self, timeout: float = NODE_HEARTBEAT_TIMEOUT) -> List[str]:
+        """Evict nodes whose last heartbeat is older than timeout
+
+        Only the expired end of the heartbeat index is read, so a sweep costs
+        O(log N + expired) rather than a scan of the fleet. Tasks that were
+        in flight on an evicted node get a node_lost reply, which makes the
+        worker waiting on them queue the task again.
+        """
+        cutoff = time.time() - timeout
+        expired = await self.redis.zrangebyscore(HEARTBEATS_KEY, "-inf", cutoff, start=0, num=NODE_SWEEP_BATCH)
+
+        evicted = []
+        for node_id in map(decode, expired):
+            tasks = await self._evict(args=[node_id, cutoff])
+            if tasks is None:
+                continue  # Another process evicted it, or it just sent a heartbeat
+
+            evicted.append(node_id)
+            for request_id in map(decode, tasks):
+                await self.redis.rpush(node_result_key(request_id), json.dumps({
+                    "type": "inference_response",
+                    "request_id": request_id,
+                    "result": {"error": f"Node {node_id} stopped responding", "node_lost": True}
+                }))
+            await self._changed(node_id)
+            logger.warning(f"Evicted node {node_id}: no heartbeat for {timeout:.0f}s, {len(tasks)} tasks re-queued")
+        return evicted
+
+    async def reopen_tripped_nodes(self) -> List[str]:
+        """Let nodes whose breaker has been open long enough back into selection"""
+        due = await self.redis.zrangebyscore(TRIPPED_KEY, "-inf", time.time(), start=0, num=NODE_SWEEP_BATCH)
+        reopened = []
+        for node_id in map(decode, due):
+            state = await self._reopen(args=[node_id, time.time(), self.circuit_failures])
+            if state:
+                reopened.append(node_id)
+                await self._changed(node_id, state)
+                logger.info(f"Node {node_id} back in selection on probation")
+        return reopened
+
+    async def _sweep_forever(self):
+        while True:
+            try:
+                while len(await self.expire_stale_nodes()) == NODE_SWEEP_BATCH:
+                    pass
+                while len(await self.reopen_tripped_nodes()) == NODE_SWEEP_BATCH:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Node sweep error: {e}")
+            await asyncio.sleep(NODE_SWEEP_INTERVAL)
+
+    async def liveness_stats(self) -> Dict[str, int]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zcount(HEARTBEATS_KEY, "-inf", time.time() - NODE_STALE_AFTER)
+            pipe.hget(NODE_STATS_KEY, "evicted")
+            stale, evicted = await pipe.execute()
+        return {"stale_nodes": stale, "evicted_nodes": int(evicted or 0)}
+
+    async def rebuild_totals(self):
+        """Recompute the fleet totals from every node
+
+        Only needed for a registry written before totals were kept; this is
+        the one O(N) pass, and it also fills in the vram, location, bandwidth
+        and slot fields the scripts and the scheduler read.
+        """
+        node_ids = [decode(n) for n in await self.redis.smembers(NODES_KEY)]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for node_id in node_ids:
+                pipe.hgetall(node_key(node_id))
+            records = await pipe.execute()
+
+        totals: Dict[str, float] = {"nodes": 0, "available": 0, "vram": 0, "slots": 0, "score": 0.0}
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for node_id, record in zip(node_ids, records):
+                if not record:
+                    continue
+                record = {decode(k): decode(v) for k, v in record.items()}
+                capabilities = json.loads(record["capabilities"])
+                vram, location = capabilities["vram"], capabilities.get("location", "")
+                models = [m for m in record["models"].split(",") if m]
+                # Nodes registered before slots were counted take one request
+                slots = [int(c) for c in record["slots"].split(",")] if record.get("slots") else [1] * len(models)
+                pipe.hset(node_key(node_id), mapping={
+                    "vram": vram, "location": location, "bandwidth": capabilities.get("bandwidth", 0),
+                    "slots": ",".join(map(str, slots)),
+                    "in_flight": record.get("in_flight", 1 if record["status"] == "busy" else 0)
+                })
+
+                available = 1 if record["status"] == "available" else 0
+                totals["score"] += float(record["score"])
+                most = max(slots, default=0)
+                groups = [("", most), (f"location:{location}:", most)] + [
+                    (f"model:{m}:", count) for m, count in zip(models, slots)
+                ]
+                for prefix, count in groups:
+                    totals[f"{prefix}nodes"] = totals.get(f"{prefix}nodes", 0) + 1
+                    totals[f"{prefix}available"] = totals.get(f"{prefix}available", 0) + available
+                    totals[f"{prefix}vram"] = totals.get(f"{prefix}vram", 0) + vram
+                    totals[f"{prefix}slots"] = totals.get(f"{prefix}slots", 0) + count
+            pipe.delete(TOTALS_KEY)
+            pipe.hset(TOTALS_KEY, mapping=totals)
+            await pipe.execute()
+        logger.info(f"Rebuilt fleet totals from {len(node_ids)} nodes")
+
+    async def network_totals(self) -> Dict:
+        """Fleet totals with per-model and per-location breakdowns"""
+        raw = {decode(k): decode(v) for k, v in (await self.redis.hgetall(TOTALS_KEY)).items()}
+        breakdown: Dict[str, Dict[str, Dict[str, int]]] = {"model": {}, "location": {}}
+        for field, value in raw.items():
+            kind, _, rest = field.partition(":")
+            if kind in breakdown:
+                name, _, counter = rest.rpartition(":")
+                breakdown[kind].setdefault(name, {})[TOTALS_FIELDS[counter]] = int(value)
+
+        total_nodes = int(raw.get("nodes", 0))
+        return {
+            "total_nodes": total_nodes,
+            "available_nodes": int(raw.get("available", 0)),
+            "total_vram_gb": int(raw.get("vram", 0)),
+            "total_slots": int(raw.get("slots", 0)),
+            "average_node_score": float(raw.get("score", 0)) / total_nodes if total_nodes else 0,
+            "models": breakdown["model"],
+            "locations": breakdown["location"]
+        }
+
+    async def select_best_node(self, model_id: str, request_id: Optional[str] = None,
+                               exclude: Iterable[str] = ()) -> Optional[str]:
+        """Take a slot on the best available node for a request, other than the excluded ones"""
+        with stage_timer("node_selection"):
+            reserved = await self._reserve_best(keys=[available_key(model_id)], args=[request_id or "", *exclude])
+        if not reserved:
+            return None
+
+        selected_node = decode(reserved[0])
+        await self._changed(selected_node, reserved[1:])
+        return selected_node
+
+    async def release_node(self, node_id: str, request_id: Optional[str] = None, outcome: str = "ok"):
+        """Free the request's slot on a node
+
+        outcome is "ok" or "failed", which feed the node's circuit breaker,
+        or "" for a request that was withdrawn, such as a losing hedge.
+        """
+        state = await self._release(args=[
+            node_id, request_id or "", outcome, self.circuit_failures, time.time() + self.circuit_open_seconds
+        ])
+        if state:
+            await self._changed(node_id, state)
+            if decode(state[0]) == "tripped":
+                logger.warning(f"Node {node_id} failed {self.circuit_failures} dispatches in a row, "
+                               f"out of selection for {self.circuit_open_seconds:.0f}s")
+
+    async def update_node_score(self, node_id: str, timings: dict, expected_speed: float,
+                                uptime: float = 100, accuracy: float = 1) -> float:
+        """Update node reliability score from the timings the node reported
+
+        The speed factor is the node's measured decode throughput against the
+        model's expected tokens_per_second, so routing follows what nodes
+        actually deliver.
+        """
+        actual_speed = timings.get("decode_tokens_per_second", 0)
+
+        # Calculate performance adjustments
+        uptime_factor = uptime / 100
+        speed_factor = min(1.0, actual_speed / expected_speed) if expected_speed else 1.0
+        accuracy_factor = accuracy
+
+        # The script blends this with 0.7 of the current score
+        performance = uptime_factor * 10 + speed_factor * 10 + accuracy_factor * 10
+        new_score = await self._update_score(args=[node_id, performance, actual_speed])
+        if new_score is None:
+            return 0
+        new_score = float(new_score)
+        await self._changed(node_id)
+
+        # Calculate payment adjustment (±10% based on score)
+        adjustment = (new_score - 80) / 200  # -10% to +10%
+        return adjustment
@@ -0,0 +1,37 @@
+"""
+Prefix affinity for node selection.
+
+GPU nodes keep the key/values of recent prompt prefixes (see PrefixCache in
+gpu_node_client.py), so a request whose prompt starts like an earlier one
+prefills much faster on the node that served the earlier one. Prompts are
+keyed by a hash of their model and first PREFIX_AFFINITY_CHARS characters.
+After a task completes, its key points at the node that served it for
+PREFIX_AFFINITY_TTL seconds. The admission scheduler then offers that node
+to the scheduling policy as a candidate marked prefix_cached.
+"""
+
+import hashlib
+import os
+from typing import Optional
+
+PREFIX_AFFINITY_ENABLED = os.getenv("PREFIX_AFFINITY_ENABLED", "true").lower() == "true"
+# Shorter prompts have too little prefix to be worth routing on
+PREFIX_AFFINITY_CHARS = int(os.getenv("PREFIX_AFFINITY_CHARS", "256"))
+PREFIX_AFFINITY_TTL = int(os.getenv("PREFIX_AFFINITY_TTL", "600"))
+
+
+def prefix_key(model_id: str, prompt: str) -> Optional[str]:
+    """Key shared by prompts for the model that start the same way, or None"""
+    if not PREFIX_AFFINITY_ENABLED or len(prompt) < PREFIX_AFFINITY_CHARS:
+        return None
+    digest = hashlib.blake2b(f"{model_id}\0{prompt[:PREFIX_AFFINITY_CHARS]}".encode(), digest_size=16)
+    return digest.hexdigest()
+
+
+def affinity_key(key: str) -> str:
+    return f"prefix_affinity:{key}"
+
+
+async def remember_node(redis, key: str, node_id: str):
+    """Route later prompts with this prefix to the node that just served one"""
+    await redis.set(affinity_key(key), node_id, ex=PREFIX_AFFINITY_TTL)
@@ -0,0 +1,132 @@
+"""
+Redis connections for the inference API and workers.
+
+create_redis gives a client on an explicit, bounded connection pool: a
+caller that finds every connection busy waits up to REDIS_POOL_TIMEOUT for
+one instead of opening more, and connections idle for
+REDIS_HEALTH_CHECK_INTERVAL are pinged before reuse. Size the pool for the
+long-lived connections too: each pub/sub subscription holds one. Node
+channels get a pool of their own (NODE_CHANNEL_MAX_CONNECTIONS), since
+every node connected to an API process keeps two connections blocked in
+BLPOP, and sharing would leave requests waiting behind them.
+
+PipelineBatcher merges the Lua script calls of concurrent requests, such as
+admission's rate limit and enqueue, into one pipeline flushed every
+REDIS_BATCH_WINDOW_MS, so a burst of requests costs a few round trips
+instead of one or more each.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import redis.asyncio as redis
+from redis.exceptions import NoScriptError
+
+logger = logging.getLogger(__name__)
+
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "1024"))
+# Two per connected node, plus their reply pipelines
+NODE_CHANNEL_MAX_CONNECTIONS = int(os.getenv("NODE_CHANNEL_MAX_CONNECTIONS", "4096"))
+# Seconds to wait for a free pooled connection before failing the command
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5"))
+REDIS_BATCH_ENABLED = os.getenv("REDIS_BATCH_ENABLED", "false").lower() == "true"
+REDIS_BATCH_WINDOW_MS = float(os.getenv("REDIS_BATCH_WINDOW_MS", "2"))
+REDIS_BATCH_MAX_CALLS = int(os.getenv("REDIS_BATCH_MAX_CALLS", "256"))
+
+
+def create_redis(url: str, max_connections: int = REDIS_MAX_CONNECTIONS) -> redis.Redis:
+    pool = redis.BlockingConnectionPool.from_url(
+        url,
+        max_connections=max_connections,
+        timeout=REDIS_POOL_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True
+    )
+    return redis.Redis.from_pool(pool)
+
+
+def decode(value):
+    """str for a reply value that may come back as bytes"""
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class PipelineBatcher:
+    """Runs script calls from concurrent callers as one pipeline per window"""
+
+    def __init__(self, redis_client, window_ms: float = REDIS_BATCH_WINDOW_MS,
+                 max_calls: int = REDIS_BATCH_MAX_CALLS):
+        self.redis = redis_client
+        self.window = window_ms / 1000
+        self.max_calls = max_calls
+        self._calls: List[Tuple[Any, Sequence, Sequence, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushing: Set[asyncio.Task] = set()
+        self.flushes = 0
+        self.calls = 0
+
+    async def run(self, script, keys: Sequence = (), args: Sequence = ()) -> Any:
+        """script(keys=keys, args=args), sent with whatever else is waiting"""
+        future = asyncio.get_running_loop().create_future()
+        self._calls.append((script, keys, args, future))
+        if len(self._calls) >= self.max_calls:
+            if self._flusher is not None:
+                self._flusher.cancel()
+            self._flusher = None
+            task = asyncio.create_task(self._flush(self._take()))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+        elif self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+        return await future
+
+    def _take(self):
+        calls, self._calls = self._calls, []
+        return calls
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._flusher = None
+        await self._flush(self._take())
+
+    async def _flush(self, calls):
+        if not calls:
+            return
+        self.flushes += 1
+        self.calls += len(calls)
+        try:
+            # EVALSHA directly: queuing the Script objects would make the
+            # pipeline check SCRIPT EXISTS on every flush
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for script, keys, args, _ in calls:
+                    pipe.evalsha(script.sha, len(keys), *keys, *args)
+                results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            results = [e] * len(calls)
+
+        # After a Redis restart the scripts are gone; calling them loads them
+        for i, result in enumerate(results):
+            if isinstance(result, NoScriptError):
+                script, keys, args, _ = calls[i]
+                try:
+                    results[i] = await script(keys=keys, args=args)
+                except Exception as e:
+                    results[i] = e
+
+        for (_, _, _, future), result in zip(calls, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "flushes": self.flushes,
+            "mean_calls_per_flush": self.calls / self.flushes if self.flushes else 0.0
+        }
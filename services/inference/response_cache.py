@@ -0,0 +1,117 @@
+"""
+Result cache for deterministic inference requests.
+
+Requests with temperature=0 always produce the same completion, so their
+results are cached in Redis under a hash of the model and sampling
+parameters. Identical requests that arrive while the first one is still
+running are coalesced onto its task instead of taking another node.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from redis_pool import decode
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "600"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+# How long a task may hold the single-flight claim for its key
+RESULT_CACHE_CLAIM_TTL = int(os.getenv("RESULT_CACHE_CLAIM_TTL", "600"))
+
+CACHE_INDEX_KEY = "result_cache:index"
+CACHE_STATS_KEY = "result_cache:stats"
+
+# Drop a claim only if it is still held by the given task
+RELEASE_CLAIM_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class ResponseCache:
+    def __init__(self, redis, ttl: int = RESULT_CACHE_TTL, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.redis = redis
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._release_claim = redis.register_script(RELEASE_CLAIM_SCRIPT)
+
+    @staticmethod
+    def eligible(temperature: float, stream: bool = False) -> bool:
+        """Only greedy, non-streaming requests are cached"""
+        return RESULT_CACHE_ENABLED and temperature == 0 and not stream
+
+    @staticmethod
+    def key_for(model_id: str, prompt: str, max_tokens: int, temperature: float, top_p: float) -> str:
+        payload = json.dumps([model_id, prompt, max_tokens, temperature, top_p])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def lookup_or_claim(self, cache_key: str, task_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Return (cached entry, None) on a hit, else (None, owning task id)
+
+        The owner is task_id when this caller won the claim and must run the
+        task, or the id of the task already computing the same result.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(f"result_cache:{cache_key}")
+            pipe.set(f"result_inflight:{cache_key}", task_id, nx=True, ex=RESULT_CACHE_CLAIM_TTL)
+            pipe.get(f"result_inflight:{cache_key}")
+            cached, claimed, owner = await pipe.execute()
+
+        if cached:
+            if claimed:
+                await self.release(cache_key, task_id)
+            await self.redis.hincrby(CACHE_STATS_KEY, "hits", 1)
+            return json.loads(cached), None
+
+        await self.redis.hincrby(CACHE_STATS_KEY, "misses" if claimed else "coalesced", 1)
+        return None, task_id if claimed else decode(owner)
+
+    async def release(self, cache_key: str, task_id: str):
+        """Give up the claim without storing a result"""
+        await self._release_claim(keys=[f"result_inflight:{cache_key}"], args=[task_id])
+
+    async def store(self, cache_key: str, task_id: str, result: str, tokens_generated: int):
+        """Cache a completed result, trim the cache to size and release the claim"""
+        entry = json.dumps({
+            "task_id": task_id,
+            "result": result,
+            "tokens_generated": tokens_generated
+        })
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(f"result_cache:{cache_key}", entry, ex=self.ttl)
+            pipe.zadd(CACHE_INDEX_KEY, {cache_key: time.time()})
+            pipe.zremrangebyscore(CACHE_INDEX_KEY, "-inf", time.time() - self.ttl)
+            pipe.zcard(CACHE_INDEX_KEY)
+            *_, size = await pipe.execute()
+
+        # Evict the oldest entries once the cap is exceeded
+        if size > self.max_entries:
+            evicted = await self.redis.zpopmin(CACHE_INDEX_KEY, size - self.max_entries)
+            if evicted:
+                await self.redis.delete(*(f"result_cache:{decode(key)}" for key, _ in evicted))
+                await self.redis.hincrby(CACHE_STATS_KEY, "evictions", len(evicted))
+
+        await self.release(cache_key, task_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        counters = {
+            decode(field): int(value)
+            for field, value in (await self.redis.hgetall(CACHE_STATS_KEY)).items()
+        }
+        hits = counters.get("hits", 0)
+        lookups = hits + counters.get("misses", 0) + counters.get("coalesced", 0)
+        return {
+            "entries": await self.redis.zcard(CACHE_INDEX_KEY),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": hits,
+            "misses": counters.get("misses", 0),
+            "coalesced": counters.get("coalesced", 0),
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,108 @@
+"""
+Node scheduling policies.
+
+The admission scheduler shows a policy the task at the head of a model's
+queue together with a sample of the available nodes for that model (the
+best scored in the task's region and overall, and a few of each VRAM size
+from the smallest up), and reserves whichever node the policy picks. Policies are plain Python, so the
+simulator in benchmarks/ replays traces through the same code that runs in
+production.
+
+SCHEDULER_POLICY names a built-in policy or a custom one as "module:Class".
+"""
+
+import importlib
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+SCHEDULER_POLICY = os.getenv("SCHEDULER_POLICY", "balanced")
+# How many available nodes a policy chooses from, taken this many at a
+# time from the region, the best scored and each VRAM size
+SCHEDULER_CANDIDATES = int(os.getenv("SCHEDULER_CANDIDATES", "16"))
+SCHEDULER_GROUP_CANDIDATES = int(os.getenv("SCHEDULER_GROUP_CANDIDATES", "4"))
+
+
+class SchedulingPolicy(ABC):
+    """Chooses a node for a task
+
+    Each candidate is a dict with node_id, vram (GB), location, score
+    (0-100), tokens_per_second (measured, 0 until known), bandwidth, load
+    (requests in flight), slots (requests it takes at once for the model)
+    and prefix_cached (it served the task's prompt prefix last, so probably
+    still has its key/values). Tasks carry model, min_vram, max_tokens,
+    tokens_per_second (expected for the model) and an optional region.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def choose(self, task: Dict[str, Any], candidates: List[Dict[str, Any]]) -> Optional[str]:
+        """node_id of the chosen candidate, or None to leave the task queued"""
+
+
+class ScorePolicy(SchedulingPolicy):
+    """Highest reliability score wins, as node selection always worked"""
+
+    name = "score"
+
+    def choose(self, task, candidates):
+        if not candidates:
+            return None
+        return max(candidates, key=lambda node: node["score"])["node_id"]
+
+
+class BalancedPolicy(SchedulingPolicy):
+    """Best fit on VRAM, weighted by measured throughput, load, locality and prefix affinity
+
+    Small requests go to the smallest node that can hold the model, which
+    keeps large nodes free for the models only they can serve.
+    """
+
+    name = "balanced"
+
+    def __init__(self, fit_weight: float = 1.0, speed_weight: float = 1.0, load_weight: float = 0.5,
+                 locality_weight: float = 0.5, score_weight: float = 0.5, bandwidth_weight: float = 0.1,
+                 prefix_weight: float = 1.0):
+        self.fit_weight = fit_weight
+        self.speed_weight = speed_weight
+        self.load_weight = load_weight
+        self.locality_weight = locality_weight
+        self.score_weight = score_weight
+        self.bandwidth_weight = bandwidth_weight
+        self.prefix_weight = prefix_weight
+
+    def rank(self, task: Dict[str, Any], node: Dict[str, Any]) -> float:
+        # 1.0 for a node that exactly fits the model, approaching 0 for huge ones
+        fit = min(1.0, task.get("min_vram", 0) / node["vram"]) if node["vram"] else 0.0
+        expected = task.get("tokens_per_second") or 0
+        # Unmeasured nodes are assumed to run at the expected speed
+        speed = min(2.0, node["tokens_per_second"] / expected) if expected and node["tokens_per_second"] else 1.0
+        local = 1.0 if task.get("region") and node["location"] == task["region"] else 0.0
+        return (
+            self.fit_weight * fit
+            + self.speed_weight * speed
+            - self.load_weight * node["load"] / node["slots"]
+            + self.locality_weight * local
+            + self.score_weight * node["score"] / 100
+            + self.bandwidth_weight * min(1.0, node["bandwidth"] / 1000)
+            + self.prefix_weight * node.get("prefix_cached", False)
+        )
+
+    def choose(self, task, candidates):
+        if not candidates:
+            return None
+        return max(candidates, key=lambda node: self.rank(task, node))["node_id"]
+
+
+POLICIES = {policy.name: policy for policy in (ScorePolicy, BalancedPolicy)}
+
+
+def load_policy(name: str = SCHEDULER_POLICY) -> SchedulingPolicy:
+    """Instantiate a built-in policy by name, or a custom one from "module:Class" """
+    if ":" in name:
+        module_name, _, class_name = name.partition(":")
+        return getattr(importlib.import_module(module_name), class_name)()
+    if name not in POLICIES:
+        raise ValueError(f"Unknown scheduling policy {name!r}; choose from {sorted(POLICIES)}")
+    return POLICIES[name]()
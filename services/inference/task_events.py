@@ -0,0 +1,158 @@
+"""
+Incremental task updates pushed from workers to websocket watchers.
+
+Every update is appended to a per-task Redis stream, which gives each event
+a cursor clients can resume from, and announced on a per-task pub/sub
+channel. Each API process holds one pattern subscription and fans events
+out to its local watchers, so open sockets cost no Redis round trips.
+"""
+
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Set, Tuple
+
+import orjson
+from redis.exceptions import NoScriptError
+
+from redis_pool import decode
+from task_queue import TASK_TTL
+
+logger = logging.getLogger(__name__)
+
+TASK_EVENTS_MAXLEN = 10_000
+TERMINAL_EVENTS = ("result", "error")
+# Queued to watchers when live updates may have been missed
+RESYNC = (None, None)
+
+# KEYS[1] = event stream, KEYS[2] = updates channel, ARGV = max stream
+# length, event JSON, stream TTL, task id JSON. Appends the event, announces
+# it with its cursor and returns the cursor, in one round trip.
+PUBLISH_EVENT_SCRIPT = """
+local event_id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'event', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('PUBLISH', KEYS[2],
+    '{"task_id":' .. ARGV[4] .. ',"cursor":"' .. event_id .. '","event":' .. ARGV[2] .. '}')
+return event_id
+"""
+PUBLISH_EVENT_SHA = hashlib.sha1(PUBLISH_EVENT_SCRIPT.encode()).hexdigest()
+
+
+def task_events_key(task_id: str) -> str:
+    return f"task_events:{task_id}"
+
+
+def task_updates_channel(task_id: str) -> str:
+    return f"task_updates:{task_id}"
+
+
+def cursor_after(event_id: str, cursor: str) -> bool:
+    """True if stream id event_id comes strictly after cursor"""
+    def parse(stream_id: str) -> Tuple[int, int]:
+        ms, _, seq = stream_id.partition("-")
+        return int(ms), int(seq or 0)
+    return parse(event_id) > parse(cursor)
+
+
+async def publish_task_event(redis, task_id: str, event_type: str, **fields) -> str:
+    """Record a task event and notify live watchers; returns its cursor"""
+    keys = [task_events_key(task_id), task_updates_channel(task_id)]
+    args = [TASK_EVENTS_MAXLEN, orjson.dumps({"type": event_type, **fields}), TASK_TTL, orjson.dumps(task_id)]
+    try:
+        event_id = await redis.evalsha(PUBLISH_EVENT_SHA, len(keys), *keys, *args)
+    except NoScriptError:
+        event_id = await redis.eval(PUBLISH_EVENT_SCRIPT, len(keys), *keys, *args)
+    return decode(event_id)
+
+
+async def read_task_events(redis, task_id: str, after: str = "0-0") -> List[Tuple[str, Dict[str, Any]]]:
+    """Events recorded after the given cursor, oldest first"""
+    entries = await redis.xrange(task_events_key(task_id), min=f"({after}", max="+")
+    return [
+        (decode(event_id), orjson.loads(fields[b"event"]))
+        for event_id, fields in entries
+    ]
+
+
+class TaskEventHub:
+    """Shares one pub/sub subscription among all watchers in this process"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.watchers: Dict[str, Set[asyncio.Queue]] = {}
+        self._listener = None
+
+    async def start(self):
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+
+    @property
+    def connections(self) -> int:
+        return sum(len(queues) for queues in self.watchers.values())
+
+    @asynccontextmanager
+    async def subscribe(self, task_id: str):
+        """Queue of (cursor, event) pairs for one task while the context is open
+
+        A RESYNC entry means the caller should re-read the stream from its
+        own cursor with read_task_events; follow() handles this.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self.watchers.setdefault(task_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self.watchers.get(task_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.watchers[task_id]
+
+    async def follow(self, task_id: str, cursor: str = "0-0"):
+        """Yield (cursor, event) for a task after the given cursor until it finishes"""
+        async with self.subscribe(task_id) as updates:
+            # Replay what happened since the cursor, then follow live updates
+            events = await read_task_events(self.redis, task_id, after=cursor)
+            while True:
+                for event_id, event in events:
+                    if not cursor_after(event_id, cursor):
+                        continue
+                    yield event_id, event
+                    cursor = event_id
+                    if event["type"] in TERMINAL_EVENTS:
+                        return
+
+                update = await updates.get()
+                if update == RESYNC:
+                    events = await read_task_events(self.redis, task_id, after=cursor)
+                else:
+                    events = [update]
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe(task_updates_channel("*"))
+                # Updates published while we were not subscribed only exist in
+                # the streams; tell watchers to re-read from their cursor
+                for queues in self.watchers.values():
+                    for queue in queues:
+                        queue.put_nowait(RESYNC)
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    update = orjson.loads(message["data"])
+                    for queue in self.watchers.get(update["task_id"], ()):
+                        queue.put_nowait((update["cursor"], update["event"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Task event subscription error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
@@ -0,0 +1,117 @@
+"""
+Redis keys and helpers shared by the inference API and its workers.
+
+Tasks that have been given a node are put on a Redis stream read through a
+consumer group (see admission.py for how they get there), so any number of
+worker processes can share the load and a task that was handed to a
+crashed worker is claimed again by another one. Stream entries carry only
+the task, node and request ids.
+
+A task's state lives in the task:{id} hash, one orjson-encoded value per
+field, so status reads fetch just the fields they show and updates write
+just the fields that changed. The prompt, usually the bulk of a task, is
+kept once under task_prompt:{id} and only read to dispatch the task.
+"""
+
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import orjson
+from redis.exceptions import ResponseError
+
+INFERENCE_QUEUE = "inference_queue"
+WORKER_GROUP = "inference_workers"
+TASK_TTL = 3600
+
+
+def task_key(task_id: str) -> str:
+    return f"task:{task_id}"
+
+
+def task_prompt_key(task_id: str) -> str:
+    return f"task_prompt:{task_id}"
+
+
+def node_inbox_key(node_id: str) -> str:
+    return f"node_inbox:{node_id}"
+
+
+def node_control_key(node_id: str) -> str:
+    """Messages about requests a node already has, such as cancels"""
+    return f"node_control:{node_id}"
+
+
+def node_result_key(request_id: str) -> str:
+    return f"node_result:{request_id}"
+
+
+def dispatch_id(task: Dict[str, Any]) -> str:
+    """Request id a task is sent to its node under
+
+    Each time a task is queued again it gets a new one, so a late reply to
+    an earlier attempt is never read as the answer to the current one.
+    """
+    requeues = task.get("requeues", 0)
+    return f"{task['id']}~{requeues}" if requeues else task["id"]
+
+
+async def ensure_worker_group(redis):
+    """Create the stream and its consumer group if they don't exist yet"""
+    try:
+        await redis.xgroup_create(INFERENCE_QUEUE, WORKER_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def encode_fields(fields: Dict[str, Any]) -> Dict[str, bytes]:
+    return {name: orjson.dumps(value) for name, value in fields.items()}
+
+
+def decode_fields(names: Iterable, values: Iterable) -> Dict[str, Any]:
+    """Field dict from parallel names and stored values, skipping missing ones"""
+    return {
+        name.decode() if isinstance(name, bytes) else name: orjson.loads(value)
+        for name, value in zip(names, values) if value is not None
+    }
+
+
+def split_task(task: Dict[str, Any]) -> Tuple[Dict[str, bytes], Optional[str]]:
+    """A task's encoded record fields and its prompt, which are stored apart"""
+    fields = {name: value for name, value in task.items() if name != "prompt"}
+    return encode_fields(fields), task.get("prompt")
+
+
+async def load_task(redis, task_id: str) -> Optional[Dict[str, Any]]:
+    """The whole stored task with its prompt, or None if it expired"""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hgetall(task_key(task_id))
+        pipe.get(task_prompt_key(task_id))
+        fields, prompt = await pipe.execute()
+    if not fields:
+        return None
+    task = decode_fields(fields.keys(), fields.values())
+    task["prompt"] = prompt.decode() if prompt is not None else ""
+    return task
+
+
+async def read_task_fields(redis, task_id: str, names: Iterable[str]) -> Dict[str, Any]:
+    """Just the named fields of a stored task; empty if it doesn't exist"""
+    names = list(names)
+    return decode_fields(names, await redis.hmget(task_key(task_id), names))
+
+
+async def update_task(redis, task_id: str, **fields):
+    """Overwrite fields of a stored task record"""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hset(task_key(task_id), mapping=encode_fields(fields))
+        pipe.expire(task_key(task_id), TASK_TTL)
+        pipe.expire(task_prompt_key(task_id), TASK_TTL)
+        await pipe.execute()
+
+
+async def ack_entry(redis, entry_id):
+    """Acknowledge a stream entry and drop it; nothing reads it again"""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.xack(INFERENCE_QUEUE, WORKER_GROUP, entry_id)
+        pipe.xdel(INFERENCE_QUEUE, entry_id)
+        await pipe.execute()
@@ -0,0 +1,208 @@
+"""
+Token counts for prompts, from each model's own tokenizer.
+
+The API counts prompt tokens to rate limit, price and bill requests, so
+counting sits on the request path. TokenCounter loads the fast (Rust)
+tokenizer of every MODEL_REGISTRY entry once, gathers the prompts of
+concurrent requests for a model into one encode_batch call run on a
+thread, off the event loop, and keeps the counts of recent prompts so a
+repeated prompt is not encoded again.
+
+Tokenizers come from TOKENIZER_DIR/{model_id}/tokenizer.json when that
+file exists, else from the model's Hugging Face repo (HF_TOKEN for gated
+ones). They load on threads of their own, so a slow or offline hub never
+holds up encoding, and a count waits at most TOKENIZER_LOAD_TIMEOUT for its
+model's tokenizer. A model whose tokenizer cannot be loaded, or is still
+loading, is counted at ESTIMATED_CHARS_PER_TOKEN characters per token;
+counts estimated while it loads are not cached.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_DIR = os.getenv("TOKENIZER_DIR", "")
+# Prompt counts kept in memory, least recently used dropped first
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "100000"))
+# How long the first prompt of a batch waits for others to join it
+TOKENIZE_BATCH_WINDOW_MS = float(os.getenv("TOKENIZE_BATCH_WINDOW_MS", "1"))
+TOKENIZE_MAX_BATCH = int(os.getenv("TOKENIZE_MAX_BATCH", "256"))
+TOKENIZE_THREADS = int(os.getenv("TOKENIZE_THREADS", "2"))
+# Seconds a count waits for its model's tokenizer to load before estimating
+TOKENIZER_LOAD_TIMEOUT = float(os.getenv("TOKENIZER_LOAD_TIMEOUT", "1"))
+# Fallback when a model's tokenizer is unavailable
+ESTIMATED_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / ESTIMATED_CHARS_PER_TOKEN)
+
+
+def load_tokenizer(model_id: str, path: str, tokenizer_dir: str = TOKENIZER_DIR):
+    """The model's fast tokenizer, or None if it cannot be loaded"""
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        logger.warning("tokenizers is not installed; token counts are estimated")
+        return None
+
+    local = os.path.join(tokenizer_dir, model_id, "tokenizer.json") if tokenizer_dir else ""
+    try:
+        if local and os.path.exists(local):
+            tokenizer = Tokenizer.from_file(local)
+        else:
+            tokenizer = Tokenizer.from_pretrained(path, auth_token=os.getenv("HF_TOKEN"))
+    except Exception as e:
+        logger.warning(f"No tokenizer for {model_id} ({e}); its token counts are estimated")
+        return None
+    # Counting needs neither padding nor truncation
+    tokenizer.no_padding()
+    tokenizer.no_truncation()
+    return tokenizer
+
+
+class TokenCounter:
+    """Batched, cached prompt token counts per model"""
+
+    def __init__(self, model_paths: Dict[str, str], cache_size: int = TOKEN_COUNT_CACHE_SIZE,
+                 batch_window_ms: float = TOKENIZE_BATCH_WINDOW_MS, max_batch: int = TOKENIZE_MAX_BATCH,
+                 threads: int = TOKENIZE_THREADS, tokenizer_dir: str = TOKENIZER_DIR,
+                 load_timeout: float = TOKENIZER_LOAD_TIMEOUT):
+        self.model_paths = model_paths
+        self.cache_size = cache_size
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.tokenizer_dir = tokenizer_dir
+        self.load_timeout = load_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="tokenize")
+        # One per model, so every tokenizer loads at once and none waits on encoding
+        self.load_executor = ThreadPoolExecutor(
+            max_workers=max(1, len(model_paths)), thread_name_prefix="tokenizer-load"
+        )
+        self.counts: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+        self._tokenizers: Dict[str, asyncio.Future] = {}
+        # Prompts waiting for the next batch of each model, by cache key
+        self._pending: Dict[str, Dict[Tuple[str, bytes], Tuple[str, asyncio.Future]]] = {}
+        self._flushers: Dict[str, asyncio.Task] = {}
+        self._flushing: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.batched_prompts = 0
+
+    async def start(self):
+        """Load every tokenizer in the background"""
+        for model_id in self.model_paths:
+            self._tokenizer(model_id)
+
+    async def stop(self):
+        for task in self._flushers.values():
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.load_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _tokenizer(self, model_id: str) -> asyncio.Future:
+        """Future of the model's tokenizer, loading it on first use"""
+        if model_id not in self._tokenizers:
+            loop = asyncio.get_running_loop()
+            self._tokenizers[model_id] = loop.run_in_executor(
+                self.load_executor, load_tokenizer, model_id, self.model_paths[model_id], self.tokenizer_dir
+            )
+        return self._tokenizers[model_id]
+
+    @staticmethod
+    def _key(model_id: str, text: str) -> Tuple[str, bytes]:
+        return model_id, hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    async def count(self, model_id: str, text: str) -> int:
+        """Tokens in text under model_id's tokenizer"""
+        key = self._key(model_id, text)
+        count = self.counts.get(key)
+        if count is not None:
+            self.counts.move_to_end(key)
+            self.hits += 1
+            return count
+        self.misses += 1
+
+        pending = self._pending.setdefault(model_id, {})
+        if key in pending:
+            # The same prompt is already waiting for this batch
+            return await asyncio.shield(pending[key][1])
+        future = asyncio.get_running_loop().create_future()
+        pending[key] = (text, future)
+        if len(pending) >= self.max_batch:
+            self._flush_now(model_id)
+        elif model_id not in self._flushers:
+            self._flushers[model_id] = asyncio.create_task(self._flush_later(model_id))
+        return await asyncio.shield(future)
+
+    async def count_many(self, model_id: str, texts: List[str]) -> List[int]:
+        return list(await asyncio.gather(*(self.count(model_id, text) for text in texts)))
+
+    async def _flush_later(self, model_id: str):
+        await asyncio.sleep(self.batch_window)
+        self._flushers.pop(model_id, None)
+        await self._flush(model_id)
+
+    def _flush_now(self, model_id: str):
+        flusher = self._flushers.pop(model_id, None)
+        if flusher:
+            flusher.cancel()
+        task = asyncio.create_task(self._flush(model_id))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, model_id: str):
+        batch = self._pending.pop(model_id, None)
+        if not batch:
+            return
+        self.batches += 1
+        self.batched_prompts += len(batch)
+        texts = [text for text, _ in batch.values()]
+        loading = self._tokenizer(model_id)
+        try:
+            try:
+                tokenizer = await asyncio.wait_for(asyncio.shield(loading), self.load_timeout)
+            except asyncio.TimeoutError:
+                tokenizer = None
+            if tokenizer is None:
+                counts = [estimate_tokens(text) for text in texts]
+            else:
+                encodings = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, tokenizer.encode_batch, texts
+                )
+                counts = [len(encoding.ids) for encoding in encodings]
+        except Exception as e:
+            for _, future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (key, (_, future)), count in zip(batch.items(), counts):
+            if loading.done():
+                self.counts[key] = count
+            if not future.done():
+                future.set_result(count)
+        while len(self.counts) > self.cache_size:
+            self.counts.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "cached_prompts": len(self.counts),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_prompts / self.batches if self.batches else 0.0,
+            "estimated_models": sorted(
+                model_id for model_id, future in self._tokenizers.items()
+                if future.done() and not future.exception() and future.result() is None
+            )
+        }
+
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Far Labs inference worker.
+
+Runs the admission scheduler, which moves queued requests onto the
+inference_queue stream once their model has a free node, and consumes that
+stream: each task is loaded from task:{id}, dispatched to the node
+reserved for it, the outcome is written back to task:{id} and the node is released in the shared
+registry.
+A node gets a deadline from the model's expected throughput; one that runs
+past it or fails is counted against the node's circuit breaker and the task
+is queued again for a different node. A task running slower than most
+recent ones is hedged onto a second node, and the first answer wins.
+Run as many worker processes as needed; they share the consumer group, and
+entries left unacknowledged by a dead worker are reclaimed after
+WORKER_CLAIM_IDLE_MS.
+
+    python worker.py
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import orjson
+from dotenv import load_dotenv
+from prometheus_client import start_http_server
+
+import metrics
+from admission import REQUEUED_PRIORITY, AdmissionQueue
+from node_manager import CIRCUIT_FAILURES, GPUNodeManager
+from prefix_affinity import remember_node
+from redis_pool import create_redis
+from response_cache import ResponseCache
+from task_events import publish_task_event
+from task_queue import (
+    INFERENCE_QUEUE,
+    WORKER_GROUP,
+    ack_entry,
+    dispatch_id,
+    ensure_worker_group,
+    load_task,
+    node_control_key,
+    node_inbox_key,
+    node_result_key,
+    update_task,
+)
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("inference_worker")
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+WORKER_NAME = os.getenv("WORKER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "8"))
+WORKER_CLAIM_IDLE_MS = int(os.getenv("WORKER_CLAIM_IDLE_MS", "60000"))
+WORKER_MAX_DELIVERIES = int(os.getenv("WORKER_MAX_DELIVERIES", "3"))
+NODE_TIMEOUT = float(os.getenv("NODE_TIMEOUT", "300"))
+# A node's deadline for a task: this much slack plus DISPATCH_SLOWDOWN times
+# the task's expected generation time, capped at NODE_TIMEOUT
+DISPATCH_GRACE_SECONDS = float(os.getenv("DISPATCH_GRACE_SECONDS", "10"))
+DISPATCH_SLOWDOWN = float(os.getenv("DISPATCH_SLOWDOWN", "3"))
+# Hedge a task once it runs longer than this percentile of recent dispatches
+# of its model (0 turns hedging off), after HEDGE_MIN_SAMPLES of them
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+
+def dispatch_deadline(task: Dict[str, Any], timeout: float = NODE_TIMEOUT) -> float:
+    """Seconds a node gets to answer a task"""
+    if not task.get("tokens_per_second"):
+        return timeout
+    expected = task["max_tokens"] / task["tokens_per_second"]
+    return min(timeout, DISPATCH_GRACE_SECONDS + expected * DISPATCH_SLOWDOWN)
+
+
+class LatencyTracker:
+    """Seconds per token of recent successful dispatches, per model"""
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES,
+                 window: int = 500):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, model_id: str, seconds: float, tokens: int):
+        samples = self.samples.setdefault(model_id, deque(maxlen=self.window))
+        samples.append(seconds / max(1, tokens))
+
+    def hedge_after(self, task: Dict[str, Any]) -> Optional[float]:
+        """Seconds after which the task is slower than the percentile, or None"""
+        samples = self.samples.get(task["model"], ())
+        if not self.percentile or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        per_token = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+        return per_token * task["max_tokens"]
+
+
+class NodeDispatcher:
+    """Hands a task to its GPU node through Redis and waits for the reply"""
+
+    def __init__(self, redis_client, timeout: float = NODE_TIMEOUT):
+        self.redis = redis_client
+        self.timeout = timeout
+
+    async def dispatch(self, task: Dict[str, Any], on_text=None, timeout: Optional[float] = None,
+                       request_id: Optional[str] = None) -> Dict[str, Any]:
+        """Send a task to its node and return the node's result
+
+        Node messages arrive on node_result:{request_id} in the same shape
+        the node client sends over its websocket: inference_token messages
+        while a streaming request runs, then one inference_response. A node
+        that doesn't answer within timeout gives an error with timed_out set.
+        """
+        request_id = request_id or task["id"]
+        timeout = self.timeout if timeout is None else timeout
+        await self.redis.rpush(node_inbox_key(task["node_id"]), orjson.dumps({
+            "type": "inference_request",
+            "request_id": request_id,
+            "request": {
+                "model": task["model"],
+                "prompt": task["prompt"],
+                "max_tokens": task["max_tokens"],
+                "temperature": task["temperature"],
+                "top_p": task["top_p"],
+                "stream": task.get("stream", False),
+                "profile": task.get("profile")
+            }
+        }))
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            reply = None
+            if remaining > 0:
+                reply = await self.redis.blpop(node_result_key(request_id), timeout=remaining)
+            if reply is None:
+                return {"error": f"Node {task['node_id']} did not respond within {timeout:.0f}s", "timed_out": True}
+
+            message = orjson.loads(reply[1])
+            if message.get("type") == "inference_token":
+                if on_text:
+                    await on_text(message["text"], message["index"])
+                continue
+            return message.get("result", {"error": "Malformed node response"})
+
+    async def cancel(self, node_id: str, request_id: str):
+        """Tell a node to drop a request and discard whatever it already sent"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(node_control_key(node_id), orjson.dumps({"type": "cancel", "request_id": request_id}))
+            pipe.delete(node_result_key(request_id))
+            await pipe.execute()
+
+
+class InferenceWorker:
+    def __init__(
+        self,
+        redis_client,
+        dispatcher,
+        name: str = WORKER_NAME,
+        concurrency: int = WORKER_CONCURRENCY,
+        claim_idle_ms: int = WORKER_CLAIM_IDLE_MS,
+        max_deliveries: int = WORKER_MAX_DELIVERIES,
+        block_ms: int = 5000,
+        schedule: bool = True,
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        circuit_failures: int = CIRCUIT_FAILURES
+    ):
+        self.redis = redis_client
+        self.dispatcher = dispatcher
+        self.name = name
+        self.concurrency = concurrency
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.block_ms = block_ms
+        self.schedule = schedule
+        self.response_cache = ResponseCache(redis_client)
+        self.node_manager = GPUNodeManager(redis_client, circuit_failures=circuit_failures)
+        self.admission = AdmissionQueue(redis_client, node_manager=self.node_manager)
+        self.latencies = LatencyTracker(hedge_percentile)
+        self.stop_event = asyncio.Event()
+        self.tasks_processed = 0
+
+    async def run(self):
+        """Run consumer loops until stop() is called"""
+        await ensure_worker_group(self.redis)
+        logger.info(f"Worker {self.name} consuming {INFERENCE_QUEUE} with concurrency {self.concurrency}")
+        loops = [self._consume(f"{self.name}-{i}") for i in range(self.concurrency)]
+        if self.schedule:
+            loops.append(self._schedule())
+        await asyncio.gather(*loops)
+
+    def stop(self):
+        self.stop_event.set()
+
+    async def _schedule(self):
+        async def on_expired(task: Dict[str, Any]):
+            logger.warning(f"Task {task['id']} expired waiting for a {task['model']} node")
+            await self._fail(task, "Timed out waiting for an available GPU node")
+
+        scheduler = asyncio.create_task(self.admission.run_scheduler(on_expired))
+        await self.stop_event.wait()
+        scheduler.cancel()
+        await asyncio.gather(scheduler, return_exceptions=True)
+
+    async def _consume(self, consumer: str):
+        last_claim = 0.0
+        while not self.stop_event.is_set():
+            try:
+                entries = []
+                # Reclaim work abandoned by crashed consumers before taking new work
+                if time.monotonic() - last_claim >= self.claim_idle_ms / 2000:
+                    last_claim = time.monotonic()
+                    entries = await self._claim_stale(consumer)
+                if not entries:
+                    entries = await self._read_new(consumer)
+
+                for entry_id, fields in entries:
+                    await self.handle_entry(entry_id, fields)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker {consumer} error: {e}")
+                await asyncio.sleep(1)
+
+    async def _read_new(self, consumer: str) -> List[Tuple[bytes, dict]]:
+        response = await self.redis.xreadgroup(
+            WORKER_GROUP, consumer, {INFERENCE_QUEUE: ">"},
+            count=1, block=self.block_ms
+        )
+        return response[0][1] if response else []
+
+    async def _claim_stale(self, consumer: str) -> List[Tuple[bytes, dict]]:
+        response = await self.redis.xautoclaim(
+            INFERENCE_QUEUE, WORKER_GROUP, consumer,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=1
+        )
+        return [entry for entry in response[1] if entry[1]]
+
+    async def _delivery_count(self, entry_id) -> int:
+        pending = await self.redis.xpending_range(
+            INFERENCE_QUEUE, WORKER_GROUP, min=entry_id, max=entry_id, count=1
+        )
+        return pending[0]["times_delivered"] if pending else 1
+
+    async def handle_entry(self, entry_id, fields: dict):
+        """Process one stream entry and acknowledge it"""
+        task_id = fields[b"task_id"].decode()
+        task = await load_task(self.redis, task_id)
+        if task is None:
+            logger.warning(f"Task {task_id} expired before a worker took it")
+            await ack_entry(self.redis, entry_id)
+            return
+        task["node_id"] = fields.get(b"node_id", b"").decode() or task.get("node_id")
+        task["request_id"] = fields.get(b"request_id", b"").decode() or dispatch_id(task)
+
+        if (await self._delivery_count(entry_id) > self.max_deliveries or
+                task.get("requeues", 0) > self.max_deliveries):
+            logger.error(f"Task {task_id} exceeded {self.max_deliveries} deliveries, giving up")
+            await self._finish(entry_id, task, {"error": "Task exceeded maximum delivery attempts"}, outcome="")
+            return
+
+        if not task["node_id"]:
+            await self._finish(entry_id, task, {"error": "No GPU node was assigned to the task"})
+            return
+
+        await update_task(self.redis, task_id, status="processing", node_id=task["node_id"],
+                          worker=self.name, started_at=datetime.now().isoformat())
+        await publish_task_event(self.redis, task_id, "status", status="processing", progress=0.0)
+        if task.get("created_at"):
+            waited = datetime.now() - datetime.fromisoformat(task["created_at"])
+            metrics.observe_stage("queue_wait", waited.total_seconds())
+
+        async def on_text(text: str, index: int):
+            await publish_task_event(self.redis, task_id, "token", index=index, text=text)
+
+        started = time.perf_counter()
+        result, task["node_id"], task["request_id"] = await self._dispatch(task, on_text)
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage("generation", elapsed)
+        if "error" not in result:
+            metrics.record_generation(task["model"], task["node_id"], result.get("tokens_generated", 0), elapsed)
+            await self._record_timings(task, result.get("timings") or {})
+        # A lost node says nothing about the task; other failures get a few
+        # more tries on other nodes before the error is final
+        elif result.get("node_lost") or task.get("requeues", 0) < self.max_deliveries:
+            await self._requeue(entry_id, task, result)
+            return
+        await self._finish(entry_id, task, result)
+
+    async def _dispatch(self, task: Dict[str, Any], on_text) -> Tuple[Dict[str, Any], str, str]:
+        """Run the task on its node, hedged onto a second node if it runs slow
+
+        Once the task has run past the hedge threshold without streaming any
+        text, a duplicate goes to the best other free node. The first success
+        wins and the other attempt is cancelled, while a failure is only
+        returned once no other attempt is left running. Returns the result
+        with the node and request id it came from.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = dispatch_deadline(task, self.dispatcher.timeout)
+        hedge_after = self.latencies.hedge_after(task)
+        attempts: Dict[asyncio.Task, Tuple[str, str, float]] = {}
+        pending = set()
+        streaming = None
+
+        def attempt(node_id: str, request_id: str):
+            async def emit(text: str, index: int):
+                nonlocal streaming
+                # Only one attempt's text reaches the client
+                streaming = streaming or request_id
+                if streaming == request_id:
+                    await on_text(text, index)
+
+            running = asyncio.create_task(
+                self.dispatcher.dispatch({**task, "node_id": node_id}, emit, deadline, request_id)
+            )
+            attempts[running] = (node_id, request_id, loop.time())
+            pending.add(running)
+
+        attempt(task["node_id"], task["request_id"])
+        try:
+            while True:
+                hedge = hedge_after is not None and len(attempts) == 1
+                done, pending = await asyncio.wait(
+                    pending, timeout=hedge_after if hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedge_after = None
+                    hedge_id = f"{task['request_id']}~hedge"
+                    if streaming is None:
+                        node_id = await self.node_manager.select_best_node(
+                            task["model"], hedge_id, exclude=[task["node_id"]]
+                        )
+                        if node_id:
+                            logger.info(f"Task {task['id']} running slow on {task['node_id']}, hedging on {node_id}")
+                            attempt(node_id, hedge_id)
+                    continue
+
+                # Take one at a time; any others come straight back next round
+                finished = done.pop()
+                pending |= done
+                node_id, request_id, attempt_started = attempts[finished]
+                result = finished.result()
+                if "error" not in result:
+                    self.latencies.observe(task["model"], loop.time() - attempt_started,
+                                           result.get("tokens_generated", 0))
+                    if len(attempts) > 1:
+                        outcome = "lost" if request_id == task["request_id"] else "won"
+                        metrics.HEDGES.labels(task["model"], outcome).inc()
+                    return result, node_id, request_id
+
+                await self._dispatch_failed(task, node_id, request_id, result)
+                if not pending:
+                    return result, node_id, request_id
+                await self.node_manager.release_node(node_id, request_id, "" if result.get("node_lost") else "failed")
+        finally:
+            for running in pending:
+                running.cancel()
+                node_id, request_id, _ = attempts[running]
+                await self.dispatcher.cancel(node_id, request_id)
+                await self.node_manager.release_node(node_id, request_id, "")
+
+    async def _dispatch_failed(self, task: Dict[str, Any], node_id: str, request_id: str, result: Dict[str, Any]):
+        """Count a failed attempt against its node"""
+        reason = "node_lost" if result.get("node_lost") else "timeout" if result.get("timed_out") else "error"
+        metrics.DISPATCH_FAILURES.labels(task["model"], reason).inc()
+        logger.warning(f"Task {task['id']} failed on node {node_id}: {result['error']}")
+        if result.get("timed_out"):
+            # The node may still be working on it
+            await self.dispatcher.cancel(node_id, request_id)
+        if not result.get("node_lost"):
+            await self.node_manager.update_node_score(node_id, {}, task.get("tokens_per_second"), accuracy=0)
+
+    async def _record_timings(self, task: Dict[str, Any], timings: Dict[str, float]):
+        """Export node-reported stage timings and score the node on its throughput"""
+        for stage in ("queue_wait", "tokenize", "prefill", "detokenize"):
+            if f"{stage}_ms" in timings:
+                metrics.observe_stage(f"node_{stage}", timings[f"{stage}_ms"] / 1000)
+        if timings.get("decode_tokens_per_second"):
+            await self.node_manager.update_node_score(task["node_id"], timings, task.get("tokens_per_second"))
+
+    async def _requeue(self, entry_id, task: Dict[str, Any], result: Dict[str, Any]):
+        """Put a task whose node failed, stalled or went away back on the queue"""
+        logger.info(f"Re-queueing task {task['id']} after it failed on node {task['node_id']}")
+        # A disconnected node is still registered and holds the task's slot
+        await self.node_manager.release_node(task["node_id"], task.pop("request_id"),
+                                             "" if result.get("node_lost") else "failed")
+        # Admission prefers nodes the task hasn't been tried on
+        excluded = task.get("excluded_nodes", []) + [task["node_id"]]
+        task.update(node_id=None, status="queued", requeues=task.get("requeues", 0) + 1, excluded_nodes=excluded)
+        # Ahead of new arrivals, and not subject to the queue limit
+        await self.admission.enqueue(task, REQUEUED_PRIORITY, limit=2**31)
+        metrics.TASKS.labels(task["model"], "requeued").inc()
+        await publish_task_event(self.redis, task["id"], "status", status="queued", progress=0.0)
+        await ack_entry(self.redis, entry_id)
+
+    async def _finish(self, entry_id, task: Dict[str, Any], result: Dict[str, Any], outcome: Optional[str] = None):
+        # The node is free as soon as it has answered
+        if task.get("node_id"):
+            if outcome is None:
+                outcome = "failed" if "error" in result else "ok"
+            await self.node_manager.release_node(task["node_id"], task["request_id"], outcome)
+
+        if "error" in result:
+            await self._fail(task, result["error"])
+        else:
+            # Billed on the API's count: the node's comes from its local
+            # tokenizer, after truncation, and is the provider's to report
+            prompt_tokens = task.get("prompt_tokens", 0)
+            if result.get("prompt_tokens") not in (None, prompt_tokens):
+                # Expected when the node serves the model with another tokenizer
+                logger.debug(
+                    f"Node {task['node_id']} counted {result['prompt_tokens']} prompt tokens for task "
+                    f"{task['id']}, the API {prompt_tokens}"
+                )
+            completion_tokens = result.get("tokens_generated", 0)
+            tokens_used = prompt_tokens + completion_tokens
+            await update_task(
+                self.redis, task["id"],
+                status="completed",
+                progress=1.0,
+                result=result.get("response"),
+                prompt_tokens=prompt_tokens,
+                tokens_generated=completion_tokens,
+                tokens_used=tokens_used,
+                cost=(tokens_used / 1_000_000) * task.get("price_per_1m_tokens", 0),
+                timings=result.get("timings"),
+                profile_report=result.get("profile"),
+                completed_at=datetime.now().isoformat()
+            )
+            await publish_task_event(
+                self.redis, task["id"], "result",
+                status="completed", progress=1.0, tokens=tokens_used, result=result.get("response")
+            )
+            metrics.TASKS.labels(task["model"], "completed").inc()
+            if task.get("prefix_key"):
+                await remember_node(self.redis, task["prefix_key"], task["node_id"])
+            if task.get("cache_key"):
+                await self.response_cache.store(
+                    task["cache_key"], task["id"], result.get("response"), completion_tokens
+                )
+
+        await ack_entry(self.redis, entry_id)
+        self.tasks_processed += 1
+        logger.info(f"Task {task['id']} finished on {task['node_id']}")
+
+    async def _fail(self, task: Dict[str, Any], error: str):
+        await update_task(self.redis, task["id"], status="failed", error=error,
+                          completed_at=datetime.now().isoformat())
+        await publish_task_event(self.redis, task["id"], "error", status="failed", error=error)
+        metrics.TASKS.labels(task["model"], "failed").inc()
+        if task.get("cache_key"):
+            await self.response_cache.release(task["cache_key"], task["id"])
+
+
+async def main():
+    if metrics.METRICS_ENABLED:
+        start_http_server(metrics.WORKER_METRICS_PORT)
+
+    redis_client = create_redis(REDIS_URL)
+    worker = InferenceWorker(redis_client, NodeDispatcher(redis_client))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await redis_client.close()
+        logger.info(f"Worker {worker.name} stopped after {worker.tasks_processed} tasks")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
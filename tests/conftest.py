@@ -0,0 +1,12 @@
+"""
+Tests run the benchmarks' in-process platform (benchmarks/harness.py) and
+stub node, on fakeredis, so they need no Redis, GPU or model weights.
+"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT / "benchmarks", ROOT / "services" / "inference"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
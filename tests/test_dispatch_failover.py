@@ -0,0 +1,24 @@
+import asyncio
+
+import httpx
+
+import worker
+from dispatch_failover import run_requests
+from harness import platform
+
+
+async def run_with_crash(requests: int):
+    # The first node crashes with requests in flight; the others are healthy
+    faults = [{"die_after": 4}]
+    async with platform(nodes=3, node_channel="json", node_faults=faults) as (base_url, _):
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            return await run_requests(client, requests, concurrency=8, tokens=16)
+
+
+def test_no_failed_tasks_when_node_dies_mid_dispatch(monkeypatch):
+    # Tasks sent to the crashed node after it went away time out quickly
+    monkeypatch.setattr(worker, "DISPATCH_GRACE_SECONDS", 1.0)
+
+    _, _, failed = asyncio.run(run_with_crash(requests=40))
+
+    assert failed == 0
@@ -0,0 +1,24 @@
+import asyncio
+import statistics
+
+from node_responsiveness import measure
+
+GENERATION_SECONDS = 1.0
+
+
+def test_pings_answered_during_generation():
+    # Model work runs on the inference executor, so the event loop keeps
+    # answering pings while the generation runs
+    rtts = asyncio.run(measure(inline=False, generation_seconds=GENERATION_SECONDS, ping_interval=0.05))
+
+    assert len(rtts) >= 10
+    assert statistics.median(rtts) < 25
+    assert max(rtts) < GENERATION_SECONDS * 1000 / 4
+
+
+def test_inline_generation_blocks_pings():
+    # The baseline the executor is there to avoid: a ping sent during the
+    # generation waits for all of it
+    rtts = asyncio.run(measure(inline=True, generation_seconds=GENERATION_SECONDS, ping_interval=0.05))
+
+    assert max(rtts) > GENERATION_SECONDS * 1000 / 2
@@ -0,0 +1,28 @@
+import asyncio
+import statistics
+
+import httpx
+
+from harness import platform
+from streaming_ttft import ttft_polling, ttft_streaming
+
+TOKENS = 64
+SECONDS_PER_TOKEN = 0.01
+
+
+async def measure(requests: int = 3):
+    # Sampled, so the result cache never answers and every request generates
+    body = {"model_id": "llama-70b", "prompt": "Hello " * 32, "max_tokens": TOKENS, "temperature": 0.7}
+    async with platform(nodes=2, seconds_per_token=SECONDS_PER_TOKEN) as (base_url, _):
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            polling = [await ttft_polling(client, body) for _ in range(requests)]
+            streaming = [await ttft_streaming(client, body) for _ in range(requests)]
+    return statistics.median(polling), statistics.median(streaming)
+
+
+def test_streaming_first_token_beats_polling():
+    polling, streaming = asyncio.run(measure())
+
+    # Polling sees nothing until all TOKENS are generated
+    assert polling >= TOKENS * SECONDS_PER_TOKEN
+    assert streaming < polling / 4